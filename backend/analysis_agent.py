@@ -1,15 +1,16 @@
+import asyncio
 import pandas as pd
-import numpy as np
+import orjson
 import os
+import time
 import uuid
 import re
 from dotenv import load_dotenv
-from typing import Dict, Optional, List, Literal
-from pydantic import SecretStr
+from typing import AsyncIterator, Dict, Optional, List, Literal, Tuple
+from pydantic import BaseModel, Field, SecretStr
 from langchain_openai import ChatOpenAI
 from langchain_experimental.agents import create_pandas_dataframe_agent
 from langgraph.graph import StateGraph, START, END
-from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.messages import (
     AIMessage,
     HumanMessage,
@@ -17,42 +18,105 @@ from langchain_core.messages import (
     trim_messages,
 )
 from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import var_child_runnable_config
+from dataset_store import dataset_store, DatasetSource, RequestDatasetLoader
+from worker_pool import analysis_pool
+from route_classifier import ROUTER_MODE, classify_locally, record_route
+from result_cache import result_cache, result_cache_key
+from result_store import result_store, RESULT_INLINE_ROWS
+from llm_cache import with_cache
+from serialization import RawJSON, json_safe_columns, records_json, result_frame
+from result_transform import normalize_result
+from result_digest import digest_result
+from dataset_profile import format_profiles
+from duckdb_engine import SQLSession, query_error_details, table_name
+from code_executor import CodeExecutionError, code_executor, describe_error
+from session_store import session_checkpointer
+import metrics
+from instrumentation import RequestTimings, instrument_node, measure, request_timings
 load_dotenv()
 
+# Cached datasets are shared between turns and nodes as shallow views; copy-on-write
+# keeps in-place edits made by generated code from leaking back into the cache.
+pd.set_option("mode.copy_on_write", True)
+
 # Define the state
 class AgentState(Dict):
     route: Literal["analysis", "chat"]
     history_messages: Optional[List[Dict]] = None # store all messages
     file_paths: Optional[List[str]] = None # store all file paths
+    session_id: Optional[str] = None # session id, used to look up cached datasets
+    datasets: Optional[List[Dict]] = None # dataset refs of the session: [{"name", "hash"}]
     user_prompt: Optional[str] = None # user prompt
     raw_output: Optional[str] = None#LLM output
     exec_code: Optional[str] = None#code after analysis
-    analysis_dataframe_dict: Optional[Dict] = None#dataframe after analysis
+    analysis_data_json: Optional[str] = None#inline rows of the result table, as records JSON text
+    result_id: Optional[str] = None#id of the full result table in the result store
+    result_total_rows: Optional[int] = None#row count of the full result table
     filtered_data_summary: Optional[str] = None#summary of filtered data
     error: Optional[str] = None#error message
+    analysis_retries: Optional[int] = None#times the generated code was sent back to be fixed in this request
+    retry_analysis: Optional[bool] = None#execution failed and the analysis node should fix the code
 
 api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     raise ValueError("OPENAI_API_KEY environment variable is not set")
 llm = ChatOpenAI(model="gpt-4o-mini", api_key=SecretStr(api_key))
+# per-node copies of the model, each with its own response cache setting (LLM_CACHE_NODES)
+router_llm = with_cache(llm, "router")
+analysis_llm = with_cache(llm, "analysis")
+summary_llm = with_cache(llm, "summary")
+chat_llm = with_cache(llm, "chat")
+combined_llm = with_cache(llm, "combined")
 
 #clean up node
 def clean_up_node(state: AgentState) -> AgentState:
     state["raw_output"] = None
     state["exec_code"] = None
-    state["analysis_dataframe_dict"] = None
+    state["analysis_data_json"] = None
+    state["result_id"] = None
+    state["result_total_rows"] = None
     state["filtered_data_summary"] = None
     state["error"] = None
-    # keep history_messages, file_paths, user_prompt
+    state["analysis_retries"] = 0
+    state["retry_analysis"] = False
+    # keep history_messages, file_paths, user_prompt, session_id, datasets
     return state
 
+def _dataset_loader(state: AgentState, config: Optional[RunnableConfig]) -> RequestDatasetLoader:
+    """The request-scoped dataset loader from the run config (a fresh one outside a graph run)."""
+    loader = (config or {}).get("configurable", {}).get("dataset_loader")
+    if loader is None:
+        loader = RequestDatasetLoader(dataset_store, state["session_id"])
+    return loader
+
+def load_session_frames(state: AgentState, config: Optional[RunnableConfig] = None) -> Optional[List[pd.DataFrame]]:
+    """Fetch the session's DataFrames through the request-scoped loader in the run config."""
+    if not state.get("datasets"):
+        return None
+    loader = _dataset_loader(state, config)
+    return loader.get_frames(state["datasets"])
+
+def load_session_profiles(state: AgentState, config: Optional[RunnableConfig] = None) -> Optional[List[Dict]]:
+    """Fetch the upload-time profiles of the session's datasets (no frames are touched)."""
+    if not state.get("datasets"):
+        return None
+    loader = _dataset_loader(state, config)
+    return loader.get_profiles(state["datasets"])
+
+DATASETS_EXPIRED_ERROR = "Session datasets have expired. Please upload the files again."
+
 # 修改input_node以接受外部传入的文件路径和prompt
 # 注意：此函数已不再使用，逻辑已移至run_analysis函数中
 
 #router node
-def router_node(state: AgentState) -> AgentState:
-    
-    prompt = f"""You are a data analysis assistant.
+# Speculative routing (async graph only): when the router has to ask the LLM and the session has datasets,
+# the analysis call starts at the same time and is kept only if the route turns out to be "analysis".
+ROUTER_SPECULATIVE = os.getenv("ROUTER_SPECULATIVE", "false").lower() in ("1", "true", "yes")
+
+def _router_prompt(state: AgentState) -> str:
+    return f"""You are a data analysis assistant.
     You will receive a user's question.
     
     Context:
@@ -64,202 +128,395 @@ def router_node(state: AgentState) -> AgentState:
 
     Respond with either "analysis" or "chat".
     """
-    
-    result = llm.invoke([HumanMessage(content=prompt)]).content.strip().lower()
-    if "analysis" in result:
+
+def _local_route(state: AgentState, config: RunnableConfig) -> Optional[str]:
+    """Try the local classifier tiers; returns None when the LLM has to decide."""
+    profiles = load_session_profiles(state, config) or []
+    column_names = [column["name"] for profile in profiles for column in profile["columns"]]
+    decision = classify_locally(state["user_prompt"], bool(state.get("datasets")), column_names)
+    if decision.route:
+        record_route(state["user_prompt"], decision.route, decision.tier)
+    return decision.route
+
+def _apply_route(state: AgentState, result: str) -> AgentState:
+    if "analysis" in result.strip().lower():
         state["route"] = "analysis"
     else:
         state["route"] = "chat"
+    record_route(state["user_prompt"], state["route"], "llm")
+    return state
+
+def router_node(state: AgentState, config: RunnableConfig) -> AgentState:
+    route = _local_route(state, config)
+    if route:
+        state["route"] = route
+        return state
+    if ROUTER_MODE == "combined":
+        messages = _combined_messages(state, config)
+        if messages is not None:
+            return _apply_combined_output(state, _combined_model().invoke(messages))
+    result = router_llm.invoke([HumanMessage(content=_router_prompt(state))]).content
+    return _apply_route(state, result)
+
+async def router_node_async(state: AgentState, config: RunnableConfig) -> AgentState:
+    route = _local_route(state, config)
+    if route:
+        state["route"] = route
+        return state
+    if ROUTER_MODE == "combined":
+        messages = _combined_messages(state, config)
+        if messages is not None:
+            return _apply_combined_output(state, await _combined_model().ainvoke(messages))
+    if ROUTER_SPECULATIVE and state.get("datasets"):
+        return await _route_with_speculative_analysis(state, config)
+    result = (await router_llm.ainvoke([HumanMessage(content=_router_prompt(state))])).content
+    return _apply_route(state, result)
+
+async def _route_with_speculative_analysis(state: AgentState, config: RunnableConfig) -> AgentState:
+    """
+    Ask the router LLM while the analysis call already runs on a copy of the state.
+
+    On "analysis" the speculative output is applied here and analysis_node skips its own call;
+    on "chat" the analysis is cancelled (or discarded if it already finished) and counted as wasted work.
+    """
+    speculative_state = AgentState(state)
+    started = time.perf_counter()
+    task = asyncio.ensure_future(_speculative_analysis(speculative_state, config))
+    try:
+        result = (await router_llm.ainvoke([HumanMessage(content=_router_prompt(state))])).content
+    except BaseException:
+        task.cancel()
+        # wait for the cancelled task so it never outlives the request (gather absorbs its CancelledError)
+        await asyncio.gather(task, return_exceptions=True)
+        raise
+    _apply_route(state, result)
+
+    if state["route"] == "analysis":
+        raw_output = await task
+        metrics.inc("speculative_analysis_total", outcome="used")
+        if speculative_state.get("error"):
+            state["error"] = speculative_state["error"]
+        elif raw_output is not None:
+            _apply_analysis_output(state, raw_output)
+        return state
+
+    outcome = "discarded" if task.done() else "cancelled"
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    metrics.inc("speculative_analysis_total", outcome=outcome)
+    metrics.inc("speculative_analysis_wasted_seconds_total", time.perf_counter() - started)
     return state
 
+async def _speculative_analysis(state: AgentState, config: RunnableConfig) -> Optional[str]:
+    # Runs in its own task, so this only affects the speculative calls: attribute them to the analysis node
+    # rather than the router that started them (the agent chain reads the parent config from this variable).
+    parent = var_child_runnable_config.get() or config
+    var_child_runnable_config.set({**parent, "metadata": {**parent.get("metadata", {}), "langgraph_node": "analysis"}})
+    with measure("speculative_analysis"):
+        try:
+            return await _generate_analysis_async(state, config)
+        except Exception as e:
+            state["error"] = f"analysis failed: {str(e)}"
+            return None
+
 def extract_code_blocks(text:str):
     code_blocks = re.findall(r"```(?:python)?\n(.*?)```", text, re.DOTALL)
     return code_blocks[0] if code_blocks else ""
 
-def analysis_node(state: AgentState) -> AgentState:
-    if state.get("error"):
-        return state
-    
-    # 检查是否有文件路径
-    if not state.get("file_paths") or len(state["file_paths"]) == 0:
+def extract_sql_query(text: str) -> str:
+    sql_blocks = re.findall(r"```(?:sql)?\n(.*?)```", text, re.DOTALL | re.IGNORECASE)
+    if sql_blocks:
+        return sql_blocks[0].strip()
+    # the model sometimes answers with the bare query
+    stripped = text.strip()
+    return stripped if re.match(r"(select|with)\b", stripped, re.IGNORECASE) else ""
+
+# "pandas": the model writes Python that is exec'd; "sql": the model writes one DuckDB query
+ANALYSIS_ENGINE = os.getenv("ANALYSIS_ENGINE", "pandas").lower()
+# pandas engine only. "agent": the pandas agent explores the data with tool calls before answering;
+# "direct": one prompt with the dataset profiles returns the final code
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "agent").lower()
+# cap on the pandas agent's tool-calling iterations (each is an LLM round-trip)
+ANALYSIS_AGENT_MAX_ITERATIONS = int(os.getenv("ANALYSIS_AGENT_MAX_ITERATIONS", "5"))
+# direct / sql modes: how many times failing code is sent back to the model with its traceback
+ANALYSIS_MAX_RETRIES = int(os.getenv("ANALYSIS_MAX_RETRIES", "1"))
+
+def _single_call_analysis() -> bool:
+    """Whether the analysis is one plain LLM call (SQL engine or direct mode) rather than the pandas agent."""
+    return ANALYSIS_ENGINE == "sql" or ANALYSIS_MODE == "direct"
+
+SQL_ANALYSIS_PROMPT = """You are a data analysis assistant that answers questions about the user's datasets by writing a single DuckDB SQL query.
+
+The datasets are available as the following tables (dtype, cardinality, null rate, range or sample values):
+{schema}
+
+Rules:
+- Reply with exactly one read-only query (SELECT or WITH ... SELECT) in a ```sql code block and nothing else.
+- Only use the tables and columns listed above; double-quote column names that contain spaces, upper-case letters or special characters.
+- Aggregate, filter and sort in SQL and return only the rows and columns needed to answer the question.
+"""
+
+DIRECT_ANALYSIS_PROMPT = """You are a data analysis assistant that answers questions about the user's datasets by writing Python/pandas code.
+
+The datasets are available as the following DataFrames (dtype, cardinality, null rate, range or sample values), precomputed from the full data:
+{schema}
+
+Rules:
+- Reply with exactly one ```python code block and nothing else.
+- The DataFrames are available ONLY as the list `dfs` (dfs[0], dfs[1], ...) together with `pd`; no other variables exist.
+- The last line MUST assign the actual answer (DataFrame, Series, list, dict or single value) to `result`; never None.
+- Do not print or plot, just compute `result`.
+"""
+
+RETRY_PROMPT = """The {kind} above failed when it was executed:
+{traceback}
+
+Fix the {kind} and reply with the corrected version only."""
+
+def _agent_inputs(state: AgentState, config: RunnableConfig) -> Optional[Tuple[List[pd.DataFrame], List[Dict]]]:
+    """Load the DataFrames and profiles the pandas agent works on, or set state["error"] and return None.
+
+    Blocking (Arrow restores, DuckDB sampling of out-of-core datasets): the async graph runs it on the thread pool.
+    """
+    # 检查会话中是否有数据集
+    if not state.get("datasets"):
         state["error"] = "No files provided for analysis. Please upload files first or use chat mode for general questions."
-        return state
+        return None
     
-    dfs = []
-    for file_path in state["file_paths"]:
-            if file_path.endswith(".csv"):
-                df = pd.read_csv(file_path)
-            elif file_path.endswith(".xlsx"):
-                df = pd.read_excel(file_path)
-            else:
-                raise ValueError(f"Unsupported file type: {file_path}")
-            dfs.append(df)
-  
-    agent = create_pandas_dataframe_agent(
-        llm, dfs, verbose=True, allow_dangerous_code=True,
+    dfs = load_session_frames(state, config)
+    profiles = load_session_profiles(state, config)
+    if dfs is None or profiles is None:
+        state["error"] = DATASETS_EXPIRED_ERROR
+        return None
+    return dfs, profiles
+
+def _analysis_agent(state: AgentState, config: RunnableConfig):
+    """Build the pandas agent over the session's DataFrames, or set state["error"] and return None."""
+    inputs = _agent_inputs(state, config)
+    if inputs is None:
+        return None
+    return _build_agent(state, *inputs)
+
+def _build_agent(state: AgentState, dfs: List[pd.DataFrame], profiles: List[Dict]):
+    return create_pandas_dataframe_agent(
+        analysis_llm, dfs, verbose=True, allow_dangerous_code=True,
         agent_type="openai-tools", return_intermediate_steps=True,
+        max_iterations=ANALYSIS_AGENT_MAX_ITERATIONS,
+        suffix=_schema_suffix(state, profiles),
     )
+
+def _agent_output(invoke_result: Dict) -> str:
+    """The agent's final answer; raises when it hit the iteration cap without writing any code."""
+    output = invoke_result["output"]
+    if len(invoke_result.get("intermediate_steps", [])) >= ANALYSIS_AGENT_MAX_ITERATIONS and not extract_code_blocks(output):
+        metrics.inc("analysis_agent_iteration_limit_total")
+        raise RuntimeError(f"the agent stopped after {ANALYSIS_AGENT_MAX_ITERATIONS} iterations without writing code")
+    return output
+
+def _schema_suffix(state: AgentState, profiles: List[Dict]) -> str:
+    """Inject the precomputed dataset profiles so the agent does not have to inspect columns itself."""
+    schema = format_profiles([ref["name"] for ref in state["datasets"]], profiles)
+    # the agent formats the suffix with dfs_head, so literal braces have to be escaped
+    schema = schema.replace("{", "{{").replace("}", "}}")
+    return f"""
+
+Column profile of each dataframe (dtype, cardinality, null rate, range or sample values), precomputed from the full data:
+{schema}
+
+This is the result of `print(df.head())` for each dataframe:
+{{dfs_head}}"""
+
+def _analysis_messages(state: AgentState, config: RunnableConfig) -> Optional[List]:
+    """Messages for a single-call analysis: the schema prompt plus the conversation, or None after setting state["error"]."""
+    if not state.get("datasets"):
+        state["error"] = "No files provided for analysis. Please upload files first or use chat mode for general questions."
+        return None
+    profiles = load_session_profiles(state, config)
+    if profiles is None:
+        state["error"] = DATASETS_EXPIRED_ERROR
+        return None
+    names = [ref["name"] for ref in state["datasets"]]
+    if ANALYSIS_ENGINE == "sql":
+        schema = format_profiles(names, profiles, table_names=[table_name(i) for i in range(len(profiles))])
+        prompt = SQL_ANALYSIS_PROMPT.format(schema=schema)
+    else:
+        prompt = DIRECT_ANALYSIS_PROMPT.format(schema=format_profiles(names, profiles))
+    # the general system prompt is replaced by the focused one above
+    history = [m for m in state["history_messages"] if not isinstance(m, SystemMessage)]
+    return [SystemMessage(prompt)] + history
+
+def _apply_analysis_output(state: AgentState, raw_output: str) -> AgentState:
+    state["raw_output"] = raw_output
+
+    # trim history messages
+    state["history_messages"].append(AIMessage(raw_output))#raw_output is code here
+    state["history_messages"] = trim_messages(
+        state["history_messages"],
+        strategy="last",
+        max_tokens=30000,
+        token_counter=count_tokens_approximately
+        ) 
     
+    state["exec_code"] = extract_sql_query(raw_output) if ANALYSIS_ENGINE == "sql" else extract_code_blocks(raw_output)
+    return state
+
+def analysis_node(state: AgentState, config: RunnableConfig) -> AgentState:
+    if state.get("error"):
+        return state
+    if state.get("raw_output") is not None:
+        # already produced by the combined routing call in the router node
+        return state
+    if _single_call_analysis():
+        messages = _analysis_messages(state, config)
+        if messages is None:
+            return state
+        try:
+            _apply_analysis_output(state, analysis_llm.invoke(messages).content)
+        except Exception as e:
+            state["error"] = f"analysis failed: {str(e)}"
+        return state
+    agent = _analysis_agent(state, config)
+    if agent is None:
+        return state
     try:
         invoke_result = agent.invoke(state["history_messages"])
-        raw_output = invoke_result["output"]
-        state["raw_output"] = raw_output
-
-        # trim history messages
-        state["history_messages"].append(AIMessage(raw_output))#raw_output is code here
-        state["history_messages"] = trim_messages(
-            state["history_messages"],
-            strategy="last",
-            max_tokens=30000,
-            token_counter=count_tokens_approximately
-            ) 
-        
-        state["exec_code"] = extract_code_blocks(raw_output)
+        _apply_analysis_output(state, _agent_output(invoke_result))
+    except Exception as e:
+        state["error"] = f"analysis failed: {str(e)}"
+    return state
+
+async def _generate_analysis_async(state: AgentState, config: RunnableConfig) -> Optional[str]:
+    """Run the analysis LLM call (SQL prompt or pandas agent); returns its raw output, or None after setting state["error"]."""
+    # profiles and frames may have to be restored from the columnar cache: load them on the thread pool
+    if _single_call_analysis():
+        messages = await analysis_pool.run_blocking(_analysis_messages, state, config)
+        if messages is None:
+            return None
+        return (await analysis_llm.ainvoke(messages)).content
+    inputs = await analysis_pool.run_blocking(_agent_inputs, state, config)
+    if inputs is None:
+        return None
+    agent = _build_agent(state, *inputs)
+    return _agent_output(await agent.ainvoke(state["history_messages"]))
+
+async def analysis_node_async(state: AgentState, config: RunnableConfig) -> AgentState:
+    if state.get("error"):
+        return state
+    if state.get("raw_output") is not None:
+        # already produced in the router node (speculative analysis or combined routing call)
+        return state
+    try:
+        raw_output = await _generate_analysis_async(state, config)
+        if raw_output is not None:
+            _apply_analysis_output(state, raw_output)
     except Exception as e:
         state["error"] = f"analysis failed: {str(e)}"
     return state
 
 #execute code
-def execute_code_node(state: AgentState) -> AgentState:
+def execute_code_node(state: AgentState, config: RunnableConfig) -> AgentState:
+    state["retry_analysis"] = False
     if state.get("error"):
         return state
     if not state.get("exec_code"):
         return state
     
-    # 检查是否有文件路径
-    if not state.get("file_paths") or len(state["file_paths"]) == 0:
+    # 检查会话中是否有数据集
+    if not state.get("datasets"):
         state["error"] = "No files available for code execution."
         return state
     
-    dfs = []
-    for file_path in state["file_paths"]:
-            if file_path.endswith(".csv"):
-                df = pd.read_csv(file_path)
-            elif file_path.endswith(".xlsx"):
-                df = pd.read_excel(file_path)
-            dfs.append(df)
+    # 相同代码作用于相同数据时直接复用之前的执行结果
+    cache_key = result_cache_key([ref["hash"] for ref in state["datasets"]], state["exec_code"])
+    cached_frame = result_cache.get(cache_key)
+    if cached_frame is not None:
+        return _set_result(state, cache_key, cached_frame)
+    
+    dfs = load_session_frames(state, config)
+    if dfs is None:
+        state["error"] = DATASETS_EXPIRED_ERROR
+        return state
             
-    exec_env = {"dfs": dfs, "pd": pd}
-
+    loader = _dataset_loader(state, config)
     try:
-        exec(state["exec_code"], exec_env)
-
-        if "result" not in exec_env:
-            state["error"] = "❌ No variable named `result` was defined in the executed code."
-            return state
-
-        result = exec_env["result"]
-
-        # 清理数据的辅助函数
-        def clean_dataframe_for_json(df):
-            """清理DataFrame中的无穷大值和NaN值，使其能够正确序列化为JSON"""
-            try:
-                df_cleaned = df.copy()
-                # 只对数值列进行清理
-                numeric_columns = df_cleaned.select_dtypes(include=[float, int]).columns
-                for col in numeric_columns:
-                    # 替换无穷大值
-                    df_cleaned[col] = df_cleaned[col].replace([float('inf'), float('-inf')], None)
-                    # 替换NaN值
-                    df_cleaned[col] = df_cleaned[col].where(pd.notna(df_cleaned[col]), None)
-                return df_cleaned
-            except Exception as e:
-                # 如果清理失败，返回原始DataFrame并用fillna处理
-                return df.fillna("N/A")
-        
-        # deal with different types of result
-        if isinstance(result, pd.DataFrame):
-            cleaned_df = clean_dataframe_for_json(result)
-            state["analysis_dataframe_dict"] = cleaned_df.to_dict(orient="records")
-        elif isinstance(result, pd.Series):
-            df = result.reset_index()
-            cleaned_df = clean_dataframe_for_json(df)
-            state["analysis_dataframe_dict"] = cleaned_df.to_dict(orient="records")
-        elif isinstance(result, dict):
-            # 处理字典类型的结果
-            try:
-                # 检查字典中是否包含DataFrame或Series对象
-                flattened_data = []
-                for key, value in result.items():
-                    if isinstance(value, pd.DataFrame):
-                        # 如果值是DataFrame，将其转换为记录格式并标记类别
-                        df_records = value.to_dict(orient="records")
-                        for i, record in enumerate(df_records):
-                            for col, cell_value in record.items():
-                                flattened_data.append({
-                                    "category": str(key),
-                                    "metric": str(col),
-                                    "value": cell_value
-                                })
-                    elif isinstance(value, pd.Series):
-                        # 如果值是Series，展平它
-                        for idx, val in value.items():
-                            flattened_data.append({
-                                "category": str(key),
-                                "metric": str(idx),
-                                "value": val
-                            })
-                    else:
-                        # 简单值
-                        flattened_data.append({
-                            "category": str(key),
-                            "metric": "value",
-                            "value": value
-                        })
-                
-                if flattened_data:
-                    df = pd.DataFrame(flattened_data)
-                    cleaned_df = clean_dataframe_for_json(df)
-                    state["analysis_dataframe_dict"] = cleaned_df.to_dict(orient="records")
-                else:
-                    # 如果展平失败，尝试直接转换
-                    df = pd.DataFrame([{str(k): str(v) for k, v in result.items()}])
-                    cleaned_df = clean_dataframe_for_json(df)
-                    state["analysis_dataframe_dict"] = cleaned_df.to_dict(orient="records")
-            except Exception as e:
-                # 如果都失败了，创建键值对的表格
-                df = pd.DataFrame([{"Key": str(k), "Value": str(v)} for k, v in result.items()])
-                state["analysis_dataframe_dict"] = df.to_dict(orient="records")
-        elif isinstance(result, (tuple, list)):
+        if ANALYSIS_ENGINE == "sql":
+            # the generated code is a single DuckDB query over t0, t1, ...
+            sql_session = SQLSession(dfs, loader.parquet_paths(state["datasets"]))
             try:
-                # 尝试创建DataFrame
-                if all(not isinstance(i, (list, tuple, dict)) for i in result):
-                    # 简单值列表
-                    df = pd.DataFrame(result, columns=["value"])
-                else:
-                    # 复杂结构
-                    df = pd.DataFrame(result)
-                cleaned_df = clean_dataframe_for_json(df)
-                state["analysis_dataframe_dict"] = cleaned_df.to_dict(orient="records")
-            except Exception as e:
-                # 如果创建DataFrame失败，转换为简单的键值对
-                df = pd.DataFrame([{"index": i, "value": str(v)} for i, v in enumerate(result)])
-                state["analysis_dataframe_dict"] = df.to_dict(orient="records")
-        elif isinstance(result, (int, float, str)):
-            # 处理单个值的情况，检查是否为无穷大或NaN
-            if isinstance(result, float) and (np.isnan(result) or np.isinf(result)):
-                result = None
-            df = pd.DataFrame([{"value": result}])
-            state["analysis_dataframe_dict"] = df.to_dict(orient="records")
-        elif result is None:
-            # 处理None结果，可能是可视化代码没有返回数据
-            state["analysis_dataframe_dict"] = [{"message": "分析完成，结果已通过图表显示"}]
+                df = normalize_result(sql_session(state["exec_code"]))
+            finally:
+                sql_session.close()
         else:
-            state["error"] = f"❌ Unsupported result type: {type(result)}"
-            return state
+            # pandas code runs in an isolated worker process that memory-maps the cached Arrow files
+            df = code_executor.run(
+                state["exec_code"], dfs,
+                loader.arrow_paths(state["datasets"]), loader.parquet_paths(state["datasets"]),
+            )
+
+        # unique string column names: the records JSON, result pages and summary digest all key columns by name
+        df = json_safe_columns(df)
+        result_id = result_cache.result_id(cache_key)
+        result_store.put(result_id, df)
+        _set_result(state, result_id, df)
     except Exception as e:
-        state["error"] = f"❌ Code execution error: {str(e)}"
+        details = _fix_details(e)
+        if details and _single_call_analysis() and (state.get("analysis_retries") or 0) < ANALYSIS_MAX_RETRIES:
+            _request_fix(state, details)
+        else:
+            state["error"] = describe_error(e)
     return state
 
+def _fix_details(error: Exception) -> Optional[str]:
+    """The traceback to send back to the model, or None when fixing the code cannot help (timeouts, crashes, memory limits)."""
+    if ANALYSIS_ENGINE == "sql":
+        return query_error_details(error)
+    return error.details if isinstance(error, CodeExecutionError) else None
+
+def _request_fix(state: AgentState, details: str) -> AgentState:
+    """Send the failing code back to the analysis node with its traceback instead of failing the request."""
+    kind = "query" if ANALYSIS_ENGINE == "sql" else "code"
+    state["history_messages"].append(HumanMessage(RETRY_PROMPT.format(kind=kind, traceback=details)))
+    state["analysis_retries"] = (state.get("analysis_retries") or 0) + 1
+    state["retry_analysis"] = True
+    state["raw_output"] = None
+    state["exec_code"] = None
+    metrics.inc("analysis_retries_total")
+    return state
+
+def _set_result(state: AgentState, result_id: str, df: pd.DataFrame) -> AgentState:
+    """Point the state at a stored result; only the first RESULT_INLINE_ROWS rows travel inline."""
+    state["result_id"] = result_id
+    state["result_total_rows"] = len(df)
+    # encode straight to records JSON in one vectorized pass (inf/NaN become null)
+    with measure("serialize_result"):
+        state["analysis_data_json"] = records_json(df.head(RESULT_INLINE_ROWS))
+    return state
+
+async def execute_code_node_async(state: AgentState, config: RunnableConfig) -> AgentState:
+    # exec and result conversion are CPU-bound, keep them off the event loop
+    return await analysis_pool.run_blocking(execute_code_node, state, config)
+
 #analyze filtered data
-def analysis_filtered_data_node(state: AgentState) -> AgentState:
-    if state.get("error"):
-        return state
-    
+def _result_for_summary(state: AgentState) -> pd.DataFrame:
+    # 优先使用结果存储中的完整结果；已被淘汰时退回到内联的前若干行
+    frame = result_store.get(state["result_id"]) if state.get("result_id") else None
+    if frame is None:
+        frame = result_frame(state["analysis_data_json"])
+    return frame
+
+def _result_digest(state: AgentState) -> str:
+    try:
+        return digest_result(_result_for_summary(state))
+    except Exception:
+        # fall back to the inline head rows, the summary input used before the digest
+        metrics.inc("summary_digest_failures_total")
+        return str(result_frame(state["analysis_data_json"]))
+
+def _summary_messages(state: AgentState) -> List:
     system_prompt = f"""You are a data analysis assistant. You will receive:
     1. A user's question.
-    2. A table that is the result of a Python data analysis.
-    Your task is to interpret the table and write a clear, concise natural language summary that answers the user's question.
+    2. A digest of the table that is the result of a Python data analysis (shape, column types, sample rows, statistics and detected trends).
+    Your task is to interpret the result and write a clear, concise natural language summary that answers the user's question.
 
     Guidelines:
     - Focus on key insights from the table (e.g., trends, top performers, comparisons).
@@ -269,116 +526,204 @@ def analysis_filtered_data_node(state: AgentState) -> AgentState:
     Now summarize the following result.
     """
     
-    result = llm.invoke([SystemMessage(system_prompt), 
-                         HumanMessage(state["user_prompt"]+ f"\n\nanalysis_dataframe: {pd.DataFrame(state['analysis_dataframe_dict'])}")
-        ]).content
+    return [SystemMessage(system_prompt), 
+            HumanMessage(state["user_prompt"]+ f"\n\nanalysis_result_digest:\n{_result_digest(state)}")
+        ]
+
+def _apply_summary(state: AgentState, result: str) -> AgentState:
     state["filtered_data_summary"] = result
     state["history_messages"][-1].content += "\n\n" + result
     return state
 
-#chat node
-def chat_node(state: AgentState) -> AgentState:
+def analysis_filtered_data_node(state: AgentState) -> AgentState:
+    if state.get("error"):
+        return state
+    result = summary_llm.invoke(_summary_messages(state)).content
+    return _apply_summary(state, result)
+
+async def analysis_filtered_data_node_async(state: AgentState) -> AgentState:
     if state.get("error"):
         return state
+    # 生成摘要需要扫描完整结果，放到线程池中执行
+    messages = await analysis_pool.run_blocking(_summary_messages, state)
+    result = (await summary_llm.ainvoke(messages)).content
+    return _apply_summary(state, result)
+
+#chat node
+def _chat_ready(state: AgentState) -> bool:
+    if state.get("error"):
+        return False
     if not state.get("history_messages"):
         state["error"] = "No history messages provided for chat."
-        return state
-    result = llm.invoke(state["history_messages"]).content
+        return False
+    return True
+
+def _apply_chat_reply(state: AgentState, result: str) -> AgentState:
     state["filtered_data_summary"] = result
     state["raw_output"] = result
     state["history_messages"].append(AIMessage(result))
     return state
 
+def chat_node(state: AgentState) -> AgentState:
+    if not _chat_ready(state) or state.get("raw_output") is not None:
+        # raw_output is already set when the combined routing call answered
+        return state
+    result = chat_llm.invoke(state["history_messages"]).content
+    return _apply_chat_reply(state, result)
+
+async def chat_node_async(state: AgentState) -> AgentState:
+    if not _chat_ready(state) or state.get("raw_output") is not None:
+        return state
+    result = (await chat_llm.ainvoke(state["history_messages"])).content
+    return _apply_chat_reply(state, result)
+
+#combined routing: one tool-calling request decides the route and does the work (ROUTER_MODE=combined)
+class ChatReply(BaseModel):
+    """Answer the user directly: casual conversation or general questions that do not need the datasets."""
+    reply: str = Field(description="The complete reply to the user")
+
+class AnalysisCode(BaseModel):
+    """Analyze the user's datasets with Python/pandas code."""
+    code: str = Field(description="Python code whose last line assigns the answer to `result`")
+
+class AnalysisQuery(BaseModel):
+    """Analyze the user's datasets with one DuckDB SQL query."""
+    query: str = Field(description="A single read-only SELECT (or WITH ... SELECT) query")
+
+COMBINED_ROUTING_PROMPT = """You are a helpful AI assistant with expertise in data analysis. Handle the user's latest message by calling exactly one tool:
+- `{analysis_tool}` if the message asks to analyze, query or visualize the datasets below;
+- `ChatReply` for casual conversation or general questions, with your complete answer in `reply`.
+
+{analysis_rules}
+
+Datasets (dtype, cardinality, null rate, range or sample values), precomputed from the full data:
+{schema}
+"""
+
+_PANDAS_RULES = """Analysis code rules:
+- The DataFrames are available ONLY as the list `dfs` (dfs[0], dfs[1], ...) together with `pd`; no other variables exist.
+- The last line MUST assign the actual answer (DataFrame, Series, list, dict or single value) to `result`; never None.
+- Do not print or plot, just compute `result`."""
+
+_SQL_RULES = """Analysis query rules:
+- Exactly one read-only query over the tables listed below; double-quote column names that contain spaces, upper-case letters or special characters.
+- Aggregate, filter and sort in SQL and return only the rows and columns needed to answer the question."""
+
+def _combined_model():
+    analysis_tool = AnalysisQuery if ANALYSIS_ENGINE == "sql" else AnalysisCode
+    return combined_llm.bind_tools([analysis_tool, ChatReply], tool_choice="required")
+
+def _combined_messages(state: AgentState, config: RunnableConfig) -> Optional[List]:
+    """Schema prompt plus the conversation; None when the profiles are gone (falls back to the router call)."""
+    profiles = load_session_profiles(state, config)
+    if profiles is None:
+        return None
+    names = [ref["name"] for ref in state["datasets"]]
+    if ANALYSIS_ENGINE == "sql":
+        schema = format_profiles(names, profiles, table_names=[table_name(i) for i in range(len(profiles))])
+        prompt = COMBINED_ROUTING_PROMPT.format(analysis_tool="AnalysisQuery", analysis_rules=_SQL_RULES, schema=schema)
+    else:
+        schema = format_profiles(names, profiles)
+        prompt = COMBINED_ROUTING_PROMPT.format(analysis_tool="AnalysisCode", analysis_rules=_PANDAS_RULES, schema=schema)
+    # the general system prompt is replaced by the tool instructions above
+    history = [m for m in state["history_messages"] if not isinstance(m, SystemMessage)]
+    return [SystemMessage(prompt)] + history
+
+def _apply_combined_output(state: AgentState, message: AIMessage) -> AgentState:
+    """Route on the tool the model called and apply its code or reply, so the next node does not call the LLM again."""
+    call = message.tool_calls[0] if message.tool_calls else None
+    if call and call["name"] in (AnalysisCode.__name__, AnalysisQuery.__name__):
+        state["route"] = "analysis"
+        if call["name"] == AnalysisQuery.__name__:
+            body, fence = call["args"].get("query", ""), "sql"
+        else:
+            body, fence = call["args"].get("code", ""), "python"
+        # stored in the history as a fenced block, the same shape as the analysis node's output
+        _apply_analysis_output(state, f"```{fence}\n{body.strip()}\n```")
+    else:
+        state["route"] = "chat"
+        # a model that ignores tool_choice answers in plain text
+        reply = call["args"].get("reply", "") if call else message.content
+        _apply_chat_reply(state, reply)
+    record_route(state["user_prompt"], state["route"], "combined")
+    return state
+
 #output node
 def output_node(state: AgentState) -> AgentState:
     print("="*100)
-    if state.get("analysis_dataframe_dict"):
-        print(pd.DataFrame(state['analysis_dataframe_dict']))
+    if state.get("analysis_data_json"):
+        print(result_frame(state['analysis_data_json']))
     print(state['filtered_data_summary'])
     print("="*100)
     return state
 
 # 创建专门用于API的图构建器，不包含input节点
 #create graph
-builder = StateGraph(AgentState)
-builder.add_node("clean_up", clean_up_node)
-builder.add_node("router", router_node)
-builder.add_node("analysis", analysis_node)
-builder.add_node("execute_code", execute_code_node)
-builder.add_node("analysis_filtered_data", analysis_filtered_data_node)
-builder.add_node("chat", chat_node)
-builder.add_node("output", output_node)
-
-
-builder.add_edge(START, "clean_up")
-builder.add_edge("clean_up", "router")
-builder.add_conditional_edges(
-    source="router",
-    path=lambda state: state["route"],
-    path_map={
-        "analysis": "analysis",
-        "chat": "chat"
-    }
-)
-builder.add_edge("chat", "output")
-builder.add_edge("analysis", "execute_code")
-builder.add_edge("execute_code", "analysis_filtered_data")
-builder.add_edge("analysis_filtered_data", "output")
-builder.add_edge("output", END)
+def build_graph(nodes: Dict) -> StateGraph:
+    """
+    Wire the pipeline; `nodes` maps node names to their sync or async implementations.
 
-memory = MemorySaver()
+    Every node is wrapped with instrument_node, so each run records its wall/CPU time and memory delta.
+    """
+    builder = StateGraph(AgentState)
+    for name, node in nodes.items():
+        builder.add_node(name, instrument_node(name, node))
+
+    builder.add_edge(START, "clean_up")
+    builder.add_edge("clean_up", "router")
+    builder.add_conditional_edges(
+        source="router",
+        path=lambda state: state["route"],
+        path_map={
+            "analysis": "analysis",
+            "chat": "chat"
+        }
+    )
+    builder.add_edge("chat", "output")
+    builder.add_edge("analysis", "execute_code")
+    # in the direct / sql modes failing code goes back to the analysis node once per ANALYSIS_MAX_RETRIES
+    builder.add_conditional_edges(
+        source="execute_code",
+        path=lambda state: "analysis" if state.get("retry_analysis") else "analysis_filtered_data",
+        path_map={
+            "analysis": "analysis",
+            "analysis_filtered_data": "analysis_filtered_data"
+        }
+    )
+    builder.add_edge("analysis_filtered_data", "output")
+    builder.add_edge("output", END)
+    return builder
+
+builder = build_graph({
+    "clean_up": clean_up_node,
+    "router": router_node,
+    "analysis": analysis_node,
+    "execute_code": execute_code_node,
+    "analysis_filtered_data": analysis_filtered_data_node,
+    "chat": chat_node,
+    "output": output_node,
+})
+async_builder = build_graph({
+    "clean_up": clean_up_node,
+    "router": router_node_async,
+    "analysis": analysis_node_async,
+    "execute_code": execute_code_node_async,
+    "analysis_filtered_data": analysis_filtered_data_node_async,
+    "chat": chat_node_async,
+    "output": output_node,
+})
+
+# both graphs share one checkpointer, so a session can move between the sync and async entry points;
+# it keeps only the latest checkpoint per session and evicts idle / least recently used sessions.
+# Runs pass checkpoint_during=False: every request starts from the full restored state, so only the
+# final checkpoint is needed, which saves serialising the whole state after every node.
+memory = session_checkpointer
 graph =builder.compile(checkpointer=memory)
+async_graph = async_builder.compile(checkpointer=memory)
 
 
-# API调用的主函数
-def run_analysis(file_paths: List[str], prompt: str, session_id: str = None) -> Dict:
-    """
-    运行数据分析
-    
-    Args:
-        file_paths: 文件路径列表
-        prompt: 用户分析指令
-        session_id: 会话ID，用于保持对话历史连续性
-        
-    Returns:
-        包含分析结果的字典
-    """
-    try:
-        # 使用提供的session_id或生成新的
-        if session_id:
-            config = {"configurable": {"thread_id": session_id}}
-        else:
-            session_id = str(uuid.uuid4())
-            config = {"configurable": {"thread_id": session_id}}
-        
-       
-        
-        
-        # 尝试获取现有状态，如果不存在则创建新状态
-        try:
-            # 获取现有的状态快照
-            snapshot = graph.get_state(config)
-            if snapshot and snapshot.values:
-                # 使用现有状态
-                state = snapshot.values
-                print(f"📚 恢复会话记忆，历史消息数量: {len(state.get('history_messages', []))}")
-            else:
-                # 创建新状态
-                state = AgentState()
-                print(f"🆕 创建新会话: {session_id}")
-        except Exception as e:
-            # 如果获取状态失败，创建新状态
-            state = AgentState()
-            print(f"⚠️ 无法恢复状态，创建新会话: {e}")
-        
-        # 设置当前请求的参数
-        state["file_paths"] = file_paths
-        state["user_prompt"] = prompt
-        
-        # 如果是新状态或没有历史消息，初始化系统消息
-        if not state.get("history_messages"):
-            # 使用通用的系统提示，既支持数据分析又支持普通聊天
-            system_prompt = """You are a helpful AI assistant with expertise in data analysis. You can:
+# 使用通用的系统提示，既支持数据分析又支持普通聊天
+SYSTEM_PROMPT = """You are a helpful AI assistant with expertise in data analysis. You can:
 
             1. **Data Analysis**: When users upload CSV or Excel files, you can analyze the data using Python and pandas. Generate Python code to extract insights from datasets.
             2. **General Conversation**: Have friendly conversations on any topic and remember our previous discussion context.
@@ -431,33 +776,238 @@ def run_analysis(file_paths: List[str], prompt: str, session_id: str = None) ->
             ```
 
             Remember: ONLY use dfs[0], dfs[1], etc. - no other DataFrame variable names exist!"""
-            
-            state["history_messages"] = [SystemMessage(system_prompt)]
+
+
+def _session_config(session_id: Optional[str]):
+    # 使用提供的session_id或生成新的
+    if not session_id:
+        session_id = str(uuid.uuid4())
+    return session_id, {"configurable": {"thread_id": session_id}}
+
+def _restore_state(snapshot, session_id: str) -> AgentState:
+    """从检查点快照恢复状态，不存在时创建新状态"""
+    if snapshot and snapshot.values:
+        # 使用现有状态
+        state = snapshot.values
+        print(f"📚 恢复会话记忆，历史消息数量: {len(state.get('history_messages', []))}")
+    else:
+        # 创建新状态
+        state = AgentState()
+        print(f"🆕 创建新会话: {session_id}")
+    return state
+
+def _prepare_request(state: AgentState, prompt: str, session_id: str, file_paths: List[str], datasets: Optional[List[Dict]]) -> AgentState:
+    # 设置当前请求的参数
+    state["file_paths"] = file_paths
+    state["user_prompt"] = prompt
+    state["session_id"] = session_id
+    # 本轮有新上传的文件时替换会话数据集，否则沿用之前的数据集
+    if datasets is not None:
+        state["datasets"] = datasets
+    
+    # 如果是新状态或没有历史消息，初始化系统消息
+    if not state.get("history_messages"):
+        state["history_messages"] = [SystemMessage(SYSTEM_PROMPT)]
+    
+    # 添加用户消息到历史
+    state["history_messages"].append(HumanMessage(prompt))
+    return state
+
+def _attach_timings(config: Dict, timings: RequestTimings) -> None:
+    """按节点统计 LLM 调用次数、token 数和工具调用次数（回调随运行配置传递给各节点中的模型和 agent）"""
+    config["callbacks"] = [timings.callback]
+
+def _success_response(result_state: AgentState, session_id: str, dataset_loader: RequestDatasetLoader) -> Dict:
+    return {
+        "status": "success",
+        "summary": result_state.get("filtered_data_summary", ""),
+        "data": RawJSON(result_state.get("analysis_data_json") or "[]"),
+        "result_id": result_state.get("result_id"),
+        "total_rows": result_state.get("result_total_rows") or 0,
+        "truncated": (result_state.get("result_total_rows") or 0) > RESULT_INLINE_ROWS,
+        "code": result_state.get("exec_code", ""),
+        "error": result_state.get("error"),
+        "session_id": session_id,
+        "load_stats": dataset_loader.load_stats
+    }
+
+def _error_response(e: Exception, session_id: Optional[str]) -> Dict:
+    return {
+        "status": "error",
+        "error": str(e),
+        "summary": "",
+        "data": [],
+        "code": "",
+        "session_id": session_id if session_id else ""
+    }
+
+
+# API调用的主函数
+def run_analysis(file_paths: List[str], prompt: str, session_id: str = None, file_names: Optional[List[str]] = None,
+                 include_timings: bool = False) -> Dict:
+    """
+    运行数据分析
+    
+    Args:
+        file_paths: 文件路径列表，为空时沿用会话中已缓存的数据集
+        prompt: 用户分析指令
+        session_id: 会话ID，用于保持对话历史连续性
+        file_names: 上传时的原始文件名，与file_paths一一对应
+        include_timings: 为 True 时在结果中附带各阶段的耗时和资源统计（timings 字段）
         
-        # 添加用户消息到历史
-        state["history_messages"].append(HumanMessage(prompt))
+    Returns:
+        包含分析结果的字典
+    """
+    with request_timings() as timings:
+        result = _run_analysis(file_paths, prompt, session_id, file_names, timings)
+        if include_timings:
+            result["timings"] = timings.as_dict()
+        return result
+
+
+def _run_analysis(file_paths: List[str], prompt: str, session_id: Optional[str], file_names: Optional[List[str]],
+                  timings: RequestTimings) -> Dict:
+    try:
+        session_id, config = _session_config(session_id)
+        
+        # 尝试获取现有状态，如果不存在则创建新状态
+        try:
+            with measure("restore_session"):
+                state = _restore_state(graph.get_state(config), session_id)
+        except Exception as e:
+            # 如果获取状态失败，创建新状态
+            state = AgentState()
+            print(f"⚠️ 无法恢复状态，创建新会话: {e}")
+        
+        # 请求级加载器：本轮有新上传的文件时解析并缓存到会话数据集中，否则沿用之前的数据集；
+        # 各节点通过同一个加载器拿数据，每个文件在一次请求内最多解析一次
+        dataset_loader = RequestDatasetLoader(dataset_store, session_id)
+        datasets = dataset_loader.add_files(file_paths, file_names) if file_paths else None
+        config["configurable"]["dataset_loader"] = dataset_loader
+        _attach_timings(config, timings)
+        state = _prepare_request(state, prompt, session_id, file_paths, datasets)
         
         # 执行分析
-        result_state = graph.invoke(state, config=config)
+        result_state = graph.invoke(state, config=config, checkpoint_during=False)
         
         # 准备返回结果
-        response = {
-            "status": "success",
-            "summary": result_state.get("filtered_data_summary", ""),
-            "data": result_state.get("analysis_dataframe_dict", []),
-            "code": result_state.get("exec_code", ""),
-            "error": result_state.get("error"),
-            "session_id": session_id
-        }
+        return _success_response(result_state, session_id, dataset_loader)
+        
+    except Exception as e:
+        return _error_response(e, session_id)
+
+
+async def _prepare_async_run(file_paths: List[str], prompt: str, session_id: str,
+                             file_names: Optional[List[str]],
+                             sources: Optional[List[DatasetSource]] = None,
+                             timings: Optional[RequestTimings] = None) -> Tuple[AgentState, Dict, RequestDatasetLoader]:
+    """恢复会话状态、加载本轮上传的数据集，返回 (state, config, dataset_loader)"""
+    _, config = _session_config(session_id)
+    
+    # 尝试获取现有状态，如果不存在则创建新状态
+    try:
+        with measure("restore_session"):
+            state = _restore_state(await async_graph.aget_state(config), session_id)
+    except Exception as e:
+        # 如果获取状态失败，创建新状态
+        state = AgentState()
+        print(f"⚠️ 无法恢复状态，创建新会话: {e}")
+    
+    dataset_loader = RequestDatasetLoader(dataset_store, session_id)
+    datasets = None
+    if sources:
+        datasets = await analysis_pool.run_blocking(dataset_loader.add_sources, sources)
+    elif file_paths:
+        datasets = await analysis_pool.run_blocking(dataset_loader.add_files, file_paths, file_names)
+    config["configurable"]["dataset_loader"] = dataset_loader
+    if timings is not None:
+        _attach_timings(config, timings)
+    state = _prepare_request(state, prompt, session_id, file_paths, datasets)
+    return state, config, dataset_loader
+
+async def run_analysis_async(file_paths: List[str], prompt: str, session_id: str = None, file_names: Optional[List[str]] = None,
+                             sources: Optional[List[DatasetSource]] = None, include_timings: bool = False) -> Dict:
+    """
+    运行数据分析（异步版本）
+    
+    LLM 调用全部使用 ainvoke，等待模型响应时不占用线程；文件解析和代码执行等 CPU 密集步骤
+    放到分析工作池中执行。参数和返回值与 run_analysis 相同；sources 为上传时已接收好的数据集
+    （带内容哈希，可能已解析），提供时代替 file_paths / file_names 注册到会话中。
+    调用方已处于 request_timings() 上下文中时（例如接收上传文件之前），timings 也包含之前记录的阶段。
+    """
+    with request_timings() as timings:
+        try:
+            session_id, _ = _session_config(session_id)
+            state, config, dataset_loader = await _prepare_async_run(file_paths, prompt, session_id, file_names, sources, timings)
+            
+            # 执行分析
+            result_state = await async_graph.ainvoke(state, config=config, checkpoint_during=False)
+            
+            # 准备返回结果
+            result = _success_response(result_state, session_id, dataset_loader)
+            
+        except Exception as e:
+            result = _error_response(e, session_id)
+        if include_timings:
+            result["timings"] = timings.as_dict()
+        return result
+
+
+# 流式接口中结果表每个分块的行数
+STREAM_ROWS_PER_CHUNK = int(os.getenv("STREAM_ROWS_PER_CHUNK", "500"))
+# 这些节点的 LLM 输出就是返回给用户的回答，其 token 会被逐个推送
+_ANSWER_NODES = {"analysis_filtered_data", "chat"}
+
+async def stream_analysis_async(file_paths: List[str], prompt: str, session_id: str = None, file_names: Optional[List[str]] = None,
+                                sources: Optional[List[DatasetSource]] = None, include_timings: bool = False) -> AsyncIterator[Dict]:
+    """
+    以事件流的形式运行数据分析，参数与 run_analysis_async 相同
+    
+    依次产出 {"event": ..., "data": ...}：
+        session: 会话ID
+        route: 路由结果（analysis / chat）
+        code: 生成的代码
+        rows: 结果表的一个分块 {"offset", "rows"}
+        token: 总结/聊天回复的增量文本
+        done: 最终结果，与 run_analysis 的返回值相同，但不再重复包含结果表
+        error: 分析流程抛出异常时的错误结果
+    """
+    with request_timings() as timings:
+        async for event in _stream_analysis(file_paths, prompt, session_id, file_names, sources, timings):
+            if include_timings and event["event"] in ("done", "error"):
+                event["data"]["timings"] = timings.as_dict()
+            yield event
+
+
+async def _stream_analysis(file_paths: List[str], prompt: str, session_id: Optional[str], file_names: Optional[List[str]],
+                           sources: Optional[List[DatasetSource]], timings: RequestTimings) -> AsyncIterator[Dict]:
+    try:
+        session_id, _ = _session_config(session_id)
+        state, config, dataset_loader = await _prepare_async_run(file_paths, prompt, session_id, file_names, sources, timings)
+        yield {"event": "session", "data": {"session_id": session_id}}
         
-        return response
+        async for mode, chunk in async_graph.astream(state, config=config, stream_mode=["updates", "messages"], checkpoint_during=False):
+            if mode == "messages":
+                message, metadata = chunk
+                if metadata.get("langgraph_node") in _ANSWER_NODES and message.content:
+                    yield {"event": "token", "data": {"text": message.content}}
+                continue
+            for node, update in chunk.items():
+                if not update:
+                    continue
+                if node == "router":
+                    yield {"event": "route", "data": {"route": update.get("route")}}
+                elif node == "analysis" and update.get("exec_code"):
+                    yield {"event": "code", "data": {"code": update["exec_code"]}}
+                elif node == "execute_code" and update.get("analysis_data_json"):
+                    rows = orjson.loads(update["analysis_data_json"])
+                    for offset in range(0, len(rows), STREAM_ROWS_PER_CHUNK):
+                        yield {"event": "rows", "data": {"offset": offset, "rows": rows[offset:offset + STREAM_ROWS_PER_CHUNK]}}
         
+        result_state = (await async_graph.aget_state(config)).values
+        response = _success_response(result_state, session_id, dataset_loader)
+        response.pop("data")
+        yield {"event": "done", "data": response}
+    
     except Exception as e:
-        return {
-            "status": "error",
-            "error": str(e),
-            "summary": "",
-            "data": [],
-            "code": "",
-            "session_id": session_id if session_id else ""
-        }
\ No newline at end of file
+        yield {"event": "error", "data": _error_response(e, session_id)}
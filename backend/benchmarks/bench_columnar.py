@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+列式缓存加载的基准测试
+
+对比直接解析原始文件（dataset_store.read_dataframe）和从列式缓存（Arrow IPC）读取的耗时，
+输入为 temp_file/ 下的样例 CSV（合计）以及合成的大 CSV 和 Excel 文件，另外测量只读取最后两列的列投影。
+结果以 JSON 输出。
+
+用法:
+    python benchmarks/bench_columnar.py [--rows 500000] [--excel-rows 20000] [--repeat 3]
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from columnar_cache import ColumnarCache  # noqa: E402
+from dataset_store import hash_file, read_dataframe  # noqa: E402
+
+
+def make_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "order_id": np.arange(rows),
+        "date": pd.date_range("2020-01-01", periods=rows, freq="min").strftime("%Y-%m-%d %H:%M"),
+        "region": rng.choice(["North", "South", "East", "West"], rows),
+        "product": rng.choice([f"SKU-{i:04d}" for i in range(500)], rows),
+        "quantity": rng.integers(1, 50, rows),
+        "price": rng.normal(100, 25, rows).round(2),
+        "discount": np.where(rng.random(rows) < 0.1, np.nan, rng.random(rows).round(3)),
+    })
+
+
+def best_of(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench_files(label: str, paths, cache: ColumnarCache, repeat: int) -> dict:
+    hashes = [hash_file(path) for path in paths]
+    frames = [read_dataframe(path) for path in paths]
+    for content_hash, frame in zip(hashes, frames):
+        cache.store(content_hash, frame)
+    projection = [list(frame.columns[-2:]) for frame in frames]
+
+    parse_seconds = best_of(lambda: [read_dataframe(path) for path in paths], repeat)
+    columnar_seconds = best_of(lambda: [cache.load(h) for h in hashes], repeat)
+    projected_seconds = best_of(lambda: [cache.load(h, columns=cols) for h, cols in zip(hashes, projection)], repeat)
+
+    # 缓存读回的数据必须与直接解析的结果一致
+    for content_hash, frame in zip(hashes, frames):
+        pd.testing.assert_frame_equal(frame, cache.load(content_hash))
+
+    return {
+        "input": label,
+        "files": len(paths),
+        "rows": int(sum(len(frame) for frame in frames)),
+        "source_bytes": int(sum(os.path.getsize(path) for path in paths)),
+        "parse_seconds": round(parse_seconds, 4),
+        "columnar_seconds": round(columnar_seconds, 4),
+        "projected_2_columns_seconds": round(projected_seconds, 4),
+        "speedup": round(parse_seconds / columnar_seconds, 1) if columnar_seconds else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=500000, help="合成 CSV 的行数")
+    parser.add_argument("--excel-rows", type=int, default=20000, help="合成 Excel 的行数")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        cache = ColumnarCache(os.path.join(work_dir, "cache"), max_bytes=1 << 40, enabled=True)
+
+        samples = sorted(glob.glob(os.path.join(BACKEND_DIR, "temp_file", "*.csv")))
+        if samples:
+            results.append(bench_files("temp_file/*.csv", samples, cache, args.repeat))
+
+        csv_path = os.path.join(work_dir, "synthetic.csv")
+        make_frame(args.rows).to_csv(csv_path, index=False)
+        results.append(bench_files(f"synthetic csv ({args.rows} rows)", [csv_path], cache, args.repeat))
+
+        xlsx_path = os.path.join(work_dir, "synthetic.xlsx")
+        make_frame(args.excel_rows, seed=1).to_excel(xlsx_path, index=False)
+        results.append(bench_files(f"synthetic xlsx ({args.excel_rows} rows)", [xlsx_path], cache, 1))
+
+    print(json.dumps({"benchmark": "columnar_cache", "results": results}, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
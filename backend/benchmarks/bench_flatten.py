@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+字典结果展平的基准测试
+
+对比 execute_code 节点中原来的逐单元格循环展平和 result_transform.flatten_result_dict 的向量化实现，
+输入为模拟 group-by 输出的宽表字典 {类别: DataFrame}。结果以 JSON 输出。
+
+用法:
+    python benchmarks/bench_flatten.py [--rows 200] [--cols 200] [--groups 5] [--repeat 3]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from result_transform import flatten_result_dict  # noqa: E402
+
+
+def flatten_result_dict_loop(result):
+    """原来的实现：逐行逐列构造 dict"""
+    flattened_data = []
+    for key, value in result.items():
+        if isinstance(value, pd.DataFrame):
+            for record in value.to_dict(orient="records"):
+                for col, cell_value in record.items():
+                    flattened_data.append({"category": str(key), "metric": str(col), "value": cell_value})
+        elif isinstance(value, pd.Series):
+            for idx, val in value.items():
+                flattened_data.append({"category": str(key), "metric": str(idx), "value": val})
+        else:
+            flattened_data.append({"category": str(key), "metric": "value", "value": value})
+    return pd.DataFrame(flattened_data)
+
+
+def make_result(rows: int, cols: int, groups: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    result = {}
+    for g in range(groups):
+        frame = pd.DataFrame(rng.normal(size=(rows, cols)), columns=[f"metric_{c}" for c in range(cols)])
+        frame.iloc[::11, ::7] = np.nan
+        result[f"group_{g}"] = frame
+    result["totals"] = pd.Series(rng.normal(size=cols), index=[f"metric_{c}" for c in range(cols)])
+    result["n_groups"] = groups
+    return result
+
+
+def best_of(fn, arg, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn(arg)
+        timings.append(time.perf_counter() - start)
+    return min(timings), out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--cols", type=int, default=200)
+    parser.add_argument("--groups", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    result = make_result(args.rows, args.cols, args.groups)
+    loop_seconds, expected = best_of(flatten_result_dict_loop, result, args.repeat)
+    vectorized_seconds, actual = best_of(flatten_result_dict, result, args.repeat)
+
+    # 两种实现的输出必须一致（NaN 视为相等）
+    pd.testing.assert_frame_equal(
+        expected.astype({"value": object}), actual.astype({"value": object}), check_dtype=False
+    )
+
+    print(json.dumps({
+        "benchmark": "flatten_result_dict",
+        "rows": args.rows,
+        "cols": args.cols,
+        "groups": args.groups,
+        "cells": len(actual),
+        "loop_seconds": round(loop_seconds, 4),
+        "vectorized_seconds": round(vectorized_seconds, 4),
+        "speedup": round(loop_seconds / vectorized_seconds, 1) if vectorized_seconds else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
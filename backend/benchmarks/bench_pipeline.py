@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+分析流程的离线基准测试 / 压力测试
+
+用确定性的假 chat model 替换 ChatOpenAI（路由、分析 agent、总结都返回预先写好的回答，每次调用固定延迟），
+生成不同大小的 CSV / XLSX 数据集，在进程内通过 ASGI 对 /analyze 发起 N 个并发客户端的请求，测量：
+- 端到端延迟的 p50 / p95 / p99 和吞吐量
+- 每个阶段（图节点、数据集加载、代码执行等，取自响应的 timings 字段）的耗时、CPU 时间和 token 数
+- 峰值 RSS（API 进程，以及执行生成代码的工作进程）
+不需要 OPENAI_API_KEY，也不访问网络。结果以 JSON 输出到 stdout（流程日志输出到 stderr），可用于比较不同版本。
+
+每个客户端使用独立的会话：第一个请求上传数据集，之后的请求只发送新的问题（沿用会话中的数据集）。
+
+用法:
+    python benchmarks/bench_pipeline.py [--rows 1000,100000,1000000] [--excel-rows 1000,20000]
+        [--clients 8] [--requests 5] [--llm-latency-ms 50] [--tool-calls 1] [--engine pandas] [--analysis-mode agent]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, List
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench_columnar import make_frame  # noqa: E402
+
+# 各节点依次使用的分析代码（针对 make_frame 生成的列）；轮换使用，避免全部命中执行结果缓存
+ANALYSIS_CODE = [
+    "result = dfs[0].groupby('region')['price'].mean()",
+    "result = dfs[0].groupby(['region', 'product'])['quantity'].sum().nlargest(20)",
+    "result = dfs[0].assign(revenue=dfs[0]['price'] * dfs[0]['quantity']).groupby('product')['revenue'].sum().reset_index()",
+    "result = dfs[0][['quantity', 'price', 'discount']].describe()",
+    "result = dfs[0].sort_values('price', ascending=False).head(100)",
+]
+ANALYSIS_SQL = [
+    'SELECT region, AVG(price) AS price FROM t0 GROUP BY region ORDER BY region',
+    'SELECT region, product, SUM(quantity) AS quantity FROM t0 GROUP BY 1, 2 ORDER BY 3 DESC LIMIT 20',
+    'SELECT product, SUM(price * quantity) AS revenue FROM t0 GROUP BY product',
+    'SELECT * FROM t0 ORDER BY price DESC LIMIT 100',
+]
+PROMPTS = [
+    "Analyze the average price by region",
+    "Analyze which products sell the most quantity in each region",
+    "Analyze revenue per product",
+    "Analyze the distribution of quantity, price and discount",
+    "Analyze the most expensive orders",
+]
+SUMMARY = "The analysis shows clear differences between regions; the top products account for most of the revenue."
+
+
+def configure_environment(args) -> None:
+    """导入应用之前设置环境变量（各模块在导入时读取配置）"""
+    os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+    os.environ["ANALYSIS_ENGINE"] = args.engine
+    os.environ["ROUTER_MODE"] = args.router_mode
+    os.environ["ROUTER_SPECULATIVE"] = "true" if args.speculative else "false"
+    os.environ["ANALYSIS_MODE"] = args.analysis_mode
+    if args.router_mode == "combined":
+        # 基准中的问题都能被本地规则判断，提高阈值让每个请求都走合并的 LLM 调用
+        os.environ["ROUTER_CONFIDENCE_THRESHOLD"] = "1.01"
+    if not args.caches:
+        # 默认关闭 LLM 响应缓存和执行结果缓存，测量的是每个请求完整走一遍流程的开销
+        os.environ["LLM_CACHE_BACKEND"] = "none"
+        os.environ["RESULT_CACHE_ENABLED"] = "false"
+
+
+BROKEN_CODE = "result = dfs[0]['no_such_column'].sum()"
+
+
+def build_fake_model(latency: float, tool_calls: int, broken_every: int = 0):
+    from langchain_core.language_models import BaseChatModel
+    from langchain_core.messages import AIMessage, ToolMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult
+
+    class ScriptedChatModel(BaseChatModel):
+        """按提示词类型返回预先写好的回答，每次调用固定延迟"""
+
+        latency: float = 0.0
+        tool_calls: int = 0
+        broken_every: int = 0
+        calls: Dict[str, int] = {}
+
+        @property
+        def _llm_type(self) -> str:
+            return "scripted-benchmark"
+
+        def bind_tools(self, tools, **kwargs):
+            # pandas agent 需要工具调用能力；回答中的工具调用由 _respond 生成
+            return self
+
+        def _respond(self, messages) -> AIMessage:
+            text = "\n".join(str(m.content) for m in messages)
+            if 'Respond with either "analysis" or "chat"' in text:
+                kind, message = "router", AIMessage("analysis")
+            elif "by calling exactly one tool" in str(messages[0].content):
+                # ROUTER_MODE=combined：一次调用同时完成路由和代码生成
+                kind = "analysis"
+                n = self.calls.get("analysis", 0)
+                if "AnalysisQuery" in str(messages[0].content):
+                    name, args = "AnalysisQuery", {"query": ANALYSIS_SQL[n % len(ANALYSIS_SQL)]}
+                else:
+                    name, args = "AnalysisCode", {"code": ANALYSIS_CODE[n % len(ANALYSIS_CODE)]}
+                message = AIMessage("", tool_calls=[{"name": name, "args": args, "id": f"call_{n}"}])
+                self.calls[kind] = n + 1
+                return self._with_usage(message, text)
+            elif "by writing Python/pandas code" in str(messages[0].content):
+                # ANALYSIS_MODE=direct：一次调用直接给出代码；每 broken_every 次给出一次会执行失败的代码，
+                # 之后收到带回溯的修正请求时给出正确代码
+                n = self.calls.get("analysis", 0)
+                retry = "failed when it was executed" in str(messages[-1].content)
+                broken = self.broken_every and not retry and (n + 1) % self.broken_every == 0
+                code = BROKEN_CODE if broken else ANALYSIS_CODE[n % len(ANALYSIS_CODE)]
+                kind, message = "analysis", AIMessage(f"```python\n{code}\n```")
+            elif "single DuckDB SQL query" in str(messages[0].content):
+                n = self.calls.get("analysis", 0)
+                kind, message = "analysis", AIMessage(f"```sql\n{ANALYSIS_SQL[n % len(ANALYSIS_SQL)]}\n```")
+            elif "pandas dataframe" in text:
+                kind = "analysis"
+                n = self.calls.get("analysis", 0)
+                used = sum(isinstance(m, ToolMessage) for m in messages)
+                if used < self.tool_calls:
+                    # 模拟 agent 先用工具查看数据，再给出最终代码
+                    message = AIMessage("", tool_calls=[{
+                        "name": "python_repl_ast", "args": {"query": "print(df1.shape)"}, "id": f"call_{n}_{used}",
+                    }])
+                else:
+                    message = AIMessage(f"```python\n{ANALYSIS_CODE[n % len(ANALYSIS_CODE)]}\n```")
+            else:
+                kind, message = "summary", AIMessage(SUMMARY)
+            if kind != "analysis" or not message.tool_calls:
+                self.calls[kind] = self.calls.get(kind, 0) + 1
+            return self._with_usage(message, text)
+
+        @staticmethod
+        def _with_usage(message: AIMessage, prompt: str) -> AIMessage:
+            # 近似的 token 用量，让 timings 中的 token 统计也有数据
+            output_tokens = max(1, len(str(message.content) or str(message.tool_calls)) // 4)
+            message.usage_metadata = {
+                "input_tokens": len(prompt) // 4,
+                "output_tokens": output_tokens,
+                "total_tokens": len(prompt) // 4 + output_tokens,
+            }
+            return message
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+            time.sleep(self.latency)
+            return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+            await asyncio.sleep(self.latency)
+            return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    return ScriptedChatModel(latency=latency, tool_calls=tool_calls, broken_every=broken_every)
+
+
+def install(model):
+    """用假模型替换各节点的 LLM（节点在调用时才读取这些模块变量）"""
+    import analysis_agent as aa
+
+    aa.llm = model
+    aa.router_llm = aa.analysis_llm = aa.summary_llm = aa.chat_llm = aa.combined_llm = model
+
+
+def stage_summary(responses: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """汇总各响应 timings 字段中的阶段统计：按阶段名给出耗时分位数，以及 CPU、token、工具调用的均值"""
+    stages: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for response in responses:
+        for stage in (response.get("timings") or {}).get("stages", []):
+            stages[stage["stage"]].append(stage)
+    summary = {}
+    for name, records in sorted(stages.items()):
+        summary[name] = {"count": len(records), **latency_stats([r["wall_seconds"] for r in records])}
+        for field in ("cpu_seconds", "worker_cpu_seconds", "memory_delta_bytes", "prompt_tokens", "completion_tokens",
+                      "llm_calls", "tool_calls"):
+            values = [r[field] for r in records if field in r]
+            if values:
+                summary[name][f"mean_{field}"] = round(float(np.mean(values)), 4)
+    return summary
+
+
+def latency_stats(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ms = np.asarray(values) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "mean_ms": round(float(ms.mean()), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+def peak_rss_mb() -> Dict[str, float]:
+    # Linux 上 ru_maxrss 的单位是 KB
+    return {
+        "api_process": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+async def run_scenario(client, path: str, clients: int, requests: int) -> Dict[str, Any]:
+    name = os.path.basename(path)
+    with open(path, "rb") as f:
+        content = f.read()
+    latencies: List[float] = []
+    responses: List[Dict[str, Any]] = []
+    statuses: Dict[str, int] = defaultdict(int)
+
+    async def one_client(index: int):
+        session_id = f"{name}-{index}-{time.monotonic_ns()}"
+        for i in range(requests):
+            files = [("files", (name, content))] if i == 0 else None
+            data = {"prompt": PROMPTS[(index + i) % len(PROMPTS)], "session_id": session_id, "timings": "true"}
+            start = time.perf_counter()
+            response = await client.post("/analyze", data=data, files=files)
+            latencies.append(time.perf_counter() - start)
+            body = response.json() if response.headers.get("content-type") == "application/json" else {}
+            responses.append(body)
+            status = str(response.status_code)
+            if response.status_code == 200 and (body.get("status") != "success" or body.get("error")):
+                status = "200-error"
+            statuses[status] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_client(i) for i in range(clients)))
+    wall = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "statuses": dict(statuses),
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "latency": latency_stats(latencies),
+        "stages": stage_summary(responses),
+    }
+
+
+async def run(args) -> Dict[str, Any]:
+    import httpx
+
+    from code_executor import code_executor
+    from main import app
+
+    install(build_fake_model(args.llm_latency_ms / 1000, args.tool_calls, args.broken_every))
+    code_executor.start()
+
+    datasets = [("csv", rows) for rows in args.rows] + [("xlsx", rows) for rows in args.excel_rows]
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for fmt, rows in datasets:
+            path = os.path.join(args.work_dir, f"synthetic_{rows}.{fmt}")
+            frame = make_frame(rows)
+            frame.to_csv(path, index=False) if fmt == "csv" else frame.to_excel(path, index=False)
+            if not results:
+                # 预热：让执行代码的工作进程完成导入，避免首个场景计入冷启动开销
+                await run_scenario(client, path, 1, 1)
+            scenario = await run_scenario(client, path, args.clients, args.requests)
+            results.append({
+                "dataset": f"{fmt} ({rows} rows)",
+                "format": fmt,
+                "rows": rows,
+                "file_bytes": os.path.getsize(path),
+                "clients": args.clients,
+                **scenario,
+                "peak_rss_mb": peak_rss_mb(),
+            })
+            print(f"完成: {results[-1]['dataset']}, {scenario['throughput_rps']} req/s", file=sys.stderr)
+    code_executor.shutdown()
+    return {
+        "benchmark": "pipeline",
+        "config": {
+            "engine": args.engine,
+            "analysis_mode": args.analysis_mode,
+            "broken_every": args.broken_every,
+            "router_mode": args.router_mode,
+            "speculative": args.speculative,
+            "clients": args.clients,
+            "requests_per_client": args.requests,
+            "llm_latency_ms": args.llm_latency_ms,
+            "tool_calls": args.tool_calls,
+            "caches": args.caches,
+        },
+        "results": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int_list, default=[1000, 100000, 1000000], help="CSV 数据集的行数，逗号分隔")
+    parser.add_argument("--excel-rows", type=int_list, default=[1000, 20000], help="XLSX 数据集的行数，逗号分隔（可为空）")
+    parser.add_argument("--clients", type=int, default=8, help="并发客户端数")
+    parser.add_argument("--requests", type=int, default=5, help="每个客户端的请求数")
+    parser.add_argument("--llm-latency-ms", type=float, default=50, help="假模型每次调用的延迟")
+    parser.add_argument("--tool-calls", type=int, default=1, help="分析 agent 给出代码前的工具调用次数")
+    parser.add_argument("--engine", choices=["pandas", "sql"], default="pandas")
+    parser.add_argument("--analysis-mode", choices=["agent", "direct"], default="agent", help="pandas 引擎的分析方式（ANALYSIS_MODE）")
+    parser.add_argument("--broken-every", type=int, default=0,
+                        help="direct 模式下每 N 次给出一次执行失败的代码，测量带回溯重试的开销（0 为不失败）")
+    parser.add_argument("--router-mode", choices=["local", "llm", "combined"], default="local")
+    parser.add_argument("--speculative", action="store_true", help="路由与分析并行执行（ROUTER_SPECULATIVE，配合 --router-mode llm）")
+    parser.add_argument("--caches", action="store_true", help="保留 LLM 响应缓存和执行结果缓存")
+    args = parser.parse_args()
+
+    configure_environment(args)
+    with tempfile.TemporaryDirectory() as work_dir:
+        args.work_dir = work_dir
+        # 临时文件、列式缓存等相对路径都落在临时目录中，不影响仓库
+        os.chdir(work_dir)
+        # 流程中的 print / agent 的 verbose 输出都写到 stderr，stdout 只输出 JSON 结果
+        with contextlib.redirect_stdout(sys.stderr):
+            report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+结果序列化的基准测试与一致性检查
+
+对比 serialization.records_json 与 pandas 的 DataFrame.to_json(orient="records")：
+- 一致性：整数、可空整数 / 布尔、浮点、object（混合字符串、数值、缺失值、时间戳）、日期等列，
+  两者解析后的值必须相同；浮点数要求 records_json 与原始值完全相等（to_json 只保留 10 位有效数字，按相对误差比较）
+- 耗时：records_json、to_json 以及原来的实现（逐列清理 + 逐行 dict + json）在 --rows 行的表上的最短耗时
+结果以 JSON 输出。
+
+用法:
+    python benchmarks/bench_serialization.py [--rows 200000] [--repeat 3]
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+import orjson
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from serialization import records_json  # noqa: E402
+
+
+def make_check_frame() -> pd.DataFrame:
+    """覆盖各种 dtype 和边界值的小表"""
+    return pd.DataFrame({
+        "int": [1, -2, 3, 2 ** 53],
+        "uint": np.array([0, 1, 2, 3], dtype=np.uint64),
+        "bool": [True, False, True, False],
+        "nullable_int": pd.array([1, None, 3, -4], dtype="Int64"),
+        "nullable_bool": pd.array([True, None, False, True], dtype="boolean"),
+        "nullable_float": pd.array([1.5, None, 1e-12, 2.0], dtype="Float64"),
+        "float": [1e-12, 12345678901234567.0, 1 / 3, np.nan],
+        "float_inf": [np.inf, -np.inf, 0.1 + 0.2, -0.0],
+        "float32": np.array([0.1, 1.5, np.nan, 3.25], dtype=np.float32),
+        "object": ["x", 1e-12, None, 7],
+        "object_time": [pd.Timestamp("2024-01-02 03:04:05.678"), "y", pd.NaT, np.nan],
+        "datetime": pd.to_datetime(["2024-01-01 00:00:00", None, "2024-03-04 05:06:07", "2024-12-31 23:59:59"]),
+        "category": pd.Categorical(["a", "b", None, "a"]),
+        "string": ["中文", "b", "c", "d"],
+    })
+
+
+def values_match(actual, expected, exact, rel_tol: float = 1e-9) -> bool:
+    if isinstance(expected, float) or isinstance(actual, float):
+        if actual is None or expected is None:
+            return actual is None and expected is None
+        if exact is not None and not math.isnan(exact):
+            # records_json 必须与原始值完全相等；to_json 的结果只在其精度内相等
+            return actual == exact and math.isclose(actual, expected, rel_tol=rel_tol, abs_tol=1e-9)
+        return math.isclose(actual, expected, rel_tol=rel_tol, abs_tol=1e-9)
+    return actual == expected and type(actual) is type(expected)
+
+
+def check(frame: pd.DataFrame) -> list:
+    """records_json 与 to_json 解析后的差异列表（为空表示一致）"""
+    actual = orjson.loads(records_json(frame))
+    expected = orjson.loads(frame.to_json(orient="records", date_format="iso", force_ascii=False, default_handler=str))
+    mismatches = []
+    for i, (got, want) in enumerate(zip(actual, expected)):
+        for column in frame.columns:
+            value = frame[column].iloc[i]
+            if frame[column].dtype == np.float32:
+                # float32 按其自身的最短表示编码（0.1），to_json 按 float64 展开（0.1000000015）
+                exact, rel_tol = float(str(value)), 1e-6
+            else:
+                exact, rel_tol = (float(value) if isinstance(value, (float, np.floating)) else None), 1e-9
+            if not values_match(got[column], want[column], exact, rel_tol):
+                mismatches.append({"row": i, "column": column, "records_json": got[column], "to_json": want[column]})
+    if len(actual) != len(expected):
+        mismatches.append({"rows": [len(actual), len(expected)]})
+    return mismatches
+
+
+def make_bench_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "region": rng.choice(["north", "south", "east", "west"], rows),
+        "value": rng.normal(size=rows),
+        "share": rng.random(rows),
+        "count": rng.integers(0, 1000, rows),
+        "nullable": pd.array(rng.integers(0, 10, rows), dtype="Int64"),
+        "label": rng.choice(["a", "b"], rows).astype(object),
+    })
+
+
+def legacy_json(frame: pd.DataFrame) -> bytes:
+    """原来的实现：复制后逐列替换 inf/NaN，再构造逐行 dict 由 json 编码（JSONResponse）"""
+    df = frame.copy()
+    for col in df.select_dtypes(include=[np.number]).columns:
+        df[col] = df[col].replace([np.inf, -np.inf], np.nan)
+        df[col] = df[col].astype(object).where(pd.notnull(df[col]), None)
+    return json.dumps(df.to_dict(orient="records"), ensure_ascii=False, default=str).encode("utf-8")
+
+
+def best_of(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    mismatches = check(make_check_frame())
+
+    frame = make_bench_frame(args.rows)
+    to_json_seconds = best_of(lambda: frame.to_json(orient="records", date_format="iso"), args.repeat)
+    records_json_seconds = best_of(lambda: records_json(frame), args.repeat)
+    legacy_seconds = best_of(lambda: legacy_json(frame), args.repeat)
+
+    print(json.dumps({
+        "benchmark": "records_json",
+        "rows": args.rows,
+        "consistent": not mismatches,
+        "mismatches": mismatches,
+        "to_json_seconds": round(to_json_seconds, 4),
+        "records_json_seconds": round(records_json_seconds, 4),
+        "legacy_seconds": round(legacy_seconds, 4),
+    }, indent=2, ensure_ascii=False, default=str))
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
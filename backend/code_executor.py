@@ -0,0 +1,372 @@
+"""
+生成代码的隔离执行
+
+pandas 分析代码默认在一组预热好的工作进程中执行（CODE_EXEC_MODE=process），而不是在 API 进程中直接 exec：
+- 工作进程启动时就导入了 pandas / pyarrow / duckdb，并设置了地址空间上限（RLIMIT_AS），
+  失控的 merge 只会让该工作进程内存分配失败，API 进程的内存不受影响；
+- 每次执行都有墙钟超时，超时的工作进程直接被杀掉并由新进程替换，死循环不会一直占着 CPU；
+- 数据集不经过 pickle：已写入列式缓存的数据集只传递 Arrow 文件路径，工作进程以内存映射方式读取
+  （无缺失值的数值列零拷贝），只有没有缓存文件的数据集（out-of-core 样本等）才按值传递；
+- 每个工作进程执行 CODE_EXEC_MAX_TASKS_PER_WORKER 次后回收，生成代码遗留的全局状态和内存碎片不会累积。
+
+CODE_EXEC_MODE=inprocess 时仍在调用线程中直接执行。
+"""
+
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from multiprocessing.connection import Connection
+from typing import Any, Dict, List, Optional, Union
+
+import pandas as pd
+from pyarrow import feather
+
+from columnar_cache import table_to_frame
+from duckdb_engine import SQLSession, is_resource_error
+from instrumentation import measure
+from result_transform import UnsupportedResultError, normalize_result
+from serialization import json_safe_columns
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，不设置内存上限
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# process：在工作进程池中执行；inprocess：在当前线程中直接执行（工作进程依赖 POSIX 的文件描述符传递）
+CODE_EXEC_MODE = os.getenv("CODE_EXEC_MODE", "process" if os.name == "posix" else "inprocess").lower()
+# 工作进程数（默认与 ANALYSIS_MAX_WORKERS 的默认值一致）
+CODE_EXEC_WORKERS = int(os.getenv("CODE_EXEC_WORKERS", "4"))
+CODE_EXEC_TIMEOUT_SECONDS = float(os.getenv("CODE_EXEC_TIMEOUT_SECONDS", "60"))
+# 每个工作进程的地址空间上限（MB），0 表示不限制；内存映射的数据集文件也计入地址空间
+CODE_EXEC_MEMORY_LIMIT_MB = int(os.getenv("CODE_EXEC_MEMORY_LIMIT_MB", "4096"))
+CODE_EXEC_MAX_TASKS_PER_WORKER = int(os.getenv("CODE_EXEC_MAX_TASKS_PER_WORKER", "50"))
+
+_BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class CodeExecutionError(Exception):
+    """
+    生成代码执行失败，消息可以直接展示给用户
+
+    details 为生成代码中出错位置的回溯，用于让模型修正代码；超时、工作进程崩溃、超出内存上限时为空。
+    """
+
+    def __init__(self, message: str, details: Optional[str] = None):
+        super().__init__(message)
+        self.details = details
+
+
+def describe_error(error: BaseException) -> str:
+    """把执行过程中的异常转换为返回给用户的错误信息"""
+    if isinstance(error, CodeExecutionError):
+        return str(error)
+    if isinstance(error, UnsupportedResultError):
+        return f"❌ Unsupported result type: {error}"
+    if isinstance(error, MemoryError):
+        return "❌ Code execution exceeded the memory limit"
+    return f"❌ Code execution error: {str(error)}"
+
+
+def code_traceback(error: BaseException, code: str) -> Optional[str]:
+    """
+    异常的简短回溯：只保留生成代码中的行（pandas 等库内部的帧对修正代码没有帮助），加上异常本身
+
+    超出内存上限、sql() 查询超时等资源问题返回 None：修改代码通常无济于事，不应让模型重试。
+    """
+    if isinstance(error, MemoryError) or is_resource_error(error):
+        return None
+    lines = code.splitlines()
+    out = [
+        f"  line {frame.lineno}: {lines[frame.lineno - 1].strip()}"
+        for frame in traceback.extract_tb(error.__traceback__)
+        if frame.filename == "<string>" and frame.lineno and 0 < frame.lineno <= len(lines)
+    ]
+    if out:
+        out.insert(0, "Traceback (most recent call last):")
+    out.extend(line.rstrip() for line in traceback.format_exception_only(type(error), error))
+    return "\n".join(out)
+
+
+def execute_code(code: str, dfs: List[pd.DataFrame], sql: Optional[SQLSession] = None) -> pd.DataFrame:
+    """
+    执行生成代码并把其中的 result 变量转换为 DataFrame
+
+    Raises:
+        CodeExecutionError: 代码没有定义 result
+        UnsupportedResultError: result 无法转换为表格
+    """
+    exec_env: Dict[str, Any] = {"dfs": dfs, "pd": pd}
+    if sql is not None:
+        # out-of-core datasets are only sampled in dfs; sql() queries the full data through DuckDB
+        exec_env["sql"] = sql
+    exec(code, exec_env)
+    if "result" not in exec_env:
+        raise CodeExecutionError("❌ No variable named `result` was defined in the executed code.")
+    return normalize_result(exec_env["result"])
+
+
+def _run_with_datasets(code: str, dfs: List[pd.DataFrame], parquet_paths: List[Optional[str]]) -> pd.DataFrame:
+    sql = SQLSession(dfs, parquet_paths) if any(parquet_paths) else None
+    try:
+        return execute_code(code, dfs, sql)
+    finally:
+        if sql is not None:
+            sql.close()
+
+
+# ---------------------------------------------------------------------------
+# 工作进程
+# ---------------------------------------------------------------------------
+
+class _MissingDataset(Exception):
+    def __init__(self, index: int):
+        super().__init__(index)
+        self.index = index
+
+
+def _load_dataset(index: int, dataset: Union[str, pd.DataFrame]) -> pd.DataFrame:
+    if isinstance(dataset, pd.DataFrame):
+        return dataset
+    try:
+        table = feather.read_table(dataset, memory_map=True)
+    except FileNotFoundError:
+        # 列式缓存文件在传递路径之后被淘汰了，由父进程改为按值传递
+        raise _MissingDataset(index)
+    return table_to_frame(table, split_blocks=True)
+
+
+def _worker_main(fd: int, memory_limit_bytes: int) -> None:
+    """
+    工作进程主循环：逐个接收任务，返回 (状态, 内容, 资源统计)
+
+    状态与内容为 ("ok", DataFrame)、("error", (消息, 回溯)) 或 ("missing", 数据集下标)；
+    资源统计为 {"cpu_seconds": 本次任务的 CPU 时间, "peak_rss_bytes": 工作进程的峰值常驻内存}
+    """
+    # 映射内存上的零拷贝数组是只读的，生成代码的原地修改依赖 copy-on-write 复制
+    pd.set_option("mode.copy_on_write", True)
+    if memory_limit_bytes and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit_bytes, memory_limit_bytes))
+    conn = Connection(fd)
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            return
+        cpu_start = time.process_time()
+        try:
+            dfs = [_load_dataset(i, dataset) for i, dataset in enumerate(task["datasets"])]
+            reply = ("ok", _run_with_datasets(task["code"], dfs, task["parquet_paths"]))
+        except _MissingDataset as e:
+            reply = ("missing", e.index)
+        except Exception as e:
+            reply = ("error", (describe_error(e), code_traceback(e, task["code"])))
+        dfs = None
+        usage = {"cpu_seconds": time.process_time() - cpu_start}
+        if resource is not None:
+            # Linux 上 ru_maxrss 的单位是 KB
+            usage["peak_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        try:
+            conn.send(reply + (usage,))
+        except (EOFError, OSError):
+            return
+        except Exception as e:
+            # 结果无法 pickle 等
+            conn.send(("error", (describe_error(e), None), usage))
+
+
+class _Worker:
+    """一个工作进程及与之通信的连接"""
+
+    def __init__(self, memory_limit_bytes: int):
+        parent_sock, child_sock = socket.socketpair()
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [_BACKEND_DIR, env.get("PYTHONPATH")]))
+        # 用独立的解释器启动而不是 multiprocessing：后者会在子进程中重新导入 __main__（即整个 API 应用）
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", "import sys, code_executor; code_executor._worker_main(int(sys.argv[1]), int(sys.argv[2]))",
+             str(child_sock.fileno()), str(memory_limit_bytes)],
+            pass_fds=(child_sock.fileno(),),
+            env=env,
+        )
+        child_sock.close()
+        self.conn = Connection(parent_sock.detach())
+        self.tasks = 0
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def kill(self) -> None:
+        if self.alive():
+            self.process.kill()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+        self.conn.close()
+
+    def stop(self) -> None:
+        # 关闭连接后工作进程读到 EOF 自行退出
+        self.conn.close()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class CodeExecutor:
+    """
+    生成代码的执行器
+
+    mode 为 process 时维护 workers 个常驻工作进程：空闲的进程放在池中，用完归还；
+    超时或崩溃的进程被杀掉，执行满 max_tasks_per_worker 次的进程被回收，两种情况都立即启动替补进程。
+    """
+
+    def __init__(self, mode: str = CODE_EXEC_MODE, workers: int = CODE_EXEC_WORKERS,
+                 timeout: float = CODE_EXEC_TIMEOUT_SECONDS, memory_limit_mb: int = CODE_EXEC_MEMORY_LIMIT_MB,
+                 max_tasks_per_worker: int = CODE_EXEC_MAX_TASKS_PER_WORKER):
+        self.mode = mode
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit_bytes = memory_limit_mb * 1024 * 1024
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers)
+        self._idle: List[_Worker] = []
+        self._started = False
+        self._counters = {"tasks": 0, "timeouts": 0, "crashes": 0, "recycled": 0}
+
+    def start(self) -> None:
+        """预先启动全部工作进程（服务启动时调用；未调用时在第一次执行时启动）"""
+        if self.mode != "process":
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._idle.extend(_Worker(self.memory_limit_bytes) for _ in range(self.workers))
+        logger.info(f"代码执行工作进程已启动: workers={self.workers}, timeout={self.timeout:g}s, "
+                    f"memory_limit={self.memory_limit_bytes // (1024 * 1024)}MB")
+
+    def shutdown(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._started = False
+        for worker in idle:
+            worker.stop()
+
+    def run(self, code: str, frames: List[pd.DataFrame], arrow_paths: List[Optional[str]],
+            parquet_paths: List[Optional[str]]) -> pd.DataFrame:
+        """
+        执行生成代码，返回转换后的结果表
+
+        Args:
+            frames: 会话中的 DataFrame（out-of-core 数据集为样本）
+            arrow_paths: 与 frames 对应的列式缓存文件；不为 None 时工作进程直接内存映射该文件
+            parquet_paths: 与 frames 对应的 Parquet 文件（out-of-core 数据集），用于 sql()
+
+        Raises:
+            CodeExecutionError: 执行失败、超时或超出内存上限，消息可直接返回给用户
+        """
+        with measure("code_exec", mode=self.mode) as record:
+            return self._run(code, frames, arrow_paths, parquet_paths, record)
+
+    def _run(self, code: str, frames: List[pd.DataFrame], arrow_paths: List[Optional[str]],
+             parquet_paths: List[Optional[str]], record: Dict[str, Any]) -> pd.DataFrame:
+        if self.mode != "process":
+            try:
+                return _run_with_datasets(code, frames, parquet_paths)
+            except Exception as e:
+                raise CodeExecutionError(describe_error(e), code_traceback(e, code)) from e
+
+        # 列名不是互不相同的字符串时，Arrow 文件读回的列名与 frame 不同（2021 -> "2021"），这时按值传递
+        datasets: List[Union[str, pd.DataFrame]] = [
+            path if path and json_safe_columns(frame) is frame else frame for frame, path in zip(frames, arrow_paths)
+        ]
+        self.start()
+        with self._slots:
+            worker = self._checkout()
+            try:
+                while True:
+                    status, payload, usage = self._call(worker, {
+                        "code": code, "datasets": datasets, "parquet_paths": parquet_paths,
+                    })
+                    record["worker_cpu_seconds"] = round(record.get("worker_cpu_seconds", 0) + usage["cpu_seconds"], 6)
+                    if "peak_rss_bytes" in usage:
+                        record["worker_peak_rss_bytes"] = usage["peak_rss_bytes"]
+                    if status != "missing":
+                        break
+                    datasets[payload] = frames[payload]
+            except BaseException:
+                worker.kill()
+                self._replace(worker)
+                raise
+            self._checkin(worker)
+        if status == "error":
+            raise CodeExecutionError(*payload)
+        return payload
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "workers": self.workers,
+                "idle": len(self._idle),
+                "timeout_seconds": self.timeout,
+                "memory_limit_mb": self.memory_limit_bytes // (1024 * 1024),
+                "max_tasks_per_worker": self.max_tasks_per_worker,
+                **self._counters,
+            }
+
+    def _call(self, worker: _Worker, task: Dict[str, Any]) -> tuple:
+        with self._lock:
+            self._counters["tasks"] += 1
+        worker.tasks += 1
+        try:
+            worker.conn.send(task)
+            if not worker.conn.poll(self.timeout):
+                with self._lock:
+                    self._counters["timeouts"] += 1
+                logger.warning(f"生成代码执行超时，终止工作进程: pid={worker.process.pid}, timeout={self.timeout:g}s")
+                raise CodeExecutionError(f"❌ Code execution timed out after {self.timeout:g}s")
+            return worker.conn.recv()
+        except (EOFError, OSError) as e:
+            # 工作进程在执行中退出（被内核 OOM 杀掉、段错误等）
+            with self._lock:
+                self._counters["crashes"] += 1
+            logger.warning(f"代码执行工作进程异常退出: pid={worker.process.pid}, exit={worker.process.poll()}")
+            raise CodeExecutionError("❌ Code execution worker crashed (it may have run out of memory)") from e
+
+    def _checkout(self) -> _Worker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive():
+                    return worker
+                worker.kill()
+        return _Worker(self.memory_limit_bytes)
+
+    def _checkin(self, worker: _Worker) -> None:
+        if worker.tasks >= self.max_tasks_per_worker:
+            with self._lock:
+                self._counters["recycled"] += 1
+            worker.stop()
+            self._replace(worker)
+            return
+        with self._lock:
+            self._idle.append(worker)
+
+    def _replace(self, worker: _Worker) -> None:
+        """启动一个替补进程放入池中，下一次执行不必等待解释器启动"""
+        with self._lock:
+            if self._started and len(self._idle) < self.workers:
+                self._idle.append(_Worker(self.memory_limit_bytes))
+
+
+code_executor = CodeExecutor()
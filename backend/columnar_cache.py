@@ -0,0 +1,217 @@
+"""
+列式磁盘缓存
+
+上传的文件在第一次解析后按内容哈希写成 Arrow IPC（Feather v2，不压缩，可内存映射）文件，
+之后任何会话再遇到相同内容的文件都直接从这里读取，不再经过 pd.read_csv / pd.read_excel；
+读取时支持只加载部分列。数据集画像保存在文件的 schema 元数据中，命中缓存时也不必重新计算。
+超大数据集（out-of-core 模式）以 Parquet 文件保存在同一目录中，画像保存在旁边的 JSON 文件里。
+目录按总字节预算淘汰最久未使用的文件。
+"""
+
+import json
+import logging
+import os
+import threading
+import uuid
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+logger = logging.getLogger(__name__)
+
+COLUMNAR_CACHE_ENABLED = os.getenv("COLUMNAR_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+COLUMNAR_CACHE_DIR = os.getenv("COLUMNAR_CACHE_DIR", "columnar_cache")
+# 缓存目录的总字节预算（默认 10GB）
+COLUMNAR_CACHE_MAX_BYTES = int(os.getenv("COLUMNAR_CACHE_MAX_BYTES", str(10 * 1024 * 1024 * 1024)))
+
+_PROFILE_METADATA_KEY = b"dataset_profile"
+
+
+def table_to_frame(table: pa.Table, split_blocks: bool = False) -> pd.DataFrame:
+    """
+    把缓存中的 Arrow 表转换为 DataFrame
+
+    Args:
+        split_blocks: 不合并同类型的列；对内存映射的表而言，无缺失值的数值列可以零拷贝地直接引用映射内存
+            （得到的数组是只读的，需要配合 pandas 的 copy-on-write 模式使用）
+    """
+    frame = table.to_pandas(split_blocks=split_blocks)
+    # Arrow 把字符串列中的缺失值还原为 None，这里与 pd.read_csv 保持一致，统一为 NaN
+    for name, column in zip(table.column_names, table.columns):
+        if column.null_count and pa.types.is_string(column.type):
+            frame[name] = frame[name].fillna(np.nan)
+    return frame
+
+
+class ColumnarCache:
+    """按内容哈希保存 Arrow IPC 文件的磁盘缓存，多个进程可以共享同一目录"""
+
+    def __init__(self, directory: str = COLUMNAR_CACHE_DIR, max_bytes: int = COLUMNAR_CACHE_MAX_BYTES,
+                 enabled: bool = COLUMNAR_CACHE_ENABLED):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+
+    def path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, f"{content_hash}.arrow")
+
+    def parquet_path(self, content_hash: str) -> str:
+        """超大数据集的 Parquet 文件路径（由 duckdb_engine 写入和查询）"""
+        return os.path.join(self.directory, f"{content_hash}.parquet")
+
+    def has_parquet(self, content_hash: str) -> bool:
+        path = self.parquet_path(content_hash)
+        if not os.path.exists(path):
+            return False
+        self._touch(path)
+        return True
+
+    def load_parquet_profile(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._profile_path(content_hash), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def store_parquet_profile(self, content_hash: str, profile: Dict[str, Any]) -> None:
+        path = self._profile_path(content_hash)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(profile, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"数据集画像写入失败: hash={content_hash[:12]}, error={e}")
+            self._discard(tmp_path)
+
+    def _profile_path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, f"{content_hash}.profile.json")
+
+    def load(self, content_hash: str, columns: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+        """
+        读取缓存的数据集，未命中或文件损坏时返回 None
+
+        Args:
+            columns: 只加载这些列（列投影），默认加载全部列
+        """
+        if not self.enabled:
+            return None
+        path = self.path(content_hash)
+        try:
+            table = feather.read_table(path, columns=columns, memory_map=True)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"列式缓存读取失败，忽略该缓存: hash={content_hash[:12]}, error={e}")
+            self._discard(path)
+            return None
+        self._touch(path)
+        return table_to_frame(table)
+
+    def load_profile(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        """只读取 schema 元数据中的数据集画像，不加载数据"""
+        if not self.enabled:
+            return None
+        try:
+            metadata = feather.read_table(self.path(content_hash), columns=[], memory_map=True).schema.metadata or {}
+        except Exception:
+            return None
+        raw = metadata.get(_PROFILE_METADATA_KEY)
+        return json.loads(raw) if raw else None
+
+    def store(self, content_hash: str, frame: pd.DataFrame, profile: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        把数据集写入缓存；Arrow 无法表示的数据（混合类型的 object 列等）不缓存。
+        列名需先经过 serialization.json_safe_columns（唯一的字符串），否则读回的列名与 frame 不一致
+
+        Returns:
+            是否写入成功
+        """
+        if not self.enabled:
+            return False
+        try:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+        except (pa.ArrowException, ValueError, TypeError) as e:
+            logger.info(f"数据集无法转换为 Arrow，跳过列式缓存: hash={content_hash[:12]}, error={e}")
+            return False
+        if profile is not None:
+            metadata = dict(table.schema.metadata or {})
+            metadata[_PROFILE_METADATA_KEY] = json.dumps(profile, ensure_ascii=False, default=str).encode("utf-8")
+            table = table.replace_schema_metadata(metadata)
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(content_hash)
+        # 先写临时文件再原子替换，并发写入同一内容时读者不会看到半个文件
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            feather.write_feather(table, tmp_path, compression="uncompressed")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"列式缓存写入失败: hash={content_hash[:12]}, error={e}")
+            self._discard(tmp_path)
+            return False
+        self.evict()
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        files = self._files()
+        return {
+            "enabled": self.enabled,
+            "directory": self.directory,
+            "files": len(files),
+            "total_bytes": sum(size for _, size, _ in files),
+            "max_bytes": self.max_bytes,
+        }
+
+    def _files(self) -> List[tuple]:
+        """[(路径, 字节数, 最近访问时间)]"""
+        files = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return files
+        for name in names:
+            if not name.endswith((".arrow", ".parquet")):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((path, stat.st_size, stat.st_mtime))
+        return files
+
+    def evict(self) -> None:
+        with self._lock:
+            files = sorted(self._files(), key=lambda f: f[2])
+            total = sum(size for _, size, _ in files)
+            # 按最近访问时间从旧到新淘汰，最新写入的文件始终保留
+            for path, size, _ in files[:-1]:
+                if total <= self.max_bytes:
+                    break
+                logger.info(f"列式缓存超出预算，淘汰: {os.path.basename(path)}")
+                self._discard(path)
+                if path.endswith(".parquet"):
+                    self._discard(self._profile_path(os.path.basename(path)[:-len(".parquet")]))
+                total -= size
+
+    @staticmethod
+    def _touch(path: str) -> None:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _discard(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+columnar_cache = ColumnarCache()
@@ -0,0 +1,130 @@
+"""
+数据集画像
+
+上传时对每个数据集做一次画像：逐列的类型、基数、缺失率、最小/最大值和样例值。
+画像与数据集一起缓存在会话中（按内容哈希，文件不变就不会重新计算），
+并以紧凑的文本注入分析提示词，让分析 agent 不必再花工具调用去查看列信息。
+"""
+
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# 提示词中每个数据集最多列出的列数，以及每列的样例值个数
+DATASET_PROFILE_MAX_COLUMNS = int(os.getenv("DATASET_PROFILE_MAX_COLUMNS", "50"))
+DATASET_PROFILE_SAMPLE_VALUES = int(os.getenv("DATASET_PROFILE_SAMPLE_VALUES", "3"))
+
+# 样例值展示的最大字符数，以及挑选样例值时扫描的行数
+_MAX_VALUE_CHARS = 30
+_SAMPLE_SCAN_ROWS = 1000
+
+
+def _scalar(value: Any) -> Any:
+    """把 numpy / pandas 标量转换为可 JSON 序列化的 Python 值"""
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _short(value: Any) -> str:
+    text = str(value)
+    return text if len(text) <= _MAX_VALUE_CHARS else text[:_MAX_VALUE_CHARS - 3] + "..."
+
+
+def profile_column(series: pd.Series) -> Dict[str, Any]:
+    non_null = series.dropna()
+    column: Dict[str, Any] = {
+        "name": str(series.name),
+        "dtype": str(series.dtype),
+        "null_rate": round(1 - len(non_null) / len(series), 4) if len(series) else 0.0,
+    }
+    try:
+        column["n_unique"] = int(non_null.nunique())
+        # 样例值只从前若干行中取，避免对整列再做一次去重
+        samples = non_null.head(_SAMPLE_SCAN_ROWS).drop_duplicates().head(DATASET_PROFILE_SAMPLE_VALUES)
+    except TypeError:
+        # 不可哈希的单元格（list / dict 等）
+        column["n_unique"] = None
+        samples = non_null.head(DATASET_PROFILE_SAMPLE_VALUES)
+    column["samples"] = [_short(_scalar(v)) for v in samples]
+
+    if not non_null.empty and (
+        pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+        or pd.api.types.is_datetime64_any_dtype(series)
+    ):
+        column["min"] = _scalar(non_null.min())
+        column["max"] = _scalar(non_null.max())
+    return column
+
+
+def profile_frame(df: pd.DataFrame) -> Dict[str, Any]:
+    """计算 DataFrame 的画像，结果只包含可 JSON 序列化的值"""
+    return {
+        "rows": len(df),
+        "columns": [profile_column(df.iloc[:, i]) for i in range(df.shape[1])],
+    }
+
+
+def profile_from_summary(sample: pd.DataFrame, summary: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    超大数据集的画像：类型和样例值取自样本，行数、基数、缺失率和最小/最大值取自全量数据的 SUMMARIZE
+
+    Args:
+        sample: 数据集的随机样本
+        summary: duckdb_engine.summarize_parquet 的结果
+    """
+    profile = profile_frame(sample)
+    by_name = {row["column_name"]: row for row in summary}
+    for column in profile["columns"]:
+        row = by_name.get(column["name"])
+        if row is None:
+            continue
+        column["n_unique"] = int(row["approx_unique"])
+        column["null_rate"] = round(float(row["null_percentage"]) / 100, 4)
+        if "min" in column:
+            column["min"], column["max"] = row["min"], row["max"]
+    profile["rows"] = int(summary[0]["count"]) if summary else len(sample)
+    profile["out_of_core"] = True
+    profile["sample_rows"] = len(sample)
+    return profile
+
+
+def _column_line(column: Dict[str, Any]) -> str:
+    parts = [column["dtype"]]
+    if column.get("n_unique") is not None:
+        parts.append(f"{column['n_unique']} unique")
+    if column["null_rate"]:
+        parts.append(f"{column['null_rate']:.1%} null")
+    if "min" in column:
+        parts.append(f"range {column['min']} .. {column['max']}")
+    elif column["samples"]:
+        parts.append("e.g. " + ", ".join(column["samples"]))
+    return f"- {column['name']}: " + ", ".join(parts)
+
+
+def format_profiles(names: List[str], profiles: List[Dict[str, Any]], table_names: Optional[List[str]] = None) -> str:
+    """
+    把会话中各数据集的画像格式化为提示词中的紧凑文本
+
+    默认按 pandas 的命名（dfs[i]，分析 agent 的工具中为 df1、df2 ...）；传入 table_names 时按 SQL 表名标注。
+    """
+    blocks = []
+    for i, (name, profile) in enumerate(zip(names, profiles)):
+        columns = profile["columns"]
+        label = table_names[i] if table_names else f"dfs[{i}] / df{i + 1}"
+        lines = [f"{label} ({name}): {profile['rows']} rows x {len(columns)} columns"]
+        if profile.get("out_of_core") and not table_names:
+            lines.append(
+                f"  NOTE: this dataset is too large to load; dfs[{i}] is only a random sample of {profile['sample_rows']} rows. "
+                f"For exact results over the full data, the final `result = ...` code can call sql(\"SELECT ... FROM t{i} ...\") "
+                f"(DuckDB SQL), which returns a DataFrame; sql() is only available there, not while exploring the data with tools."
+            )
+        lines.extend(_column_line(column) for column in columns[:DATASET_PROFILE_MAX_COLUMNS])
+        if len(columns) > DATASET_PROFILE_MAX_COLUMNS:
+            lines.append(f"- ... {len(columns) - DATASET_PROFILE_MAX_COLUMNS} more columns")
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
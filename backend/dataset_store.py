@@ -0,0 +1,379 @@
+"""
+会话级数据集缓存
+
+按 (session_id, 内容哈希) 在内存中保存已解析的 DataFrame，
+同一会话的后续轮次即使不再上传文件，也可以直接复用之前解析好的数据。
+缓存采用 LRU + 字节预算淘汰，并对长时间未访问的条目做 TTL 过期。
+内存中没有的数据集（已被淘汰，或由另一个工作进程加载）按内容哈希从列式磁盘缓存恢复。
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import duckdb_engine
+from columnar_cache import ColumnarCache, columnar_cache
+from dataset_profile import profile_frame, profile_from_summary
+from instrumentation import measure
+from serialization import json_safe_columns
+
+logger = logging.getLogger(__name__)
+
+# 缓存的总字节预算（默认 1GB）以及空闲过期时间（默认 1 小时）
+DATASET_CACHE_MAX_BYTES = int(os.getenv("DATASET_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+DATASET_CACHE_TTL_SECONDS = int(os.getenv("DATASET_CACHE_TTL_SECONDS", "3600"))
+
+# 超过阈值（默认 128MB，需小于上传上限 UPLOAD_MAX_FILE_BYTES）的 CSV 不再整体读入内存，而是转换为 Parquet 由 DuckDB 按需查询，
+# 生成代码中的 dfs[i] 只是 LARGE_FILE_SAMPLE_ROWS 行的随机样本
+LARGE_FILE_MODE = os.getenv("LARGE_FILE_MODE", "true").lower() in ("1", "true", "yes")
+LARGE_FILE_THRESHOLD_BYTES = int(os.getenv("LARGE_FILE_THRESHOLD_BYTES", str(128 * 1024 * 1024)))
+LARGE_FILE_SAMPLE_ROWS = int(os.getenv("LARGE_FILE_SAMPLE_ROWS", "50000"))
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path: str) -> str:
+    """计算文件内容的 SHA-256 哈希"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_large_file(file_path: str, size: Optional[int] = None) -> bool:
+    """是否按 out-of-core 模式处理该文件（目前只支持 CSV）"""
+    if not LARGE_FILE_MODE or not file_path.lower().endswith(".csv"):
+        return False
+    if size is None:
+        size = os.path.getsize(file_path)
+    return size > LARGE_FILE_THRESHOLD_BYTES
+
+
+def read_dataframe(file_path: str) -> pd.DataFrame:
+    """根据扩展名把 CSV / Excel 文件解析为 DataFrame"""
+    if file_path.endswith(".csv"):
+        return pd.read_csv(file_path)
+    elif file_path.endswith((".xlsx", ".xls")):
+        return pd.read_excel(file_path)
+    raise ValueError(f"Unsupported file type: {file_path}")
+
+
+@dataclass
+class DatasetSource:
+    """
+    待注册到会话中的一个数据集
+
+    至少提供 path 或 frame 之一；content_hash 已知时（上传时边写边算）不再重新读取文件计算哈希，
+    frame 已知时（上传时边接收边解析）不再解析文件。
+    """
+    name: str
+    path: Optional[str] = None
+    content_hash: Optional[str] = None
+    frame: Optional[pd.DataFrame] = None
+
+
+@dataclass
+class _Entry:
+    name: str
+    frame: pd.DataFrame
+    nbytes: int
+    last_access: float
+    parse_seconds: float = 0.0
+    # 上传时计算的数据集画像，见 dataset_profile.profile_frame
+    profile: Dict[str, Any] = field(default_factory=dict)
+
+
+class SessionDatasetStore:
+    """线程安全的会话数据集缓存，内存未命中时先查列式磁盘缓存，再解析原始文件"""
+
+    def __init__(self, max_bytes: int = DATASET_CACHE_MAX_BYTES, ttl_seconds: int = DATASET_CACHE_TTL_SECONDS,
+                 disk_cache: ColumnarCache = columnar_cache):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_cache = disk_cache
+        self._lock = threading.RLock()
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._total_bytes = 0
+
+    def add_files(self, session_id: str, file_paths: List[str], names: Optional[List[str]] = None,
+                  load_stats: Optional[List[Dict]] = None) -> List[Dict[str, str]]:
+        """把文件注册到会话中，参见 add_sources"""
+        names = names or [os.path.basename(path) for path in file_paths]
+        sources = [DatasetSource(name=name, path=path) for path, name in zip(file_paths, names)]
+        return self.add_sources(session_id, sources, load_stats)
+
+    def add_sources(self, session_id: str, sources: List[DatasetSource],
+                    load_stats: Optional[List[Dict]] = None) -> List[Dict[str, str]]:
+        """
+        把数据集注册到会话中，已缓存的相同内容不会被重复解析
+
+        Args:
+            load_stats: 可选，传入列表时追加每个文件的解析统计 {"name", "cached", "source", "parse_seconds"}，
+                source 为 memory（会话内存缓存）、columnar（列式磁盘缓存）、stream（上传时已流式解析）
+                或 file（解析原始文件）
+
+        Returns:
+            数据集引用列表 [{"name": ..., "hash": ...}]，按 sources 顺序排列
+        """
+        refs = []
+        for source in sources:
+            name = source.name
+            content_hash = source.content_hash or hash_file(source.path)
+            key = (session_id, content_hash)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._touch(key, entry)
+            cached = entry is not None
+            origin = "memory"
+            if not cached:
+                start = time.perf_counter()
+                frame, profile, origin = self._load(source, content_hash)
+                parse_seconds = time.perf_counter() - start
+                entry = _Entry(
+                    name=name,
+                    frame=frame,
+                    nbytes=int(frame.memory_usage(deep=True).sum()),
+                    last_access=time.monotonic(),
+                    parse_seconds=parse_seconds,
+                    profile=profile,
+                )
+                self._put(key, entry)
+                logger.info(f"数据集已加载并缓存: session={session_id}, name={name}, hash={content_hash[:12]}, "
+                            f"source={origin}, rows={len(frame)}, 加载耗时={parse_seconds:.3f}s")
+            else:
+                logger.info(f"数据集缓存命中: session={session_id}, name={name}, hash={content_hash[:12]}")
+            if load_stats is not None:
+                load_stats.append({
+                    "name": name,
+                    "cached": cached,
+                    "source": origin,
+                    "parse_seconds": 0.0 if cached else round(entry.parse_seconds, 4),
+                })
+            ref = {"name": name, "hash": content_hash}
+            if entry.profile.get("out_of_core"):
+                ref["out_of_core"] = True
+            refs.append(ref)
+        return refs
+
+    def _load(self, source: DatasetSource, content_hash: str) -> Tuple[pd.DataFrame, Dict[str, Any], str]:
+        """返回 (DataFrame, 画像, 来源)；优先读取列式缓存，未命中时解析文件并写入列式缓存"""
+        if source.frame is None and is_large_file(source.path):
+            with measure("load_out_of_core", kind="load", dataset=source.name):
+                return self._load_out_of_core(source, content_hash)
+        with measure("load_columnar", kind="load", dataset=source.name) as record:
+            frame = self.disk_cache.load(content_hash)
+            record["hit"] = frame is not None
+        if frame is not None:
+            profile = self.disk_cache.load_profile(content_hash) or profile_frame(frame)
+            return frame, profile, "columnar"
+        if source.frame is not None:
+            frame, origin = source.frame, "stream"
+        else:
+            with measure("load_file", kind="load", dataset=source.name):
+                frame, origin = read_dataframe(source.path), "file"
+        # 分析 agent、代码执行工作进程（读取 Arrow 文件）和 DuckDB 看到的列名必须相同
+        frame = json_safe_columns(frame)
+        with measure("profile", kind="load", dataset=source.name):
+            profile = profile_frame(frame)
+        with measure("columnar_store", kind="load", dataset=source.name):
+            stored = self.disk_cache.store(content_hash, frame, profile)
+        if stored:
+            # 使用从缓存读回的表，与工作进程内存映射得到的表完全一致（类型转换等也相同）
+            cached = self.disk_cache.load(content_hash)
+            if cached is not None:
+                frame = cached
+        return frame, profile, origin
+
+    def _load_out_of_core(self, source: DatasetSource, content_hash: str) -> Tuple[pd.DataFrame, Dict[str, Any], str]:
+        """超大 CSV：转换为 Parquet（已转换过则直接复用），内存中只保留随机样本"""
+        parquet_path = self.disk_cache.parquet_path(content_hash)
+        origin = "columnar"
+        if not self.disk_cache.has_parquet(content_hash):
+            os.makedirs(self.disk_cache.directory, exist_ok=True)
+            duckdb_engine.csv_to_parquet(source.path, parquet_path)
+            self.disk_cache.evict()
+            origin = "file"
+        sample = duckdb_engine.sample_parquet(parquet_path, LARGE_FILE_SAMPLE_ROWS)
+        profile = self.disk_cache.load_parquet_profile(content_hash)
+        if profile is None:
+            profile = profile_from_summary(sample, duckdb_engine.summarize_parquet(parquet_path))
+            self.disk_cache.store_parquet_profile(content_hash, profile)
+        logger.info(f"超大数据集使用 out-of-core 模式: name={source.name}, hash={content_hash[:12]}, "
+                    f"rows={profile['rows']}, sample_rows={len(sample)}")
+        return sample, profile, origin
+
+    def parquet_paths(self, refs: List[Dict[str, str]]) -> List[Optional[str]]:
+        """与 refs 对应的 Parquet 文件路径，非 out-of-core 数据集为 None"""
+        return [self.disk_cache.parquet_path(ref["hash"]) if ref.get("out_of_core") else None for ref in refs]
+
+    def arrow_paths(self, refs: List[Dict[str, str]]) -> List[Optional[str]]:
+        """与 refs 对应的列式缓存文件（绝对路径），供其它进程内存映射读取；没有缓存文件时为 None"""
+        paths = []
+        for ref in refs:
+            path = self.disk_cache.path(ref["hash"])
+            usable = self.disk_cache.enabled and not ref.get("out_of_core") and os.path.exists(path)
+            paths.append(os.path.abspath(path) if usable else None)
+        return paths
+
+    def get_frames(self, session_id: str, refs: List[Dict[str, str]]) -> Optional[List[pd.DataFrame]]:
+        """按引用取回会话的 DataFrame；内存中没有的数据集从列式缓存恢复，仍然找不到任意一个时返回 None"""
+        frames = []
+        for ref in refs:
+            entry = self._entry(session_id, ref)
+            if entry is None:
+                return None
+            frames.append(entry.frame)
+        return frames
+
+    def get_profiles(self, session_id: str, refs: List[Dict[str, str]]) -> Optional[List[Dict[str, Any]]]:
+        """按引用取回数据集画像（内存中没有时读取列式缓存中保存的画像）；任意一个找不到时返回 None"""
+        profiles = []
+        for ref in refs:
+            with self._lock:
+                self._purge_expired()
+                entry = self._entries.get((session_id, ref["hash"]))
+            if entry is not None:
+                profile = entry.profile
+            elif ref.get("out_of_core"):
+                profile = self.disk_cache.load_parquet_profile(ref["hash"])
+            else:
+                profile = self.disk_cache.load_profile(ref["hash"])
+            if profile is None:
+                return None
+            profiles.append(profile)
+        return profiles
+
+    def _entry(self, session_id: str, ref: Dict[str, str]) -> Optional[_Entry]:
+        key = (session_id, ref["hash"])
+        with self._lock:
+            self._purge_expired()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._touch(key, entry)
+                return entry
+        entry = self._restore(ref)
+        if entry is not None:
+            self._put(key, entry)
+        return entry
+
+    def _restore(self, ref: Dict[str, str]) -> Optional[_Entry]:
+        """
+        从列式缓存恢复内存中没有的数据集：已被内存缓存淘汰，或者是由另一个工作进程上传和加载的
+        （多个 uvicorn 工作进程共享同一个列式缓存目录）
+        """
+        content_hash = ref["hash"]
+        start = time.perf_counter()
+        if ref.get("out_of_core"):
+            if not self.disk_cache.has_parquet(content_hash):
+                return None
+            frame, profile, _ = self._load_out_of_core(DatasetSource(name=ref["name"]), content_hash)
+        else:
+            frame = self.disk_cache.load(content_hash)
+            if frame is None:
+                return None
+            profile = self.disk_cache.load_profile(content_hash) or profile_frame(frame)
+        parse_seconds = time.perf_counter() - start
+        logger.info(f"数据集已从列式缓存恢复: name={ref['name']}, hash={content_hash[:12]}, 耗时={parse_seconds:.3f}s")
+        return _Entry(
+            name=ref["name"],
+            frame=frame,
+            nbytes=int(frame.memory_usage(deep=True).sum()),
+            last_access=time.monotonic(),
+            parse_seconds=parse_seconds,
+            profile=profile,
+        )
+
+    def drop_session(self, session_id: str) -> None:
+        """移除某个会话的全部数据集"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == session_id]:
+                self._remove(key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "sessions": len({k[0] for k in self._entries}),
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _touch(self, key: Tuple[str, str], entry: _Entry) -> None:
+        entry.last_access = time.monotonic()
+        self._entries.move_to_end(key)
+
+    def _put(self, key: Tuple[str, str], entry: _Entry) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._total_bytes += entry.nbytes
+            self._purge_expired()
+            # 按 LRU 顺序淘汰，直到回到预算之内；刚写入的条目始终保留
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                oldest_key = next(iter(self._entries))
+                logger.info(f"数据集缓存超出预算，淘汰: session={oldest_key[0]}, hash={oldest_key[1][:12]}")
+                self._remove(oldest_key)
+
+    def _purge_expired(self) -> None:
+        deadline = time.monotonic() - self.ttl_seconds
+        for key in [k for k, e in self._entries.items() if e.last_access < deadline]:
+            logger.info(f"数据集缓存过期: session={key[0]}, hash={key[1][:12]}")
+            self._remove(key)
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        entry = self._entries.pop(key)
+        self._total_bytes -= entry.nbytes
+
+
+class RequestDatasetLoader:
+    """
+    请求级数据集加载器
+
+    一次请求内只向缓存查找（或解析）一次数据集，之后各个节点拿到的都是同一组 DataFrame 的
+    浅拷贝视图；配合 pandas 的 copy-on-write 模式，生成代码对视图的修改不会污染缓存中的原始数据。
+    """
+
+    def __init__(self, store: SessionDatasetStore, session_id: str):
+        self.store = store
+        self.session_id = session_id
+        self.load_stats: List[Dict] = []
+        self._frames: Optional[List[pd.DataFrame]] = None
+        self._refs: Optional[List[Dict[str, str]]] = None
+
+    def add_files(self, file_paths: List[str], names: Optional[List[str]] = None) -> List[Dict[str, str]]:
+        return self.store.add_files(self.session_id, file_paths, names, load_stats=self.load_stats)
+
+    def add_sources(self, sources: List[DatasetSource]) -> List[Dict[str, str]]:
+        return self.store.add_sources(self.session_id, sources, load_stats=self.load_stats)
+
+    def get_frames(self, refs: List[Dict[str, str]]) -> Optional[List[pd.DataFrame]]:
+        """返回本次请求的数据集视图；数据集已被淘汰时返回 None"""
+        if self._frames is None or self._refs != refs:
+            self._frames = self.store.get_frames(self.session_id, refs)
+            self._refs = refs
+        if self._frames is None:
+            return None
+        return [frame.copy(deep=False) for frame in self._frames]
+
+    def get_profiles(self, refs: List[Dict[str, str]]) -> Optional[List[Dict[str, Any]]]:
+        """返回数据集画像；数据集已被淘汰时返回 None"""
+        return self.store.get_profiles(self.session_id, refs)
+
+    def parquet_paths(self, refs: List[Dict[str, str]]) -> List[Optional[str]]:
+        return self.store.parquet_paths(refs)
+
+    def arrow_paths(self, refs: List[Dict[str, str]]) -> List[Optional[str]]:
+        return self.store.arrow_paths(refs)
+
+
+dataset_store = SessionDatasetStore()
@@ -0,0 +1,162 @@
+"""
+嵌入式 DuckDB 查询引擎
+
+- 超大 CSV 在上传时由 DuckDB 流式转换为 Parquet，之后按需扫描，内存占用与文件大小无关
+  （超过 DUCKDB_MEMORY_LIMIT 的中间结果会溢写到 DUCKDB_TEMP_DIR）；
+- 为会话中的数据集创建视图 t0、t1 ...（与 dfs[0]、dfs[1] ... 一一对应），
+  内存中的 DataFrame 直接注册，超大数据集指向 Parquet 文件；
+- 查询有超时（到时中断）和结果行数上限。
+"""
+
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+import duckdb
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT", "2GB")
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", str(os.cpu_count() or 4)))
+DUCKDB_TEMP_DIR = os.getenv("DUCKDB_TEMP_DIR", "duckdb_tmp")
+DUCKDB_QUERY_TIMEOUT_SECONDS = float(os.getenv("DUCKDB_QUERY_TIMEOUT_SECONDS", "60"))
+# 查询结果转换为 DataFrame 时的最大行数，防止 SELECT * 把整个大文件读进内存
+DUCKDB_MAX_RESULT_ROWS = int(os.getenv("DUCKDB_MAX_RESULT_ROWS", "1000000"))
+
+
+class QueryTimeoutError(Exception):
+    """查询超过时间限制被中断"""
+
+
+def is_resource_error(error: BaseException) -> bool:
+    """查询超时或超出内存：与查询的写法无关，同样的查询重试也不会成功"""
+    return isinstance(error, (QueryTimeoutError, duckdb.InterruptException, duckdb.OutOfMemoryException))
+
+
+def query_error_details(error: BaseException) -> Optional[str]:
+    """查询本身的错误（语法、表名列名、类型等）的说明，用于让模型修正查询；资源问题和其他异常返回 None"""
+    if not isinstance(error, duckdb.Error) or is_resource_error(error):
+        return None
+    return f"{type(error).__name__}: {error}"
+
+
+def table_name(index: int) -> str:
+    """第 index 个数据集在 SQL 中的表名"""
+    return f"t{index}"
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def connect() -> duckdb.DuckDBPyConnection:
+    """创建带内存上限和线程数配置的内存数据库连接"""
+    os.makedirs(DUCKDB_TEMP_DIR, exist_ok=True)
+    return duckdb.connect(":memory:", config={
+        "memory_limit": DUCKDB_MEMORY_LIMIT,
+        "threads": DUCKDB_THREADS,
+        "temp_directory": DUCKDB_TEMP_DIR,
+    })
+
+
+def csv_to_parquet(csv_path: str, parquet_path: str) -> None:
+    """把 CSV 流式转换为 Parquet（先写临时文件再原子替换）"""
+    tmp_path = f"{parquet_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    con = connect()
+    try:
+        con.execute(
+            f"COPY (SELECT * FROM read_csv_auto(?)) TO {_quote(tmp_path)} (FORMAT PARQUET, COMPRESSION ZSTD)",
+            [csv_path],
+        )
+        os.replace(tmp_path, parquet_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        con.close()
+
+
+def sample_parquet(parquet_path: str, rows: int) -> pd.DataFrame:
+    """从 Parquet 文件中抽取 rows 行的随机样本"""
+    con = connect()
+    try:
+        return con.execute(
+            f"SELECT * FROM read_parquet(?) USING SAMPLE reservoir({int(rows)} ROWS) REPEATABLE (42)",
+            [parquet_path],
+        ).df()
+    finally:
+        con.close()
+
+
+def summarize_parquet(parquet_path: str) -> List[Dict[str, Any]]:
+    """对 Parquet 文件做 SUMMARIZE，返回逐列的统计信息"""
+    con = connect()
+    try:
+        return con.execute(f"SUMMARIZE SELECT * FROM read_parquet({_quote(parquet_path)})").df().to_dict("records")
+    finally:
+        con.close()
+
+
+def register_datasets(con: duckdb.DuckDBPyConnection, frames: List[pd.DataFrame],
+                      parquet_paths: List[Optional[str]]) -> None:
+    """
+    为数据集创建视图 t0、t1 ...
+
+    Args:
+        frames: 会话中的 DataFrame（超大数据集时为样本）
+        parquet_paths: 与 frames 对应；不为 None 时视图指向该 Parquet 文件（完整数据）
+    """
+    for i, (frame, parquet_path) in enumerate(zip(frames, parquet_paths)):
+        if parquet_path:
+            con.execute(f"CREATE VIEW {table_name(i)} AS SELECT * FROM read_parquet({_quote(parquet_path)})")
+        else:
+            con.register(table_name(i), frame)
+
+
+def run_query(con: duckdb.DuckDBPyConnection, query: str, timeout: float = DUCKDB_QUERY_TIMEOUT_SECONDS,
+              max_rows: int = DUCKDB_MAX_RESULT_ROWS) -> pd.DataFrame:
+    """
+    执行查询并返回 DataFrame，超过 timeout 秒时中断查询，结果最多取 max_rows 行
+
+    Raises:
+        QueryTimeoutError: 查询超时
+    """
+    timer = threading.Timer(timeout, con.interrupt)
+    timer.start()
+    try:
+        relation = con.sql(query)
+        if relation is None:
+            # DDL 等没有结果集的语句
+            return pd.DataFrame()
+        return relation.limit(max_rows).df()
+    except duckdb.InterruptException as e:
+        raise QueryTimeoutError(f"SQL query exceeded {timeout:g}s and was interrupted") from e
+    finally:
+        timer.cancel()
+
+
+class SQLSession:
+    """
+    会话数据集上的 SQL 执行器，第一次查询时才创建连接并注册数据集
+
+    实例可直接作为生成代码中的 sql(query) 函数调用，返回 DataFrame。
+    """
+
+    def __init__(self, frames: List[pd.DataFrame], parquet_paths: List[Optional[str]]):
+        self.frames = frames
+        self.parquet_paths = parquet_paths
+        self._con: Optional[duckdb.DuckDBPyConnection] = None
+
+    def __call__(self, query: str) -> pd.DataFrame:
+        if self._con is None:
+            self._con = connect()
+            register_datasets(self._con, self.frames, self.parquet_paths)
+        return run_query(self._con, query)
+
+    def close(self) -> None:
+        if self._con is not None:
+            self._con.close()
+            self._con = None
@@ -0,0 +1,210 @@
+"""
+分析流程的分阶段计时与资源统计
+
+每个图节点、文件加载步骤和生成代码的执行都作为一个"阶段"记录：墙钟时间、CPU 时间、进程 RSS 变化，
+节点阶段还包括 LLM 调用次数、token 数和 agent 的工具调用次数。所有阶段都会计入 metrics
+（/metrics 端点的 analysis_stage_* 指标）；请求处于 request_timings() 上下文中时，还会收集到
+该请求的 RequestTimings，可以随响应返回（timings 字段）。
+
+说明：
+- CPU 时间是进程级的（time.process_time），并发处理多个请求时会包含其他请求的 CPU 时间；
+  生成代码在独立工作进程中执行，其 CPU 时间和峰值内存由工作进程上报，记录在 code_exec 阶段的
+  worker_cpu_seconds / worker_peak_rss_bytes 中。
+- 内存变化是阶段前后的进程 RSS 之差，只在能读取 /proc/self/statm 的系统上提供。
+"""
+
+import functools
+import inspect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+import metrics
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes() -> Optional[int]:
+    """当前进程的常驻内存（字节），无法读取时为 None"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """按图节点累计 LLM 调用次数、token 数和工具调用次数（节点名取自 LangGraph 写入的 metadata）"""
+
+    # 在触发事件的调用中同步执行，请求返回前所有用量都已计入
+    run_inline = True
+
+    def __init__(self, timings: "RequestTimings"):
+        self.timings = timings
+        self._run_nodes: Dict[UUID, str] = {}
+
+    def _start_llm(self, run_id: UUID, metadata: Optional[Dict[str, Any]]) -> None:
+        self._run_nodes[run_id] = (metadata or {}).get("langgraph_node", "unknown")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata=None, **kwargs) -> None:
+        self._start_llm(run_id, metadata)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, metadata=None, **kwargs) -> None:
+        self._start_llm(run_id, metadata)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs) -> None:
+        node = self._run_nodes.pop(run_id, "unknown")
+        prompt_tokens, completion_tokens = _token_usage(response)
+        self.timings.add_usage(node, llm_calls=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        self._run_nodes.pop(run_id, None)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, metadata=None, **kwargs) -> None:
+        self.timings.add_usage((metadata or {}).get("langgraph_node", "unknown"), tool_calls=1)
+
+
+def _token_usage(response: LLMResult):
+    """从模型响应中取 (prompt_tokens, completion_tokens)，兼容 usage_metadata 和 OpenAI 的 token_usage"""
+    prompt_tokens = completion_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                prompt_tokens += usage.get("input_tokens", 0)
+                completion_tokens += usage.get("output_tokens", 0)
+    if not (prompt_tokens or completion_tokens):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+    return prompt_tokens, completion_tokens
+
+
+class RequestTimings:
+    """一次请求内各阶段的统计，线程安全（文件加载和代码执行在线程池中记录）"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages: List[Dict[str, Any]] = []
+        self._usage: Dict[str, Dict[str, int]] = {}
+        self.callback = UsageCallbackHandler(self)
+
+    def record(self, stage: Dict[str, Any]) -> None:
+        with self._lock:
+            self._stages.append(stage)
+
+    def add_usage(self, node: str, **counts: int) -> None:
+        with self._lock:
+            usage = self._usage.setdefault(node, {"llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "tool_calls": 0})
+            for name, value in counts.items():
+                usage[name] += value
+        for name, value in counts.items():
+            if not value:
+                continue
+            if name.endswith("_tokens"):
+                metrics.inc("llm_tokens_total", value, node=node, type=name[:-len("_tokens")])
+            else:
+                metrics.inc(f"{name}_total", value, node=node)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        {"total_seconds", "stages": [...]}，阶段按完成顺序排列
+
+        节点阶段合并该节点的 LLM 用量；同一节点执行了多次（如代码执行失败后重新分析）时，用量合计在最后一次上。
+        """
+        with self._lock:
+            stages = [dict(stage) for stage in self._stages]
+            usage = {node: dict(counts) for node, counts in self._usage.items()}
+        for stage in reversed(stages):
+            if stage.get("kind") == "node":
+                stage.update(usage.pop(stage["stage"], {}))
+        return {
+            "total_seconds": round(time.perf_counter() - self.started_at, 4),
+            "stages": stages,
+        }
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+@contextmanager
+def request_timings() -> Iterator[RequestTimings]:
+    """在上下文中收集当前请求的阶段统计；已经处于某个请求的上下文中时沿用它"""
+    timings = _current.get()
+    if timings is not None:
+        yield timings
+        return
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # 异步生成器（流式接口）可能在另一个上下文中被关闭，此时上下文变量已不属于当前上下文
+            pass
+
+
+@contextmanager
+def measure(stage: str, kind: str = "step", **info: Any) -> Iterator[Dict[str, Any]]:
+    """
+    统计一个阶段，计入 metrics 和当前请求的 RequestTimings
+
+    Args:
+        stage: 阶段名，作为指标的 stage 标签
+        kind: node（图节点）、load（数据集加载）或 step（其他步骤）
+        info: 附加到该阶段记录上的信息（如文件名）
+
+    Yields:
+        阶段记录字典，调用方可以在其中补充字段（如工作进程上报的 CPU 时间）
+    """
+    record: Dict[str, Any] = {"stage": stage, "kind": kind, **info}
+    rss_before = rss_bytes()
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        record["failed"] = True
+        raise
+    finally:
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        rss_after = rss_bytes()
+        record["wall_seconds"] = round(wall, 6)
+        record["cpu_seconds"] = round(cpu, 6)
+        if rss_before is not None and rss_after is not None:
+            record["memory_delta_bytes"] = rss_after - rss_before
+        metrics.observe("analysis_stage_duration_seconds", wall, stage=stage)
+        metrics.inc("analysis_stage_cpu_seconds_total", cpu, stage=stage)
+        timings = _current.get()
+        if timings is not None:
+            timings.record(record)
+
+
+def instrument_node(name: str, node):
+    """包装图节点（同步或异步），每次执行记录为一个 node 阶段；保留 config 参数，LangGraph 据此传入配置"""
+    if inspect.iscoroutinefunction(node):
+        @functools.wraps(node)
+        async def wrapper(*args, **kwargs):
+            with measure(name, kind="node"):
+                return await node(*args, **kwargs)
+    else:
+        @functools.wraps(node)
+        def wrapper(*args, **kwargs):
+            with measure(name, kind="node"):
+                return node(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,185 @@
+"""
+LLM 响应缓存
+
+包装在各节点使用的 chat model 上（通过 LangChain 的 cache 参数），当消息列表和模型参数与之前某次调用完全相同时
+直接返回缓存的响应，不再请求 OpenAI。
+- 后端：进程内 LRU（memory）或磁盘上的 SQLite（sqlite），也可以关闭（none）
+- 缓存键：去掉消息 id、响应元数据等易变字段后的消息列表 + 模型参数
+- 每个节点可单独开启/关闭，并分别统计命中率
+任何 BaseChatModel（包括离线测试用的 fake chat model）都可以使用。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.language_models import BaseChatModel
+from langchain_core._api import LangChainBetaWarning
+from langchain_core.load import dumps, loads
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory")  # memory | sqlite | none
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_SQLITE_PATH = os.getenv("LLM_CACHE_SQLITE_PATH", "llm_cache.sqlite3")
+# 开启缓存的节点，逗号分隔；可选 router, analysis, summary, chat, combined（ROUTER_MODE=combined 的合并调用）
+LLM_CACHE_NODES = {node.strip() for node in os.getenv("LLM_CACHE_NODES", "router,analysis,summary").split(",") if node.strip()}
+
+# 序列化消息中与内容无关、每次调用都会变化的字段
+_VOLATILE_MESSAGE_FIELDS = {"id", "response_metadata", "usage_metadata"}
+
+
+def _normalize(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        normalized = {k: _normalize(v) for k, v in obj.items()}
+        if isinstance(normalized.get("kwargs"), dict):
+            normalized["kwargs"] = {k: v for k, v in normalized["kwargs"].items() if k not in _VOLATILE_MESSAGE_FIELDS}
+        return normalized
+    if isinstance(obj, list):
+        return [_normalize(v) for v in obj]
+    return obj
+
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    """由序列化的消息列表和模型参数生成缓存键"""
+    try:
+        prompt = json.dumps(_normalize(json.loads(prompt)), sort_keys=True, ensure_ascii=False)
+    except ValueError:
+        pass
+    return hashlib.sha256(f"{llm_string}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+class LRUCache(BaseCache):
+    """进程内 LRU 缓存"""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, RETURN_VAL_TYPE]" = OrderedDict()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        with self._lock:
+            value = self._entries.get(prompt)
+            if value is not None:
+                self._entries.move_to_end(prompt)
+            return value
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        with self._lock:
+            self._entries[prompt] = return_val
+            self._entries.move_to_end(prompt)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache(BaseCache):
+    """磁盘上的 SQLite 缓存，重启后依然有效；超过容量时淘汰最久未访问的条目"""
+
+    def __init__(self, path: str = LLM_CACHE_SQLITE_PATH, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM llm_cache WHERE key = ?", (prompt,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), prompt))
+            self._conn.commit()
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", LangChainBetaWarning)
+                return loads(row[0])
+        except Exception as e:
+            logger.warning(f"LLM 缓存条目反序列化失败，忽略: {e}")
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        value = dumps(list(return_val))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, last_access) VALUES (?, ?, ?)",
+                (prompt, value, time.time()),
+            )
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key NOT IN "
+                "(SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+
+class NodeCache(BaseCache):
+    """为某个节点包装共享的缓存后端：归一化缓存键并统计命中率"""
+
+    def __init__(self, backend: BaseCache, node: str):
+        self.backend = backend
+        self.node = node
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        value = self.backend.lookup(cache_key(prompt, llm_string), llm_string)
+        metrics.inc("llm_cache_requests_total", node=self.node, result="hit" if value is not None else "miss")
+        return value
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        self.backend.update(cache_key(prompt, llm_string), llm_string, return_val)
+
+    def clear(self, **kwargs: Any) -> None:
+        self.backend.clear(**kwargs)
+
+
+def create_backend(backend: str = LLM_CACHE_BACKEND) -> Optional[BaseCache]:
+    if backend == "memory":
+        return LRUCache()
+    if backend == "sqlite":
+        return SQLiteCache()
+    if backend != "none":
+        logger.warning(f"未知的 LLM_CACHE_BACKEND: {backend}，不启用 LLM 缓存")
+    return None
+
+
+_backend = create_backend()
+
+
+def with_cache(model: BaseChatModel, node: str, backend: Optional[BaseCache] = None) -> BaseChatModel:
+    """
+    返回带缓存的模型副本；该节点未开启缓存或未配置后端时原样返回
+
+    Args:
+        model: 任意 chat model
+        node: 节点名，用于开关判断和命中率统计
+        backend: 缓存后端，默认使用 LLM_CACHE_BACKEND 配置的全局后端
+    """
+    backend = backend or _backend
+    if backend is None or node not in LLM_CACHE_NODES:
+        return model
+    return model.model_copy(update={"cache": NodeCache(backend, node)})
+
+
+def stats() -> Dict[str, Any]:
+    return {"backend": LLM_CACHE_BACKEND, "nodes": sorted(LLM_CACHE_NODES)}
@@ -1,18 +1,40 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from typing import List
-import shutil
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query
+from typing import Awaitable, Callable, Dict, List
+from contextlib import AsyncExitStack, asynccontextmanager
 import os
 import uuid
 import logging
-from analysis_agent import run_analysis
-from fastapi.responses import JSONResponse
+from analysis_agent import run_analysis_async, stream_analysis_async
+from worker_pool import analysis_pool, PoolFullError
+import metrics
+from instrumentation import request_timings, rss_bytes
+from dataset_store import dataset_store, DatasetSource
+from upload_ingest import receive_upload, UploadSizeLimitMiddleware, UploadTooLargeError
+from columnar_cache import columnar_cache
+from code_executor import code_executor
+from session_store import session_checkpointer
+from result_store import result_store, InvalidSortError, RESULT_PAGE_MAX_LIMIT
+from serialization import RawJSON, dumps_response, records_json
+import llm_cache
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="AI Data Analysis API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 预先启动执行生成代码的工作进程，第一个请求不必等待解释器启动
+    await run_in_threadpool(code_executor.start)
+    yield
+    code_executor.shutdown()
+
+app = FastAPI(title="AI Data Analysis API", version="1.0.0", lifespan=lifespan)
+
+# 限制上传请求体大小，超限的请求在接收阶段就返回 413（放在 CORS 之内，413 响应同样带有 CORS 头）
+app.add_middleware(UploadSizeLimitMiddleware)
 
 # 配置CORS - 专门为Vercel前端部署优化
 app.add_middleware(
@@ -33,11 +55,80 @@ app.add_middleware(
 TEMP_DIR = "temp_file"
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+async def receive_uploaded_files(files: List[UploadFile]) -> List[DatasetSource]:
+    """
+    校验并流式接收上传的文件，接收的同时计算内容哈希并检查单文件大小上限
+    
+    Returns:
+        上传的数据集列表（临时文件路径、原始文件名、内容哈希）
+    """
+    sources: List[DatasetSource] = []
+    
+    # 如果有文件，处理文件上传
+    if files and len(files) > 0 and files[0].filename:  # 检查是否真的有文件
+        logger.info(f"处理 {len(files)} 个文件")
+        
+        # 验证文件数量
+        if len(files) > 10:  # 限制最大文件数量
+            raise HTTPException(status_code=400, detail="最多支持上传10个文件")
+        
+        # 处理每个上传的文件
+        for i, file in enumerate(files):
+            # 验证文件类型
+            if not file.filename:
+                continue  # 跳过空文件
+            
+            file_ext = file.filename.split('.')[-1].lower()
+            if file_ext not in ['csv', 'xlsx', 'xls']:
+                cleanup_temp_files(upload_paths(sources))
+                raise HTTPException(
+                    status_code=400, 
+                    detail=f"不支持的文件类型: {file.filename}. 仅支持 CSV, XLSX, XLS 文件"
+                )
+            
+            # 按块写入临时目录（生成唯一文件名，保留原始扩展名），写入时计算哈希，不阻塞事件循环
+            try:
+                sources.append(await run_in_threadpool(receive_upload, file.file, file.filename, file_ext, TEMP_DIR, file.size))
+            except UploadTooLargeError as e:
+                logger.warning(f"上传文件过大: {file.filename}, {str(e)}")
+                cleanup_temp_files(upload_paths(sources))
+                raise HTTPException(status_code=413, detail=str(e))
+            except Exception as e:
+                logger.error(f"保存文件失败: {file.filename}, 错误: {str(e)}")
+                # 清理已保存的文件
+                cleanup_temp_files(upload_paths(sources))
+                raise HTTPException(status_code=500, detail=f"保存文件失败: {str(e)}")
+    
+    return sources
+
+def upload_paths(sources: List[DatasetSource]) -> List[str]:
+    """上传文件对应的临时文件路径（流式解析的 CSV 没有临时文件）"""
+    return [source.path for source in sources if source.path]
+
+def cleanup_temp_files(file_paths: List[str]):
+    """删除临时文件（解析后的数据已缓存在会话数据集中）"""
+    for file_path in file_paths:
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                logger.info(f"临时文件已清理: {file_path}")
+        except Exception as e:
+            logger.warning(f"清理临时文件失败 {file_path}: {e}")
+
+def pool_full_exception(e: PoolFullError) -> HTTPException:
+    logger.warning(f"分析队列已满，拒绝请求: {str(e)}")
+    return HTTPException(
+        status_code=503,
+        detail="服务器繁忙，分析队列已满，请稍后重试",
+        headers={"Retry-After": "5"}
+    )
+
 @app.post("/analyze")
 async def analyze_files(
     files: List[UploadFile] = File(default=[]),
     prompt: str = Form(default="请分析数据"),
-    session_id: str = Form(default="")
+    session_id: str = Form(default=""),
+    timings: bool = Form(default=False)
 ):
     """
     分析多个上传的文件
@@ -46,95 +137,169 @@ async def analyze_files(
         files: 上传的文件列表 (支持 CSV, XLSX，可选)
         prompt: 分析指令
         session_id: 会话ID，用于保持对话历史连续性
+        timings: 为 true 时在响应中附带各阶段（上传解析、数据集加载、图节点、代码执行）的耗时和资源统计
         
     Returns:
         分析结果的JSON响应
     """
     logger.info(f"收到分析请求: prompt='{prompt}', session_id='{session_id}', files_count={len(files) if files else 0}")
     
-    try:
-        file_paths = []
-        
-        # 如果没有提供session_id，生成一个新的
-        if not session_id:
-            session_id = str(uuid.uuid4())
-            logger.info(f"生成新的session_id: {session_id}")
+    # 上传文件的接收和解析也计入本次请求的阶段统计
+    with request_timings():
+        try:
+            # 如果没有提供session_id，生成一个新的
+            if not session_id:
+                session_id = str(uuid.uuid4())
+                logger.info(f"生成新的session_id: {session_id}")
         
-        # 如果有文件，处理文件上传
-        if files and len(files) > 0 and files[0].filename:  # 检查是否真的有文件
-            logger.info(f"处理 {len(files)} 个文件")
-            
-            # 验证文件数量
-            if len(files) > 10:  # 限制最大文件数量
-                raise HTTPException(status_code=400, detail="最多支持上传10个文件")
-            
-            # 处理每个上传的文件
-            for i, file in enumerate(files):
-                # 验证文件类型
-                if not file.filename:
-                    continue  # 跳过空文件
-                
-                file_ext = file.filename.split('.')[-1].lower()
-                if file_ext not in ['csv', 'xlsx', 'xls']:
-                    raise HTTPException(
-                        status_code=400, 
-                        detail=f"不支持的文件类型: {file.filename}. 仅支持 CSV, XLSX, XLS 文件"
-                    )
-                
-                # 生成唯一文件名，保留原始扩展名
-                unique_filename = f"{uuid.uuid4().hex}.{file_ext}"
-                file_path = os.path.join(TEMP_DIR, unique_filename)
-                
-                # 保存文件
-                try:
-                    with open(file_path, "wb") as buffer:
-                        shutil.copyfileobj(file.file, buffer)
-                    file_paths.append(file_path)
-                    logger.info(f"文件保存成功: {file.filename} -> {file_path}")
-                except Exception as e:
-                    logger.error(f"保存文件失败: {file.filename}, 错误: {str(e)}")
-                    # 清理已保存的文件
-                    for path in file_paths:
-                        if os.path.exists(path):
-                            os.remove(path)
-                    raise HTTPException(status_code=500, detail=f"保存文件失败: {str(e)}")
+            sources = await receive_uploaded_files(files)
+            file_paths = upload_paths(sources)
         
-        # 调用分析函数（现在支持空文件列表和会话ID）
-        try:
-            logger.info(f"开始分析: files={file_paths}, prompt='{prompt}'")
-            analysis_result = run_analysis(file_paths, prompt, session_id)
-            logger.info(f"分析完成: status={analysis_result.get('status', 'unknown')}")
+            # 调用分析函数（现在支持空文件列表和会话ID）
+            try:
+                logger.info(f"开始分析: files={[source.name for source in sources]}, prompt='{prompt}'")
+                # 占用分析名额后异步执行分析流程，LLM等待期间不阻塞事件循环
+                async with analysis_pool.slot() as queue_wait:
+                    analysis_result = await run_analysis_async(file_paths, prompt, session_id, sources=sources,
+                                                                 include_timings=timings)
+                logger.info(f"分析完成: status={analysis_result.get('status', 'unknown')}, 排队等待={queue_wait:.3f}s")
             
-            # 分析完成后清理临时文件
-            for file_path in file_paths:
-                try:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                        logger.info(f"临时文件已清理: {file_path}")
-                except Exception as e:
-                    logger.warning(f"清理临时文件失败 {file_path}: {e}")
+                # 在响应中包含session_id，让前端能够维护会话
+                analysis_result["session_id"] = session_id
+                analysis_result["queue_wait_seconds"] = round(queue_wait, 4)
             
-            # 在响应中包含session_id，让前端能够维护会话
-            analysis_result["session_id"] = session_id
+                return Response(content=dumps_response(analysis_result), media_type="application/json")
             
-            return JSONResponse(content=analysis_result)
+            except PoolFullError as e:
+                raise pool_full_exception(e)
+            except Exception as e:
+                logger.error(f"分析失败: {str(e)}")
+                raise HTTPException(status_code=500, detail=f"分析失败: {str(e)}")
+            finally:
+                # 分析完成或出错后都要清理临时文件
+                cleanup_temp_files(file_paths)
             
+        except HTTPException:
+            raise
         except Exception as e:
-            logger.error(f"分析失败: {str(e)}")
-            # 发生错误时也要清理文件
-            for file_path in file_paths:
-                try:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                except:
-                    pass
-            raise HTTPException(status_code=500, detail=f"分析失败: {str(e)}")
-            
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"服务器内部错误: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
+            logger.error(f"服务器内部错误: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    响应结束后一定执行 on_close 的 StreamingResponse
+    
+    客户端在生成器第一次迭代之前断开、或发送失败时，生成器的 finally 不会执行，BackgroundTask 也会被跳过；
+    分析名额和临时文件要在这里释放。
+    """
+    
+    def __init__(self, content, on_close: Callable[[], Awaitable[None]], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+    
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.on_close()
+
+def format_sse(event: str, data: Dict) -> str:
+    """按 Server-Sent Events 格式编码一个事件"""
+    return f"event: {event}\ndata: {dumps_response(data).decode('utf-8')}\n\n"
+
+@app.post("/analyze/stream")
+async def analyze_files_stream(
+    files: List[UploadFile] = File(default=[]),
+    prompt: str = Form(default="请分析数据"),
+    session_id: str = Form(default=""),
+    timings: bool = Form(default=False)
+):
+    """
+    分析多个上传的文件，并以 Server-Sent Events 流式返回进度和结果
+    
+    参数与 /analyze 相同。事件依次为 queued、session、route、code、rows（结果表分块）、
+    token（回答的增量文本），最后是 done（或 error）；timings 为 true 时 done / error 事件附带各阶段的统计。
+    """
+    logger.info(f"收到流式分析请求: prompt='{prompt}', session_id='{session_id}', files_count={len(files) if files else 0}")
+    
+    if not session_id:
+        session_id = str(uuid.uuid4())
+        logger.info(f"生成新的session_id: {session_id}")
+    
+    sources = await receive_uploaded_files(files)
+    file_paths = upload_paths(sources)
+    
+    # 在开始推流之前占用分析名额，队列已满时仍能返回 503
+    slot = AsyncExitStack()
+    try:
+        queue_wait = await slot.enter_async_context(analysis_pool.slot())
+    except PoolFullError as e:
+        cleanup_temp_files(file_paths)
+        raise pool_full_exception(e)
+    
+    async def event_stream():
+        yield format_sse("queued", {"queue_wait_seconds": round(queue_wait, 4)})
+        async for event in stream_analysis_async(file_paths, prompt, session_id, sources=sources, include_timings=timings):
+            yield format_sse(event["event"], event["data"])
+    
+    stream = event_stream()
+    
+    async def release():
+        try:
+            await stream.aclose()
+        finally:
+            await slot.aclose()
+            cleanup_temp_files(file_paths)
+    
+    return ClosingStreamingResponse(
+        stream,
+        on_close=release,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/results/{result_id}")
+async def get_result_page(
+    result_id: str,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=100, ge=1),
+    sort: str = Query(default="")
+):
+    """
+    分页获取服务端保存的完整结果表
+    
+    Args:
+        result_id: /analyze 响应中的 result_id
+        offset: 起始行
+        limit: 行数，最多 RESULT_PAGE_MAX_LIMIT 行
+        sort: 排序列，逗号分隔，列名前加 "-" 表示降序，例如 "-Sales,Region"
+    """
+    limit = min(limit, RESULT_PAGE_MAX_LIMIT)
+    
+    def load_page():
+        page = result_store.page(result_id, offset, limit, sort)
+        if page is None:
+            return None
+        frame, total_rows = page
+        return records_json(frame), total_rows
+    
+    try:
+        page = await analysis_pool.run_blocking(load_page)
+    except InvalidSortError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page is None:
+        raise HTTPException(status_code=404, detail="结果不存在或已过期，请重新执行分析")
+    
+    data_json, total_rows = page
+    body = {
+        "result_id": result_id,
+        "offset": offset,
+        "limit": limit,
+        "sort": sort,
+        "total_rows": total_rows,
+        "data": RawJSON(data_json),
+    }
+    return Response(content=dumps_response(body), media_type="application/json")
 
 @app.get("/")
 async def root():
@@ -144,7 +309,44 @@ async def root():
 @app.get("/health")
 async def health_check():
     """健康检查端点"""
-    return {"status": "healthy", "temp_dir": TEMP_DIR}
+    return {"status": "healthy", "temp_dir": TEMP_DIR, "analysis_pool": analysis_pool.stats()}
+
+@app.get("/stats")
+async def stats():
+    """运行时计数器（路由决策层级等）"""
+    return {
+        "counters": metrics.snapshot(),
+        "dataset_cache": dataset_store.stats(),
+        "columnar_cache": columnar_cache.stats(),
+        "code_executor": code_executor.stats(),
+        "result_store": result_store.stats(),
+        "session_store": session_checkpointer.stats(),
+        "llm_cache": llm_cache.stats(),
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 文本格式的指标：各阶段耗时直方图、CPU 时间、LLM token 数、缓存命中等计数器，以及各缓存和会话检查点的当前大小"""
+    rss = rss_bytes()
+    if rss is not None:
+        metrics.set_gauge("process_resident_memory_bytes", rss)
+    pool = analysis_pool.stats()
+    metrics.set_gauge("analysis_pool_running_requests", pool["running"])
+    metrics.set_gauge("analysis_pool_queued_requests", pool["queued"])
+    metrics.set_gauge("analysis_pool_busy_threads", pool["busy_threads"])
+    datasets = dataset_store.stats()
+    metrics.set_gauge("dataset_cache_entries", datasets["entries"])
+    metrics.set_gauge("dataset_cache_bytes", datasets["total_bytes"])
+    results = result_store.stats()
+    metrics.set_gauge("result_store_entries", results["entries"])
+    metrics.set_gauge("result_store_bytes", results["total_bytes"])
+    # 检查点存储的统计会查询 SQLite（溢写或共享存储），放到线程池中执行
+    sessions = await run_in_threadpool(session_checkpointer.stats) if session_checkpointer.uses_disk else session_checkpointer.stats()
+    metrics.set_gauge("session_checkpoint_entries", sessions["checkpoints"])
+    metrics.set_gauge("session_checkpoint_bytes", sessions["total_bytes"])
+    if "spilled_sessions" in sessions:
+        metrics.set_gauge("session_spilled_sessions", sessions["spilled_sessions"])
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
 
 @app.get("/test")
 async def test_endpoint():
@@ -0,0 +1,127 @@
+"""
+进程内指标计数
+
+各模块通过 inc() 累加带标签的计数器、observe() 记录直方图样本、set_gauge() 设置瞬时值；
+snapshot() 汇总计数器供 /stats 端点输出，render_prometheus() 输出 Prometheus 文本格式供 /metrics 端点抓取。
+指标只在本进程内统计，多工作进程部署时每个进程各自一份。
+"""
+
+import bisect
+import math
+import threading
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# 直方图默认分桶（秒），覆盖从本地路由的亚毫秒到大文件解析的数十秒
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_lock = threading.Lock()
+_counters: Dict[_Key, float] = defaultdict(float)
+_gauges: Dict[_Key, float] = {}
+# (name, labels) -> [各分桶计数..., +Inf 计数, 样本总和]
+_histograms: Dict[_Key, List[float]] = {}
+_buckets: Dict[str, Tuple[float, ...]] = {}
+
+
+def _key(name: str, labels: Dict[str, str]) -> _Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels: str) -> None:
+    """累加计数器 name{labels}"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] += value
+
+
+def get(name: str, **labels: str) -> float:
+    key = _key(name, labels)
+    with _lock:
+        return _counters.get(key, 0)
+
+
+def set_gauge(name: str, value: float, **labels: str) -> None:
+    """设置瞬时值 name{labels}"""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def observe(name: str, value: float, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels: str) -> None:
+    """向直方图 name{labels} 记录一个样本；同名直方图使用第一次记录时的分桶"""
+    key = _key(name, labels)
+    with _lock:
+        bounds = _buckets.setdefault(name, buckets)
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0.0] * (len(bounds) + 2)
+        histogram[bisect.bisect_left(bounds, value)] += 1
+        histogram[-1] += value
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    """
+    返回所有计数器的当前值
+
+    Returns:
+        {name: {"label1=a,label2=b": value}}，无标签的计数器键为 ""
+    """
+    result: Dict[str, Dict[str, float]] = defaultdict(dict)
+    with _lock:
+        for (name, labels), value in _counters.items():
+            result[name][",".join(f"{k}={v}" for k, v in labels)] = value
+    return dict(result)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    # 整数值（计数器、字节数等）按整数输出，其他值输出可往返的完整精度（:g 格式只保留 6 位有效数字）
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def render_prometheus() -> str:
+    """以 Prometheus 文本格式（0.0.4）输出所有指标"""
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = sorted((key, list(values)) for key, values in _histograms.items())
+        buckets = dict(_buckets)
+
+    lines: List[str] = []
+    typed = set()
+
+    def declare(name: str, kind: str) -> None:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in counters:
+        declare(name, "counter")
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    for (name, labels), value in gauges:
+        declare(name, "gauge")
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    for (name, labels), values in histograms:
+        declare(name, "histogram")
+        cumulative = 0.0
+        for bound, count in zip(buckets[name] + (float("inf"),), values):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {_format_value(cumulative)}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(values[-1])}")
+        lines.append(f"{name}_count{_format_labels(labels)} {_format_value(cumulative)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,57 @@
+"""
+代码执行结果缓存
+
+以 (数据集内容哈希, 归一化后的代码) 为键，重试、重新生成的会话或重复提问时，
+相同代码作用于相同数据可以直接复用之前的结果表而不再执行 pandas。
+缓存键同时用作结果的 result_id，结果表本身保存在 result_store 中（同一份数据既用于分页也用于缓存命中）。
+"""
+
+import ast
+import hashlib
+import json
+import os
+import uuid
+from typing import List, Optional
+
+import pandas as pd
+
+import metrics
+from result_store import ResultStore, result_store
+
+# 是否复用相同代码 + 相同数据的执行结果；关闭后每次执行都会生成新的 result_id
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+def normalize_code(code: str) -> str:
+    """去掉注释和格式差异，语义相同的代码得到相同的文本"""
+    try:
+        return ast.unparse(ast.parse(code))
+    except SyntaxError:
+        return "\n".join(line.rstrip() for line in code.strip().splitlines() if line.strip())
+
+
+def result_cache_key(dataset_hashes: List[str], code: str) -> str:
+    payload = json.dumps({"datasets": dataset_hashes, "code": normalize_code(code)})
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """基于结果存储的执行结果缓存"""
+
+    def __init__(self, store: ResultStore, enabled: bool = RESULT_CACHE_ENABLED):
+        self.store = store
+        self.enabled = enabled
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        if not self.enabled:
+            return None
+        frame = self.store.get(key)
+        metrics.inc("result_cache_requests_total", result="hit" if frame is not None else "miss")
+        return frame
+
+    def result_id(self, key: str) -> str:
+        """新结果使用的 result_id：开启缓存时即缓存键，否则为随机 id"""
+        return key if self.enabled else uuid.uuid4().hex
+
+
+result_cache = ResultCache(result_store)
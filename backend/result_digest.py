@@ -0,0 +1,148 @@
+"""
+分析结果摘要（供总结节点使用）
+
+总结节点不再把结果表的 repr 整个塞进提示词，而是基于完整结果生成一份有 token 预算的摘要：
+形状、列类型、首尾若干行、类别列的 top-k、数值列的 describe() 以及简单的趋势检测。
+摘要超出预算时逐步减少展示的行数、列数和 top-k，最后再按字符截断，保证输入 token 有上界。
+"""
+
+import os
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+# 总结节点输入中结果摘要的 token 预算
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "1500"))
+
+# 与 langchain 的 count_tokens_approximately 一致：约 4 个字符一个 token
+CHARS_PER_TOKEN = 4
+# 单元格展示的最大字符数
+MAX_CELL_CHARS = 40
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _frame_text(df: pd.DataFrame) -> str:
+    return df.to_string(max_colwidth=MAX_CELL_CHARS, show_dimensions=False)
+
+
+def _label_column(df: pd.DataFrame) -> Optional[str]:
+    """第一个非数值列，用来描述极值出现在哪一行"""
+    for col in df.columns:
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            return col
+    return None
+
+
+def _shape_section(df: pd.DataFrame, max_cols: int) -> str:
+    lines = [f"Shape: {len(df)} rows x {df.shape[1]} columns"]
+    dtypes = [f"{col} ({dtype})" for col, dtype in df.dtypes.items()]
+    if len(dtypes) > max_cols:
+        dtypes = dtypes[:max_cols] + [f"... {len(df.columns) - max_cols} more"]
+    lines.append("Columns: " + ", ".join(dtypes))
+    return "\n".join(lines)
+
+
+def _rows_section(df: pd.DataFrame, n_rows: int) -> str:
+    if len(df) <= 2 * n_rows:
+        return "Rows:\n" + _frame_text(df)
+    return (
+        f"First {n_rows} rows:\n{_frame_text(df.head(n_rows))}\n"
+        f"Last {n_rows} rows:\n{_frame_text(df.tail(n_rows))}"
+    )
+
+
+def _describe_section(df: pd.DataFrame) -> str:
+    numeric = df.select_dtypes(include="number")
+    if numeric.empty:
+        return ""
+    # inf 会让均值、标准差失去意义，统计时按缺失值处理
+    stats = numeric.replace([np.inf, -np.inf], np.nan).describe().T[["mean", "std", "min", "50%", "max"]]
+    return "Numeric statistics:\n" + _frame_text(stats.round(4))
+
+
+def _top_k_section(df: pd.DataFrame, top_k: int) -> str:
+    lines = []
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series):
+            continue
+        try:
+            counts = series.value_counts(dropna=True)
+        except TypeError:
+            # 不可哈希的单元格（list / dict 等）
+            continue
+        if counts.empty:
+            continue
+        top = ", ".join(f"{str(value)[:MAX_CELL_CHARS]} ({count})" for value, count in counts.head(top_k).items())
+        lines.append(f"- {col}: {counts.size} distinct; top: {top}")
+    if not lines:
+        return ""
+    return "Top values:\n" + "\n".join(lines)
+
+
+def _trend_section(df: pd.DataFrame) -> str:
+    """数值列的极值位置、单调性以及首尾变化"""
+    label_col = _label_column(df)
+    lines = []
+    for col in df.select_dtypes(include="number").columns:
+        values = df[col].to_numpy(dtype=float, na_value=np.nan)
+        valid = ~np.isnan(values)
+        if valid.sum() < 2:
+            continue
+        series = df[col][valid]
+        parts = []
+        for name, pos in (("max", int(np.nanargmax(values))), ("min", int(np.nanargmin(values)))):
+            where = f"{label_col}={df[label_col].iat[pos]}" if label_col is not None else f"row {pos}"
+            parts.append(f"{name} {values[pos]:.4g} at {where}")
+        if series.is_monotonic_increasing:
+            parts.append("monotonically increasing")
+        elif series.is_monotonic_decreasing:
+            parts.append("monotonically decreasing")
+        first, last = values[valid][0], values[valid][-1]
+        if first != 0 and np.isfinite(first) and np.isfinite(last):
+            parts.append(f"first-to-last change {(last - first) / abs(first):+.1%}")
+        lines.append(f"- {col}: " + "; ".join(parts))
+    if not lines:
+        return ""
+    return "Trends (in row order):\n" + "\n".join(lines)
+
+
+def _build(df: pd.DataFrame, n_rows: int, max_cols: int, top_k: int) -> str:
+    shown = df.iloc[:, :max_cols]
+    sections: List[str] = [
+        _shape_section(df, max_cols),
+        _rows_section(shown, n_rows),
+        _describe_section(shown),
+        _top_k_section(shown, top_k),
+        _trend_section(shown),
+    ]
+    return "\n\n".join(section for section in sections if section)
+
+
+def digest_result(df: pd.DataFrame, token_budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """
+    生成结果表的摘要文本，长度不超过 token_budget（按约 4 字符/token 估算）
+
+    Args:
+        df: 完整的结果表
+        token_budget: 摘要的 token 上限
+    """
+    if df.empty:
+        return f"Shape: 0 rows x {df.shape[1]} columns (the result is empty)"
+
+    n_rows, max_cols, top_k = 5, 20, 5
+    while True:
+        digest = _build(df, n_rows, max_cols, top_k)
+        if estimate_tokens(digest) <= token_budget or (n_rows, max_cols, top_k) == (1, 1, 1):
+            break
+        n_rows, max_cols, top_k = max(1, n_rows // 2), max(1, max_cols // 2), max(1, top_k // 2)
+
+    max_chars = token_budget * CHARS_PER_TOKEN
+    if len(digest) > max_chars:
+        marker = "\n... (digest truncated)"
+        digest = digest[:max(0, max_chars - len(marker))] + marker
+    return digest
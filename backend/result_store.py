@@ -0,0 +1,215 @@
+"""
+服务端结果存储与分页
+
+execute_code 节点产出的完整结果表按 result_id 保存在内存中，/analyze 只内联返回前若干行，
+其余部分由前端通过 /results/{result_id} 按 offset / limit / sort 分页获取。
+存储按字节预算做 LRU 淘汰，并对长时间未访问的结果做 TTL 过期。
+配置 RESULT_STORE_DIR 后结果同时写成 Arrow 文件，内存中没有的结果（已被淘汰，或由另一个 uvicorn 工作进程产生）
+从该目录读回，多个工作进程因此可以共享结果分页和执行结果缓存。
+"""
+
+import logging
+import numbers
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from columnar_cache import ColumnarCache
+from serialization import json_safe_columns
+
+logger = logging.getLogger(__name__)
+
+# 结果存储的总字节预算（默认 512MB）以及空闲过期时间（默认 1 小时）
+RESULT_STORE_MAX_BYTES = int(os.getenv("RESULT_STORE_MAX_BYTES", str(512 * 1024 * 1024)))
+RESULT_STORE_TTL_SECONDS = int(os.getenv("RESULT_STORE_TTL_SECONDS", "3600"))
+# /analyze 响应中内联返回的最大行数，以及单次分页请求的最大行数
+RESULT_INLINE_ROWS = int(os.getenv("RESULT_INLINE_ROWS", "1000"))
+RESULT_PAGE_MAX_LIMIT = int(os.getenv("RESULT_PAGE_MAX_LIMIT", "10000"))
+# 多个工作进程共享结果的目录，为空时结果只保存在进程内存中；以及该目录的字节预算（默认 2GB）
+RESULT_STORE_DIR = os.getenv("RESULT_STORE_DIR", "")
+RESULT_STORE_DIR_MAX_BYTES = int(os.getenv("RESULT_STORE_DIR_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+
+class InvalidSortError(ValueError):
+    """排序参数引用了不存在的列，或排序列无法排序"""
+
+
+@dataclass
+class _Entry:
+    frame: pd.DataFrame
+    nbytes: int
+    last_access: float
+    # 排序键 -> 排序后的行位置，避免翻页时重复排序
+    orders: Dict[str, np.ndarray] = field(default_factory=dict)
+
+
+def parse_sort(sort: str) -> List[Tuple[str, bool]]:
+    """解析 "col1,-col2" 形式的排序参数，返回 [(列名, 是否升序)]"""
+    keys = []
+    for part in sort.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if part.startswith("-"):
+            keys.append((part[1:], False))
+        else:
+            keys.append((part.lstrip("+"), True))
+    return keys
+
+
+def _sort_order(frame: pd.DataFrame, sort_keys: List[Tuple[str, bool]]) -> np.ndarray:
+    """按 sort_keys 排序后的行位置；空值排在最后"""
+    options = dict(
+        by=[col for col, _ in sort_keys],
+        ascending=[asc for _, asc in sort_keys],
+        kind="stable",
+        na_position="last",
+    )
+    try:
+        return frame.sort_values(**options).index.to_numpy()
+    except TypeError:
+        # 混合类型的列（如 dict 结果展平后的 value 列）无法直接比较，改用统一的排序键
+        pass
+    try:
+        return frame.sort_values(key=_mixed_type_key, **options).index.to_numpy()
+    except TypeError as e:
+        raise InvalidSortError(f"Cannot sort by {', '.join(options['by'])}: {e}") from e
+
+
+def _mixed_type_key(column: pd.Series) -> pd.Series:
+    """数值排在前面并按大小比较，其他值按字符串比较，空值保持为空"""
+    if column.dtype != object:
+        return column
+
+    def key(value):
+        if pd.api.types.is_scalar(value) and pd.isna(value):
+            return None
+        if isinstance(value, numbers.Real):
+            return (0, float(value), "")
+        return (1, 0.0, str(value))
+
+    return column.map(key)
+
+
+class ResultStore:
+    """线程安全的结果存储"""
+
+    def __init__(self, max_bytes: int = RESULT_STORE_MAX_BYTES, ttl_seconds: int = RESULT_STORE_TTL_SECONDS,
+                 shared: Optional[ColumnarCache] = None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.shared = shared
+        self._lock = threading.RLock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._total_bytes = 0
+
+    def put(self, result_id: str, frame: pd.DataFrame) -> None:
+        # 统一为 0..n-1 的行索引，分页和排序都按位置进行
+        frame = frame.reset_index(drop=True)
+        if self.shared is not None:
+            self.shared.store(result_id, frame)
+        self._put(result_id, frame)
+
+    def _put(self, result_id: str, frame: pd.DataFrame) -> _Entry:
+        entry = _Entry(frame=frame, nbytes=int(frame.memory_usage(deep=True).sum()), last_access=time.monotonic())
+        with self._lock:
+            if result_id in self._entries:
+                self._remove(result_id)
+            self._entries[result_id] = entry
+            self._total_bytes += entry.nbytes
+            self._purge_expired()
+            # 按 LRU 顺序淘汰，直到回到预算之内；刚写入的结果始终保留
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+                metrics.inc("result_store_evictions_total")
+        return entry
+
+    def get(self, result_id: str) -> Optional[pd.DataFrame]:
+        entry = self._entry(result_id)
+        return entry.frame if entry is not None else None
+
+    def _entry(self, result_id: str) -> Optional[_Entry]:
+        with self._lock:
+            self._purge_expired()
+            entry = self._entries.get(result_id)
+            if entry is not None:
+                self._touch(result_id, entry)
+                return entry
+        if self.shared is None:
+            return None
+        frame = self.shared.load(result_id)
+        if frame is None:
+            return None
+        return self._put(result_id, frame)
+
+    def page(self, result_id: str, offset: int, limit: int, sort: str = "") -> Optional[Tuple[pd.DataFrame, int]]:
+        """
+        取结果的一页
+
+        Returns:
+            (该页的 DataFrame, 总行数)；结果不存在或已过期时返回 None
+
+        Raises:
+            InvalidSortError: 排序列不存在或无法排序
+        """
+        entry = self._entry(result_id)
+        if entry is None:
+            return None
+
+        frame = entry.frame
+        sort_keys = parse_sort(sort)
+        if not sort_keys:
+            return frame.iloc[offset:offset + limit], len(frame)
+
+        # 排序列按客户端看到的列名查找（records_json 会展平多级列名、为重复列名追加序号）
+        named = json_safe_columns(frame)
+        missing = [col for col, _ in sort_keys if col not in named.columns]
+        if missing:
+            raise InvalidSortError(f"Unknown sort column(s): {', '.join(missing)}")
+        sort_id = ",".join(f"{'' if asc else '-'}{col}" for col, asc in sort_keys)
+        order = entry.orders.get(sort_id)
+        if order is None:
+            order = _sort_order(named, sort_keys)
+            with self._lock:
+                if sort_id not in entry.orders:
+                    entry.orders[sort_id] = order
+                    entry.nbytes += order.nbytes
+                    if self._entries.get(result_id) is entry:
+                        self._total_bytes += order.nbytes
+        return frame.iloc[order[offset:offset + limit]], len(frame)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = {
+                "entries": len(self._entries),
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+        if self.shared is not None:
+            stats["shared"] = self.shared.stats()
+        return stats
+
+    def _touch(self, result_id: str, entry: _Entry) -> None:
+        entry.last_access = time.monotonic()
+        self._entries.move_to_end(result_id)
+
+    def _purge_expired(self) -> None:
+        deadline = time.monotonic() - self.ttl_seconds
+        for result_id in [k for k, e in self._entries.items() if e.last_access < deadline]:
+            self._remove(result_id)
+
+    def _remove(self, result_id: str) -> None:
+        entry = self._entries.pop(result_id)
+        self._total_bytes -= entry.nbytes
+
+
+result_store = ResultStore(
+    shared=ColumnarCache(RESULT_STORE_DIR, max_bytes=RESULT_STORE_DIR_MAX_BYTES, enabled=True) if RESULT_STORE_DIR else None
+)
@@ -0,0 +1,98 @@
+"""
+分析结果的形状转换
+
+生成代码可能返回 {类别: DataFrame/Series/标量} 形式的字典，这里把它整体展开为
+(category, metric, value) 三列的长表，全部用向量化操作完成，不再逐单元格构造 Python dict。
+"""
+
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+FLAT_COLUMNS = ["category", "metric", "value"]
+
+
+def _long_part(category: str, metrics: np.ndarray, values: np.ndarray) -> pd.DataFrame:
+    return pd.DataFrame({
+        "category": np.full(len(values), category, dtype=object),
+        "metric": metrics,
+        "value": values,
+    })
+
+
+def flatten_result_dict(result: Dict[Any, Any]) -> pd.DataFrame:
+    """
+    把字典结果展开为 category / metric / value 长表
+
+    - DataFrame：按行优先的顺序展开每个单元格，metric 为列名（行索引被丢弃）
+    - Series：每个元素一行，metric 为索引值
+    - 其它值：一行，metric 为 "value"
+    """
+    parts: List[pd.DataFrame] = []
+    for key, value in result.items():
+        category = str(key)
+        if isinstance(value, pd.DataFrame):
+            n_rows, n_cols = value.shape
+            if n_rows == 0 or n_cols == 0:
+                continue
+            metrics = np.tile(np.array([str(col) for col in value.columns], dtype=object), n_rows)
+            # C 顺序展开即为逐行、逐列的顺序
+            parts.append(_long_part(category, metrics, value.to_numpy().ravel()))
+        elif isinstance(value, pd.Series):
+            if value.empty:
+                continue
+            parts.append(_long_part(category, value.index.map(str).to_numpy(dtype=object), value.to_numpy()))
+        else:
+            parts.append(pd.DataFrame({"category": [category], "metric": ["value"], "value": [value]}))
+
+    if not parts:
+        return pd.DataFrame(columns=FLAT_COLUMNS)
+    return pd.concat(parts, ignore_index=True)
+
+
+class UnsupportedResultError(TypeError):
+    """生成代码返回了无法转换为表格的结果类型"""
+
+
+def normalize_result(result: Any) -> pd.DataFrame:
+    """
+    把生成代码的 result 统一转换为一个 DataFrame
+
+    Raises:
+        UnsupportedResultError: 结果类型无法转换
+    """
+    if isinstance(result, pd.DataFrame):
+        return result
+    if isinstance(result, pd.Series):
+        return result.reset_index()
+    if isinstance(result, dict):
+        # 处理字典类型的结果
+        try:
+            # 把其中的DataFrame/Series/简单值展开为 category / metric / value 长表
+            df = flatten_result_dict(result)
+            if df.empty:
+                # 如果展平失败，尝试直接转换
+                df = pd.DataFrame([{str(k): str(v) for k, v in result.items()}])
+            return df
+        except Exception:
+            # 如果都失败了，创建键值对的表格
+            return pd.DataFrame([{"Key": str(k), "Value": str(v)} for k, v in result.items()])
+    if isinstance(result, (tuple, list)):
+        try:
+            # 尝试创建DataFrame
+            if all(not isinstance(i, (list, tuple, dict)) for i in result):
+                # 简单值列表
+                return pd.DataFrame(result, columns=["value"])
+            # 复杂结构
+            return pd.DataFrame(result)
+        except Exception:
+            # 如果创建DataFrame失败，转换为简单的键值对
+            return pd.DataFrame([{"index": i, "value": str(v)} for i, v in enumerate(result)])
+    if isinstance(result, (int, float, str)):
+        # 处理单个值的情况，无穷大或NaN在序列化时会变成null
+        return pd.DataFrame([{"value": result}])
+    if result is None:
+        # 处理None结果，可能是可视化代码没有返回数据
+        return pd.DataFrame([{"message": "分析完成，结果已通过图表显示"}])
+    raise UnsupportedResultError(str(type(result)))
@@ -0,0 +1,179 @@
+"""
+本地路由分类器
+
+在调用 LLM 判断 "analysis" / "chat" 之前，先依次尝试本地的快速判断：
+1. 会话中没有任何数据集时直接走 chat
+2. 关键词 / 列名命中等启发式规则
+3. （可选）基于历史 LLM 路由日志训练的字符 n-gram 朴素贝叶斯模型
+只有本地判断的置信度都低于阈值时，才回退到 LLM。
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# "local": 先走本地分类，置信度不足时回退 LLM；"llm": 始终调用 LLM；
+# "combined": 同 local，但本地无法判断时不单独调用路由 LLM，而是由一次工具调用请求同时完成路由和回答/生成代码
+ROUTER_MODE = os.getenv("ROUTER_MODE", "local")
+ROUTER_CONFIDENCE_THRESHOLD = float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", "0.75"))
+# LLM 做出的路由决定会追加到该 JSONL 文件，作为 n-gram 模型的训练数据；为空时不记录
+ROUTER_LOG_PATH = os.getenv("ROUTER_LOG_PATH", "")
+ROUTER_NGRAM_MIN_SAMPLES = int(os.getenv("ROUTER_NGRAM_MIN_SAMPLES", "50"))
+
+ROUTES = ("analysis", "chat")
+
+# 只保留明确指向数据分析的词；"数据"、"哪些"、which、top、rows 这类泛用词在闲聊中同样常见，不作为依据
+_ANALYSIS_KEYWORDS_ZH = (
+    "分析", "统计", "平均", "均值", "总和", "求和", "合计", "最大", "最小", "最高", "最低", "排名", "排序",
+    "前十", "前三", "前五", "趋势", "对比", "筛选", "过滤", "分布", "占比", "图表", "画图", "可视化",
+    "相关性", "分组", "汇总", "增长率", "同比", "环比",
+)
+_ANALYSIS_PATTERN_EN = re.compile(
+    r"\b(analy[sz]\w*|average|mean|median|sum|total|count|group by|plot|chart|trends?|filter\w*|"
+    r"max|maximum|min|minimum|highest|lowest|compare|comparison|distribution|correlat\w*|"
+    r"rank\w*|percent\w*|ratio|breakdown)\b",
+    re.IGNORECASE,
+)
+_CHAT_PATTERN = re.compile(
+    r"^\s*((hi|hello|hey|thanks|thank you|good (morning|afternoon|evening)|who are you|bye)\b|"
+    r"你好|您好|嗨|哈喽|谢谢|多谢|早上好|晚上好|你是谁|再见|拜拜)",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class RouteDecision:
+    route: Optional[str]  # None 表示本地无法判断，需要回退到 LLM
+    confidence: float
+    tier: str
+
+
+def _mentions(text: str, term: str) -> bool:
+    """text 中是否以完整单词的形式出现 term（两侧不是字母、数字或下划线），"id" 不会命中 "did"，中文列名照常匹配"""
+    return re.search(rf"(?<![a-z0-9_]){re.escape(term)}(?![a-z0-9_])", text) is not None
+
+
+def _keyword_decision(prompt: str, column_names: Iterable[str]) -> RouteDecision:
+    text = prompt.lower()
+    column_hits = sum(1 for col in column_names if len(col) > 1 and _mentions(text, col.lower()))
+    keyword_hits = sum(1 for kw in _ANALYSIS_KEYWORDS_ZH if kw in text) + len(_ANALYSIS_PATTERN_EN.findall(text))
+    # 只有同时提到数据集中的列和分析操作时才跳过 LLM；只命中关键词或只命中列名（"max and min temperature on Mars"、
+    # "what is your name"）时置信度低于阈值，交给 n-gram 模型或 LLM 判断
+    confident = column_hits > 0 and keyword_hits > 0
+
+    # 先判断寒暄：以问候、致谢开头的消息只有分析依据充分时才交给后续层级判断
+    if _CHAT_PATTERN.match(prompt):
+        if confident:
+            return RouteDecision(None, 0.0, "rules")
+        # 较长的寒暄后面可能跟着真正的问题，降低置信度
+        return RouteDecision("chat", 0.9 if len(prompt) <= 20 and not (column_hits or keyword_hits) else 0.6, "rules")
+    if confident:
+        return RouteDecision("analysis", 0.9, "rules")
+    if column_hits or keyword_hits:
+        return RouteDecision("analysis", 0.6, "rules")
+    return RouteDecision(None, 0.0, "rules")
+
+class NgramRouteModel:
+    """字符 n-gram 朴素贝叶斯分类器，对中英文都适用"""
+
+    def __init__(self, n_values=(2, 3)):
+        self.n_values = n_values
+        self.route_counts: Counter = Counter()
+        self.ngram_counts = {route: Counter() for route in ROUTES}
+        self.vocabulary = set()
+
+    def _ngrams(self, text: str) -> List[str]:
+        text = f" {text.lower().strip()} "
+        return [text[i:i + n] for n in self.n_values for i in range(len(text) - n + 1)]
+
+    def fit(self, samples: Iterable[dict]) -> "NgramRouteModel":
+        for sample in samples:
+            route = sample.get("route")
+            if route not in ROUTES:
+                continue
+            grams = self._ngrams(sample.get("prompt", ""))
+            self.route_counts[route] += 1
+            self.ngram_counts[route].update(grams)
+            self.vocabulary.update(grams)
+        return self
+
+    @property
+    def sample_count(self) -> int:
+        return sum(self.route_counts.values())
+
+    def predict(self, prompt: str) -> RouteDecision:
+        grams = self._ngrams(prompt)
+        total = self.sample_count
+        vocab_size = len(self.vocabulary) + 1
+        log_probs = {}
+        for route in ROUTES:
+            counts = self.ngram_counts[route]
+            denominator = sum(counts.values()) + vocab_size
+            log_prob = math.log((self.route_counts[route] + 1) / (total + len(ROUTES)))
+            log_prob += sum(math.log((counts[g] + 1) / denominator) for g in grams)
+            log_probs[route] = log_prob
+        best = max(log_probs, key=log_probs.get)
+        norm = max(log_probs.values())
+        confidence = math.exp(log_probs[best] - norm) / sum(math.exp(v - norm) for v in log_probs.values())
+        return RouteDecision(best, confidence, "ngram")
+
+
+def _load_ngram_model() -> Optional[NgramRouteModel]:
+    if not ROUTER_LOG_PATH or not os.path.exists(ROUTER_LOG_PATH):
+        return None
+    try:
+        with open(ROUTER_LOG_PATH, encoding="utf-8") as f:
+            model = NgramRouteModel().fit(json.loads(line) for line in f if line.strip())
+    except Exception as e:
+        logger.warning(f"加载路由日志失败，跳过 n-gram 模型: {e}")
+        return None
+    if model.sample_count < ROUTER_NGRAM_MIN_SAMPLES:
+        logger.info(f"路由日志样本不足 ({model.sample_count} < {ROUTER_NGRAM_MIN_SAMPLES})，不启用 n-gram 模型")
+        return None
+    logger.info(f"n-gram 路由模型已加载，样本数: {model.sample_count}")
+    return model
+
+
+_ngram_model = _load_ngram_model()
+_log_lock = threading.Lock()
+
+
+def classify_locally(prompt: str, has_datasets: bool, column_names: Iterable[str] = ()) -> RouteDecision:
+    """按 no_files → rules → ngram 的顺序做本地判断，route 为 None 时调用方应回退到 LLM"""
+    if ROUTER_MODE == "llm":
+        return RouteDecision(None, 0.0, "disabled")
+    if not has_datasets:
+        return RouteDecision("chat", 1.0, "no_files")
+
+    decision = _keyword_decision(prompt, column_names)
+    if decision.route and decision.confidence >= ROUTER_CONFIDENCE_THRESHOLD:
+        return decision
+
+    if _ngram_model is not None:
+        decision = _ngram_model.predict(prompt)
+        if decision.confidence >= ROUTER_CONFIDENCE_THRESHOLD:
+            return decision
+
+    return RouteDecision(None, decision.confidence, "llm")
+
+
+def record_route(prompt: str, route: str, tier: str) -> None:
+    """记录各层级的决策次数；LLM 的决定同时写入路由日志，供之后训练 n-gram 模型"""
+    metrics.inc("router_decisions_total", tier=tier, route=route)
+    if tier not in ("llm", "combined") or not ROUTER_LOG_PATH:
+        return
+    try:
+        with _log_lock, open(ROUTER_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"prompt": prompt, "route": route}, ensure_ascii=False) + "\n")
+    except Exception as e:
+        logger.warning(f"写入路由日志失败: {e}")
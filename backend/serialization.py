@@ -0,0 +1,121 @@
+"""
+分析结果的 JSON 序列化
+
+结果表编码为 records 格式的 JSON 文本（inf/NaN 统一变为 null），不再逐列清理数据：
+各列按 dtype 一次性转换为 Python 对象后由 orjson 编码，浮点数完整保留精度；响应编码时用 orjson 把这段文本原样嵌入。
+"""
+
+import datetime
+import decimal
+from itertools import repeat
+from typing import Any, Dict, List
+
+import numpy as np
+import orjson
+import pandas as pd
+
+
+class RawJSON(str):
+    """已经编码好的 JSON 文本，dumps_response 会原样嵌入而不是当作字符串再编码"""
+
+
+def json_safe_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """records 格式要求列名是唯一的字符串：展平多级列名，重复列名追加序号（即客户端看到的列名）"""
+    columns = ["_".join(map(str, col)) if isinstance(col, tuple) else str(col) for col in df.columns]
+    taken = set(columns)
+    seen: Dict[str, int] = {}
+    for i, col in enumerate(columns):
+        if col in seen:
+            # 跳过已被其他列占用的序号（x、x、x.1 -> x、x.2、x.1）
+            while f"{col}.{seen[col] + 1}" in taken:
+                seen[col] += 1
+            seen[col] += 1
+            columns[i] = f"{col}.{seen[col]}"
+            taken.add(columns[i])
+        else:
+            seen[col] = 0
+    if columns != list(df.columns):
+        df = df.set_axis(columns, axis=1)
+    return df
+
+
+def _pandas_json(df: pd.DataFrame, orient: str) -> str:
+    return df.to_json(orient=orient, date_format="iso", force_ascii=False, default_handler=str)
+
+
+def _iso_datetime(value: datetime.datetime) -> str:
+    # 与 pandas 的 date_format="iso" 一致：毫秒精度，带时区的时间转换为 UTC 并以 Z 结尾
+    if isinstance(value, pd.Timestamp) and value.tzinfo is not None:
+        return value.tz_convert("UTC").strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc)
+        return value.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]
+
+
+def _record_default(obj: Any) -> Any:
+    """object 列中 orjson 不能直接编码的值"""
+    if obj is pd.NaT or obj is pd.NA:
+        return None
+    if isinstance(obj, datetime.datetime):
+        return _iso_datetime(obj)
+    if isinstance(obj, datetime.date):
+        return _iso_datetime(datetime.datetime(obj.year, obj.month, obj.day))
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    return str(obj)
+
+
+def _column_values(column: pd.Series) -> List[Any]:
+    """一列的值，转换为 orjson 能按原样编码的 Python 对象（NaN / inf / 缺失值编码为 null）"""
+    dtype = column.dtype
+    if isinstance(dtype, np.dtype):
+        if dtype.kind in "iub" or dtype == np.float64:
+            return column.to_numpy().tolist()
+        if dtype.kind == "f":
+            # float32 / float16 按其自身的最短表示（0.1 而不是 0.10000000149011612）
+            return column.to_numpy().astype(str).astype(np.float64).tolist()
+        if dtype == object:
+            return column.tolist()
+    elif pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+        # 可空的 Int64 / Float64 / boolean：缺失值为 None，整数仍按整数编码
+        return column.to_numpy(dtype=object, na_value=None).tolist()
+    # 日期、时间差、分类、字符串等由 pandas 编码，格式与之前一致
+    return orjson.loads(_pandas_json(column, "values"))
+
+
+def records_json(df: pd.DataFrame) -> str:
+    """
+    把 DataFrame 编码为 records 格式的 JSON 文本
+
+    pandas 的编码器最多保留约 15 位有效数字（默认 10 位，1e-12 会变成 0.0），含浮点数或 object 列时
+    按列转换为 Python 对象后由 orjson 编码（浮点数为可往返的最短表示）；只有整数、布尔、日期等列时仍由 pandas 一次编码。
+    与 pandas 输出的一致性和耗时对比见 benchmarks/bench_serialization.py。
+    """
+    df = json_safe_columns(df)
+    if not any(dtype.kind in "fO" for dtype in df.dtypes):
+        return _pandas_json(df, "records")
+
+    names = list(df.columns)
+    columns = [_column_values(df.iloc[:, position]) for position in range(df.shape[1])]
+    records = list(map(dict, map(zip, repeat(names), zip(*columns))))
+    return orjson.dumps(
+        records,
+        default=_record_default,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+    ).decode("utf-8")
+
+
+def result_frame(data_json: str) -> pd.DataFrame:
+    """把 records JSON 文本还原为 DataFrame"""
+    return pd.DataFrame(orjson.loads(data_json))
+
+
+def _default(obj: Any) -> Any:
+    return str(obj)
+
+
+def dumps_response(payload: Dict[str, Any]) -> bytes:
+    """用 orjson 编码响应体，RawJSON 字段直接嵌入，numpy 标量/数组按原生类型编码"""
+    payload = {k: orjson.Fragment(str.__str__(v)) if isinstance(v, RawJSON) else v for k, v in payload.items()}
+    return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
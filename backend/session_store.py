@@ -0,0 +1,604 @@
+"""
+会话检查点存储
+
+替代 LangGraph 的 MemorySaver（每个会话的每个检查点都永久留在进程内存中）：
+- 每个会话只保留最近 SESSION_MAX_CHECKPOINTS 个检查点（默认只保留最新的一个）；
+- 内存中的会话数和序列化后的总字节数都有上限，超出时按 LRU 淘汰；空闲超过 SESSION_IDLE_TTL_SECONDS 的会话同样被淘汰；
+- SESSION_STORE=sqlite 时被淘汰的会话不丢弃，而是写入磁盘上的 SQLite，下次访问时再读回内存；
+- SESSION_STORE=shared 时检查点直接保存在 WAL 模式的 SQLite 中，同一台机器上的多个 uvicorn 工作进程共享会话；
+- 检查点以序列化后的字节保存，stats() 中的 total_bytes 即为实际占用的内存。
+"""
+
+import asyncio
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Iterator, Sequence
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.serde.types import TASKS
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")  # memory | sqlite | shared
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+# 内存中全部检查点序列化后的字节预算（默认 256MB）
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+SESSION_MAX_CHECKPOINTS = int(os.getenv("SESSION_MAX_CHECKPOINTS", "1"))
+SESSION_IDLE_TTL_SECONDS = int(os.getenv("SESSION_IDLE_TTL_SECONDS", "3600"))
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "sessions.sqlite3")
+# 磁盘上（溢写或共享存储中）的会话保留多久（默认 7 天）
+SESSION_SPILL_TTL_SECONDS = int(os.getenv("SESSION_SPILL_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# 序列化后的值：(类型, 字节)
+Typed = Tuple[str, bytes]
+
+
+@dataclass
+class _Saved:
+    """一个检查点及其挂起的写入，全部为序列化后的形式"""
+    checkpoint: Typed
+    metadata: Typed
+    parent_id: Optional[str]
+    # (task_id, 写入下标) -> (task_id, 通道, 值, task_path)
+    writes: Dict[Tuple[str, int], Tuple[str, str, Typed, str]] = field(default_factory=dict)
+
+    def nbytes(self) -> int:
+        return (len(self.checkpoint[1]) + len(self.metadata[1])
+                + sum(len(w[2][1]) for w in self.writes.values()))
+
+
+@dataclass
+class _Session:
+    # checkpoint_ns -> {checkpoint_id: _Saved}，检查点 id 按时间递增，按插入顺序即新旧顺序
+    namespaces: Dict[str, "OrderedDict[str, _Saved]"] = field(default_factory=dict)
+    last_access: float = 0.0
+    nbytes: int = 0
+
+    def recount(self) -> None:
+        self.nbytes = sum(saved.nbytes() for checkpoints in self.namespaces.values() for saved in checkpoints.values())
+
+
+class SQLiteSpill:
+    """被淘汰会话的磁盘存储，每个会话一行"""
+
+    def __init__(self, path: str = SESSION_SQLITE_PATH, ttl_seconds: int = SESSION_SPILL_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (thread_id TEXT PRIMARY KEY, data BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def save(self, thread_id: str, session: _Session) -> None:
+        data = pickle.dumps(session.namespaces, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (thread_id, data, last_access) VALUES (?, ?, ?)",
+                (thread_id, data, time.time()),
+            )
+            self._conn.execute("DELETE FROM sessions WHERE last_access < ?", (time.time() - self.ttl_seconds,))
+            self._conn.commit()
+
+    def take(self, thread_id: str) -> Optional[_Session]:
+        """取出并删除某个会话（读回内存后以内存中的为准）"""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM sessions WHERE thread_id = ?", (thread_id,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("DELETE FROM sessions WHERE thread_id = ?", (thread_id,))
+            self._conn.commit()
+        session = _Session(namespaces=pickle.loads(row[0]))
+        session.recount()
+        return session
+
+    def delete(self, thread_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE thread_id = ?", (thread_id,))
+            self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class _SerializedCheckpointSaver(BaseCheckpointSaver):
+    """
+    以序列化形式（_Saved）保存检查点的存储的公共部分
+
+    异步接口调用同步实现：只读写内存时直接在事件循环中调用；会访问 SQLite 时（uses_disk）放到线程中执行，
+    等待其它工作进程的写锁（最长 30 秒）时不会阻塞同一进程中的其它请求。
+    """
+
+    uses_disk = False
+
+    async def _call(self, fn, *args, **kwargs):
+        if self.uses_disk:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    def _serialize(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata) -> _Saved:
+        c = checkpoint.copy()
+        c.pop("pending_sends", None)
+        # 检查点中带有全部通道的当前值，整体序列化（msgpack）即可，不需要按通道版本分别保存
+        return _Saved(
+            checkpoint=self.serde.dumps_typed(c),
+            metadata=self.serde.dumps_typed(get_checkpoint_metadata(config, metadata)),
+            parent_id=config["configurable"].get("checkpoint_id"),
+        )
+
+    def _to_tuple(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str, saved: _Saved,
+                  parent: Optional[_Saved]) -> CheckpointTuple:
+        # 父检查点仍保留时，其中发往 TASKS 通道的写入是本检查点待处理的 Send
+        sends = sorted(
+            ((*w, k[1]) for k, w in parent.writes.items() if w[1] == TASKS),
+            key=lambda w: (w[3], w[0], w[4]),
+        ) if parent is not None else []
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint={
+                **self.serde.loads_typed(saved.checkpoint),
+                "pending_sends": [self.serde.loads_typed(s[2]) for s in sends],
+            },
+            metadata=self.serde.loads_typed(saved.metadata),
+            pending_writes=[(task_id, channel, self.serde.loads_typed(value))
+                            for task_id, channel, value, _ in saved.writes.values()],
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": saved.parent_id,
+                    }
+                }
+                if saved.parent_id
+                else None
+            ),
+        )
+
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await self._call(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        tuples = await self._call(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for checkpoint_tuple in tuples:
+            yield checkpoint_tuple
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await self._call(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        await self._call(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await self._call(self.delete_thread, thread_id)
+
+
+def _filter_tuples(tuples: List[CheckpointTuple], filter: Optional[Dict[str, Any]],
+                   limit: Optional[int]) -> Iterator[CheckpointTuple]:
+    for checkpoint_tuple in tuples:
+        if filter and not all(checkpoint_tuple.metadata.get(k) == v for k, v in filter.items()):
+            continue
+        if limit is not None:
+            if limit <= 0:
+                break
+            limit -= 1
+        yield checkpoint_tuple
+
+
+class BoundedCheckpointSaver(_SerializedCheckpointSaver):
+    """
+    内存中有上限的 LangGraph 检查点存储
+
+    只保留每个会话最近的 max_checkpoints 个检查点；会话数、总字节数和空闲时间超限时按 LRU 淘汰，
+    配置了 spill 时淘汰的会话写入 SQLite 而不是丢弃。
+    """
+
+    def __init__(self, max_sessions: int = SESSION_MAX_SESSIONS, max_bytes: int = SESSION_MAX_BYTES,
+                 max_checkpoints: int = SESSION_MAX_CHECKPOINTS, ttl_seconds: int = SESSION_IDLE_TTL_SECONDS,
+                 spill: Optional[SQLiteSpill] = None):
+        super().__init__()
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.max_checkpoints = max(1, max_checkpoints)
+        self.ttl_seconds = ttl_seconds
+        self.spill = spill
+        # 淘汰和读回会话时读写溢写用的 SQLite
+        self.uses_disk = spill is not None
+        self._lock = threading.RLock()
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._total_bytes = 0
+
+    # --- LangGraph 检查点接口 -------------------------------------------------
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with self._lock:
+            session = self._get_session(thread_id)
+            checkpoints = session.namespaces.get(checkpoint_ns) if session else None
+            if not checkpoints:
+                return None
+            checkpoint_id = get_checkpoint_id(config) or next(reversed(checkpoints))
+            saved = checkpoints.get(checkpoint_id)
+            if saved is None:
+                return None
+            parent = checkpoints.get(saved.parent_id) if saved.parent_id else None
+            return self._to_tuple(thread_id, checkpoint_ns, checkpoint_id, saved, parent)
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        with self._lock:
+            if config:
+                session = self._get_session(config["configurable"]["thread_id"])
+                sessions = [(config["configurable"]["thread_id"], session)] if session else []
+            else:
+                sessions = list(self._sessions.items())
+            tuples = []
+            for thread_id, session in sessions:
+                for checkpoint_ns, checkpoints in session.namespaces.items():
+                    if config and config["configurable"].get("checkpoint_ns", checkpoint_ns) != checkpoint_ns:
+                        continue
+                    for checkpoint_id, saved in reversed(checkpoints.items()):
+                        if config and get_checkpoint_id(config) and checkpoint_id != get_checkpoint_id(config):
+                            continue
+                        if before and get_checkpoint_id(before) and checkpoint_id >= get_checkpoint_id(before):
+                            continue
+                        parent = checkpoints.get(saved.parent_id) if saved.parent_id else None
+                        tuples.append(self._to_tuple(thread_id, checkpoint_ns, checkpoint_id, saved, parent))
+        yield from _filter_tuples(tuples, filter, limit)
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        saved = self._serialize(config, checkpoint, metadata)
+        with self._lock:
+            session = self._get_session(thread_id) or _Session()
+            checkpoints = session.namespaces.setdefault(checkpoint_ns, OrderedDict())
+            checkpoints[checkpoint["id"]] = saved
+            # 只保留最近的若干个检查点（挂起的写入跟随各自的检查点一起丢弃）
+            while len(checkpoints) > self.max_checkpoints:
+                checkpoints.popitem(last=False)
+            self._store(thread_id, session)
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        with self._lock:
+            session = self._get_session(thread_id)
+            saved = session.namespaces.get(checkpoint_ns, {}).get(checkpoint_id) if session else None
+            if saved is None:
+                # 检查点已被淘汰，这些写入不再有意义
+                return
+            for idx, (channel, value) in enumerate(writes):
+                key = (task_id, WRITES_IDX_MAP.get(channel, idx))
+                if key[1] >= 0 and key in saved.writes:
+                    continue
+                saved.writes[key] = (task_id, channel, self.serde.dumps_typed(value), task_path)
+            self._store(thread_id, session)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._remove(thread_id)
+        if self.spill is not None:
+            self.spill.delete(thread_id)
+
+    # --- 容量管理 ------------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._purge_expired()
+            stats = {
+                "backend": "sqlite" if self.spill is not None else "memory",
+                "sessions": len(self._sessions),
+                "checkpoints": sum(len(c) for s in self._sessions.values() for c in s.namespaces.values()),
+                "total_bytes": self._total_bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+            }
+        if self.spill is not None:
+            stats["spilled_sessions"] = self.spill.count()
+        return stats
+
+    def _get_session(self, thread_id: str) -> Optional[_Session]:
+        """取出会话并标记为最近使用；内存中没有时尝试从磁盘读回"""
+        self._purge_expired()
+        session = self._sessions.get(thread_id)
+        if session is None and self.spill is not None:
+            session = self.spill.take(thread_id)
+            if session is not None:
+                metrics.inc("session_store_restores_total")
+                self._store(thread_id, session)
+        if session is not None:
+            session.last_access = time.monotonic()
+            self._sessions.move_to_end(thread_id)
+        return session
+
+    def _store(self, thread_id: str, session: _Session) -> None:
+        """(重新)计入会话的字节数，放到 LRU 末尾，并淘汰超出上限的会话；刚写入的会话始终保留"""
+        self._remove(thread_id)
+        session.recount()
+        session.last_access = time.monotonic()
+        self._sessions[thread_id] = session
+        self._total_bytes += session.nbytes
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or self._total_bytes > self.max_bytes):
+            self._evict(next(iter(self._sessions)), reason="capacity")
+
+    def _purge_expired(self) -> None:
+        deadline = time.monotonic() - self.ttl_seconds
+        while self._sessions:
+            thread_id, session = next(iter(self._sessions.items()))
+            if session.last_access >= deadline:
+                break
+            self._evict(thread_id, reason="idle")
+
+    def _evict(self, thread_id: str, reason: str) -> None:
+        session = self._remove(thread_id)
+        if session is None:
+            return
+        if self.spill is not None:
+            self.spill.save(thread_id, session)
+        action = "spill" if self.spill is not None else "drop"
+        metrics.inc("session_store_evictions_total", reason=reason, action=action)
+        logger.info(f"会话检查点被淘汰: session={thread_id}, reason={reason}, action={action}, bytes={session.nbytes}")
+
+    def _remove(self, thread_id: str) -> Optional[_Session]:
+        session = self._sessions.pop(thread_id, None)
+        if session is not None:
+            self._total_bytes -= session.nbytes
+        return session
+
+
+class SharedSQLiteCheckpointSaver(_SerializedCheckpointSaver):
+    """
+    多个工作进程共享的 SQLite（WAL 模式）检查点存储
+
+    检查点直接读写数据库，不在进程内缓存，因此同一会话的相邻请求可以落在不同的 uvicorn 工作进程上。
+    每个会话只保留最近的 max_checkpoints 个检查点，超过 ttl_seconds 没有更新的会话被定期删除。
+    """
+
+    _PURGE_INTERVAL_SECONDS = 60
+    uses_disk = True
+
+    def __init__(self, path: str = SESSION_SQLITE_PATH, max_checkpoints: int = SESSION_MAX_CHECKPOINTS,
+                 ttl_seconds: int = SESSION_SPILL_TTL_SECONDS):
+        super().__init__()
+        self.path = path
+        self.max_checkpoints = max(1, max_checkpoints)
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        # isolation_level=None：由下面的 BEGIN IMMEDIATE 显式控制事务；timeout 为等待其它进程写锁的时间
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, parent_id TEXT, "
+            "checkpoint_type TEXT NOT NULL, checkpoint BLOB NOT NULL, metadata_type TEXT NOT NULL, metadata BLOB NOT NULL, "
+            "updated_at REAL NOT NULL, PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoint_writes ("
+            "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, task_id TEXT NOT NULL, "
+            "idx INTEGER NOT NULL, channel TEXT NOT NULL, value_type TEXT NOT NULL, value BLOB NOT NULL, task_path TEXT NOT NULL, "
+            "PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx))"
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        query = ("SELECT checkpoint_id, parent_id, checkpoint_type, checkpoint, metadata_type, metadata "
+                 "FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?")
+        params: Tuple = (thread_id, checkpoint_ns)
+        if checkpoint_id:
+            query += " AND checkpoint_id = ?"
+            params += (checkpoint_id,)
+        query += " ORDER BY checkpoint_id DESC LIMIT 1"
+        with self._lock:
+            row = self._conn.execute(query, params).fetchone()
+            if row is None:
+                return None
+            saved, parent = self._load_saved(thread_id, checkpoint_ns, row)
+        return self._to_tuple(thread_id, checkpoint_ns, row[0], saved, parent)
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        query = ("SELECT checkpoint_id, parent_id, checkpoint_type, checkpoint, metadata_type, metadata, thread_id, checkpoint_ns "
+                 "FROM checkpoints WHERE 1 = 1")
+        params: Tuple = ()
+        if config:
+            query += " AND thread_id = ?"
+            params += (config["configurable"]["thread_id"],)
+            if "checkpoint_ns" in config["configurable"]:
+                query += " AND checkpoint_ns = ?"
+                params += (config["configurable"]["checkpoint_ns"],)
+            if get_checkpoint_id(config):
+                query += " AND checkpoint_id = ?"
+                params += (get_checkpoint_id(config),)
+        if before and get_checkpoint_id(before):
+            query += " AND checkpoint_id < ?"
+            params += (get_checkpoint_id(before),)
+        query += " ORDER BY thread_id, checkpoint_ns, checkpoint_id DESC"
+        tuples = []
+        with self._lock:
+            for row in self._conn.execute(query, params).fetchall():
+                saved, parent = self._load_saved(row[6], row[7], row)
+                tuples.append(self._to_tuple(row[6], row[7], row[0], saved, parent))
+        yield from _filter_tuples(tuples, filter, limit)
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        saved = self._serialize(config, checkpoint, metadata)
+        now = time.time()
+        with self._lock, self._transaction():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_id, checkpoint_type, "
+                "checkpoint, metadata_type, metadata, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], saved.parent_id, *saved.checkpoint, *saved.metadata, now),
+            )
+            # 只保留最近的若干个检查点，挂起的写入跟随各自的检查点一起删除
+            self._conn.execute(
+                "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN ("
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                "ORDER BY checkpoint_id DESC LIMIT ?)",
+                (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.max_checkpoints),
+            )
+            self._conn.execute(
+                "DELETE FROM checkpoint_writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN ("
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?)",
+                (thread_id, checkpoint_ns, thread_id, checkpoint_ns),
+            )
+            if now - self._last_purge > self._PURGE_INTERVAL_SECONDS:
+                self._last_purge = now
+                self._purge_expired(now)
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            idx = WRITES_IDX_MAP.get(channel, idx)
+            rows.append((idx >= 0, (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel,
+                                    *self.serde.dumps_typed(value), task_path)))
+        with self._lock, self._transaction():
+            for keep_existing, row in rows:
+                # 与 MemorySaver 一致：普通写入不覆盖已有的同一条写入，特殊通道（下标为负）的写入总是覆盖
+                self._conn.execute(
+                    f"INSERT OR {'IGNORE' if keep_existing else 'REPLACE'} INTO checkpoint_writes (thread_id, checkpoint_ns, "
+                    "checkpoint_id, task_id, idx, channel, value_type, value, task_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    row,
+                )
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock, self._transaction():
+            self._conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            self._conn.execute("DELETE FROM checkpoint_writes WHERE thread_id = ?", (thread_id,))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions, checkpoints = self._conn.execute(
+                "SELECT COUNT(DISTINCT thread_id), COUNT(*) FROM checkpoints"
+            ).fetchone()
+        total_bytes = 0
+        for suffix in ("", "-wal"):
+            try:
+                total_bytes += os.path.getsize(self.path + suffix)
+            except OSError:
+                pass
+        return {
+            "backend": "shared",
+            "path": self.path,
+            "sessions": sessions,
+            "checkpoints": checkpoints,
+            "total_bytes": total_bytes,
+        }
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # BEGIN IMMEDIATE 一开始就拿到写锁，多个进程并发写时排队等待，而不是在提交时失败
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _load_saved(self, thread_id: str, checkpoint_ns: str, row: Tuple) -> Tuple[_Saved, Optional[_Saved]]:
+        """由检查点行构造 (_Saved, 父检查点)；父检查点只带 TASKS 通道的写入，且只在仍然保留时返回"""
+        checkpoint_id, parent_id = row[0], row[1]
+        saved = _Saved(checkpoint=(row[2], row[3]), metadata=(row[4], row[5]), parent_id=parent_id,
+                       writes=self._load_writes(thread_id, checkpoint_ns, checkpoint_id))
+        parent = None
+        if parent_id:
+            writes = self._load_writes(thread_id, checkpoint_ns, parent_id, channel=TASKS)
+            if writes:
+                parent = _Saved(checkpoint=("empty", b""), metadata=("empty", b""), parent_id=None, writes=writes)
+        return saved, parent
+
+    def _load_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str,
+                     channel: Optional[str] = None) -> Dict[Tuple[str, int], Tuple[str, str, Typed, str]]:
+        query = ("SELECT task_id, idx, channel, value_type, value, task_path FROM checkpoint_writes "
+                 "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?")
+        params: Tuple = (thread_id, checkpoint_ns, checkpoint_id)
+        if channel is not None:
+            query += " AND channel = ?"
+            params += (channel,)
+        rows = self._conn.execute(query + " ORDER BY task_id, idx", params).fetchall()
+        return {(task_id, idx): (task_id, ch, (value_type, value), task_path)
+                for task_id, idx, ch, value_type, value, task_path in rows}
+
+    def _purge_expired(self, now: float) -> None:
+        expired = ("SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING MAX(updated_at) < ?")
+        deadline = now - self.ttl_seconds
+        self._conn.execute(f"DELETE FROM checkpoint_writes WHERE thread_id IN ({expired})", (deadline,))
+        deleted = self._conn.execute(f"DELETE FROM checkpoints WHERE thread_id IN ({expired})", (deadline,)).rowcount
+        if deleted:
+            metrics.inc("session_store_evictions_total", deleted, reason="idle", action="drop")
+
+
+def create_checkpointer(backend: str = SESSION_STORE) -> BaseCheckpointSaver:
+    if backend == "shared":
+        return SharedSQLiteCheckpointSaver()
+    if backend == "sqlite":
+        return BoundedCheckpointSaver(spill=SQLiteSpill())
+    if backend != "memory":
+        logger.warning(f"未知的 SESSION_STORE: {backend}，使用内存存储")
+    return BoundedCheckpointSaver()
+
+
+session_checkpointer = create_checkpointer()
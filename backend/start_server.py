@@ -5,7 +5,9 @@
 
 import uvicorn
 import os
-from main import app
+
+# 工作进程数（与 uvicorn 一致使用 WEB_CONCURRENCY）；多于一个时会话需要保存在共享存储中
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
 
 def start_server():
     """启动FastAPI服务器"""
@@ -18,6 +20,17 @@ def start_server():
     # 确保必要的目录存在
     os.makedirs("temp_file", exist_ok=True)
     
+    if WORKERS > 1:
+        if os.getenv("SESSION_STORE") != "shared":
+            print("⚠️ 多个工作进程需要设置 SESSION_STORE=shared，否则同一会话的请求落在不同进程上时会丢失历史")
+        if not os.getenv("RESULT_STORE_DIR"):
+            print("⚠️ 多个工作进程建议设置 RESULT_STORE_DIR，否则结果分页只能在产生结果的进程上访问")
+        # 多进程模式需要以导入字符串的形式传入应用，每个工作进程各自导入
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WORKERS, log_level="info")
+        return
+    
+    from main import app
+    
     # 启动服务器
     uvicorn.run(
         app,
@@ -0,0 +1,176 @@
+"""
+上传文件的流式接收
+
+- 请求体大小在接收阶段就受限：Content-Length 超限的请求直接返回 413，未声明长度的请求边接收边计数；
+- 每个上传文件按块写入临时目录，写入的同时计算内容哈希并检查单文件大小上限，
+  之后数据集缓存直接使用这个哈希（不再重新读一遍文件），内存或列式缓存命中时根本不会再打开该文件；
+- 可选地把 CSV 直接从上传流中增量解析（UPLOAD_STREAM_PARSE_CSV），不落临时文件。
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import uuid
+from typing import BinaryIO, Optional
+
+import pandas as pd
+
+from dataset_store import DatasetSource, is_large_file, LARGE_FILE_MODE, LARGE_FILE_THRESHOLD_BYTES
+from instrumentation import measure
+
+logger = logging.getLogger(__name__)
+
+# 单个文件和单个请求体的字节上限（默认 200MB / 500MB）
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", str(200 * 1024 * 1024)))
+UPLOAD_MAX_REQUEST_BYTES = int(os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(500 * 1024 * 1024)))
+# 是否在接收 CSV 的同时直接解析为 DataFrame（不写临时文件；内容已缓存时这次解析是多余的）
+UPLOAD_STREAM_PARSE_CSV = os.getenv("UPLOAD_STREAM_PARSE_CSV", "false").lower() in ("1", "true", "yes")
+
+_CHUNK_SIZE = 1024 * 1024
+
+if LARGE_FILE_MODE and LARGE_FILE_THRESHOLD_BYTES >= UPLOAD_MAX_FILE_BYTES:
+    logger.warning(
+        f"LARGE_FILE_THRESHOLD_BYTES ({LARGE_FILE_THRESHOLD_BYTES}) 不小于 UPLOAD_MAX_FILE_BYTES ({UPLOAD_MAX_FILE_BYTES})，"
+        f"超过上传上限的文件会被拒绝，out-of-core 模式不会生效"
+    )
+
+
+class UploadTooLargeError(Exception):
+    """上传的文件或请求体超过大小上限"""
+
+
+class _HashingReader(io.RawIOBase):
+    """包装上传流：读出的每个字节都计入哈希和大小，超过上限时抛出 UploadTooLargeError"""
+
+    def __init__(self, source: BinaryIO, name: str, max_bytes: int):
+        self.source = source
+        self.name = name
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._digest = hashlib.sha256()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.source.read(len(buffer))
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadTooLargeError(f"文件 {self.name} 超过大小上限 {self.max_bytes} 字节")
+        self._digest.update(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+
+def receive_upload(source: BinaryIO, name: str, ext: str, temp_dir: str, size: Optional[int] = None,
+                   max_bytes: int = UPLOAD_MAX_FILE_BYTES) -> DatasetSource:
+    """
+    接收一个上传文件（阻塞操作，应在线程池中调用）
+
+    Args:
+        source: 上传文件的二进制流
+        name: 原始文件名
+        ext: 小写扩展名（csv / xlsx / xls）
+        temp_dir: 临时文件目录
+        size: 客户端声明的文件大小（可选）；超大 CSV 不做流式解析，留给 out-of-core 模式处理
+
+    Returns:
+        带有内容哈希的 DatasetSource；流式解析 CSV 时 frame 已填好且没有临时文件
+
+    Raises:
+        UploadTooLargeError: 文件超过 max_bytes
+    """
+    reader = _HashingReader(source, name, max_bytes)
+
+    if ext == "csv" and UPLOAD_STREAM_PARSE_CSV and not (size is not None and is_large_file(name, size)):
+        # pandas 的 C 解析器按块从流中读取，读取的同时完成哈希
+        with measure("upload_parse", kind="load", dataset=name):
+            frame = pd.read_csv(io.BufferedReader(reader, _CHUNK_SIZE))
+        # 解析器可能没有读到流的末尾（例如末尾的空行），把剩余字节也计入哈希
+        while reader.read(_CHUNK_SIZE):
+            pass
+        logger.info(f"上传文件已流式解析: {name}, {reader.size} 字节, hash={reader.hexdigest()[:12]}")
+        return DatasetSource(name=name, content_hash=reader.hexdigest(), frame=frame)
+
+    file_path = os.path.join(temp_dir, f"{uuid.uuid4().hex}.{ext}")
+    try:
+        with open(file_path, "wb") as out:
+            for chunk in iter(lambda: reader.read(_CHUNK_SIZE), b""):
+                out.write(chunk)
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    logger.info(f"文件保存成功: {name} -> {file_path}, {reader.size} 字节, hash={reader.hexdigest()[:12]}")
+    return DatasetSource(name=name, path=file_path, content_hash=reader.hexdigest())
+
+
+class UploadSizeLimitMiddleware:
+    """
+    限制上传接口请求体大小的 ASGI 中间件
+
+    声明了 Content-Length 的请求在读取请求体之前就被拒绝；未声明长度（分块传输）的请求在
+    接收到的字节数超限后停止读取，并把应用返回的响应替换为 413。
+    """
+
+    def __init__(self, app, max_bytes: int = UPLOAD_MAX_REQUEST_BYTES, path_prefix: str = "/analyze"):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            logger.warning(f"请求体过大，已拒绝: Content-Length={int(content_length)}, 上限={self.max_bytes}")
+            await self._reject(send)
+            return
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    logger.warning(f"请求体超过上限，停止接收: 已接收 {received} 字节, 上限={self.max_bytes}")
+                    return {"type": "http.disconnect"}
+            return message
+
+        response_started = False
+
+        async def limited_send(message):
+            nonlocal response_started
+            if exceeded:
+                # 应用在请求体被截断后给出的响应（解析失败等）一律替换为 413
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await self._reject(send)
+                return
+            response_started = response_started or message["type"] == "http.response.start"
+            await send(message)
+
+        await self.app(scope, limited_receive, limited_send)
+
+    async def _reject(self, send) -> None:
+        body = json.dumps({"detail": f"请求体超过大小上限 {self.max_bytes} 字节"}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
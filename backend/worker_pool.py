@@ -0,0 +1,97 @@
+"""
+分析任务的有界工作池
+
+- 准入控制：限制同时进行中的分析请求数和排队深度，队列已满时直接拒绝新请求，而不是无限堆积
+- 阻塞任务：同步的 LLM 调用、pandas 解析、exec 执行等放到线程池中运行，避免阻塞事件循环
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# 执行阻塞任务的线程数、同时进行中的分析请求数，以及允许排队等待的请求数
+ANALYSIS_MAX_WORKERS = int(os.getenv("ANALYSIS_MAX_WORKERS", "4"))
+ANALYSIS_MAX_CONCURRENCY = int(os.getenv("ANALYSIS_MAX_CONCURRENCY", "64"))
+ANALYSIS_MAX_QUEUE = int(os.getenv("ANALYSIS_MAX_QUEUE", "16"))
+
+
+class PoolFullError(Exception):
+    """进行中的请求和等待队列都已占满"""
+
+
+class AnalysisWorkerPool:
+    """带排队深度限制的分析工作池"""
+
+    def __init__(self, max_workers: int = ANALYSIS_MAX_WORKERS, max_queue: int = ANALYSIS_MAX_QUEUE,
+                 max_concurrency: int = ANALYSIS_MAX_CONCURRENCY):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # 以下计数只在事件循环线程中修改
+        self._active = 0
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self._busy_threads = 0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[float]:
+        """
+        占用一个分析名额，产出排队等待的秒数
+
+        Raises:
+            PoolFullError: 名额已满且排队数已达上限
+        """
+        if self._semaphore.locked() and self._waiting >= self.max_queue:
+            raise PoolFullError(f"analysis pool is full ({self._active} active, {self._waiting} queued)")
+        requested_at = time.perf_counter()
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        self._active += 1
+        try:
+            yield time.perf_counter() - requested_at
+        finally:
+            self._active -= 1
+            self._semaphore.release()
+
+    async def run_blocking(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """在线程池中执行阻塞函数 fn(*args)；fn 在调用方上下文变量（如请求的阶段统计）的副本中运行"""
+        context = contextvars.copy_context()
+
+        def task():
+            with self._lock:
+                self._busy_threads += 1
+            try:
+                return context.run(fn, *args)
+            finally:
+                with self._lock:
+                    self._busy_threads -= 1
+
+        return await asyncio.wrap_future(self._executor.submit(task))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            busy_threads = self._busy_threads
+        return {
+            "max_workers": self.max_workers,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "running": self._active,
+            "queued": self._waiting,
+            "busy_threads": busy_threads,
+        }
+
+
+analysis_pool = AnalysisWorkerPool()